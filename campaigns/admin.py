@@ -1,11 +1,24 @@
+import json
+
+from django.conf import settings
 from django.contrib import admin
 from django.utils.html import format_html
 from django.urls import path
-from django.shortcuts import render, redirect
+from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib import messages
-from .models import Campaign, Recipient, DeliveryLog
-from .forms import CampaignForm, RecipientUploadForm, RecipientForm
-from .importer_v2 import RecipientImporterParallel
+from django.db import transaction
+from django.db.models import Count, Q
+from django.core.exceptions import ValidationError
+from django.http import JsonResponse
+from django.urls import reverse
+from django.utils import timezone
+from .models import Campaign, Recipient, DeliveryLog, Suppression, ImportJob, Segment
+from .segments import refresh_segment
+from .forms import CampaignForm, RecipientUploadForm, RecipientForm, check_campaigns_in_progress
+from .suppression import suppress
+from .uploads import ChunkRejected, append_chunk, start_chunked_upload
+from .tasks import run_import_job
+from .utils import email_domain
 
 
 @admin.register(Campaign)
@@ -18,14 +31,18 @@ class CampaignAdmin(admin.ModelAdmin):
         'name',
         'subject',
         'status_badge',
+        'priority',
+        'segment',
         'scheduled_time',
         'delivery_stats',
+        'engagement_stats',
         'created_by',
         'created_on'
     ]
     
     list_filter = [
         'status',
+        'priority',
         'created_on',
         'scheduled_time',
         'created_by'
@@ -40,7 +57,11 @@ class CampaignAdmin(admin.ModelAdmin):
     readonly_fields = [
         'created_by',
         'created_on',
-        'delivery_summary'
+        'delivery_summary',
+        'unique_open_count',
+        'open_count',
+        'unique_click_count',
+        'click_count',
     ]
     
     fieldsets = (
@@ -48,7 +69,7 @@ class CampaignAdmin(admin.ModelAdmin):
             'fields': ('name', 'subject', 'content')
         }),
         ('Scheduling & Status', {
-            'fields': ('scheduled_time', 'status')
+            'fields': ('scheduled_time', 'status', 'priority', 'segment')
         }),
         ('Metadata', {
             'fields': ('created_by', 'created_on'),
@@ -57,6 +78,10 @@ class CampaignAdmin(admin.ModelAdmin):
         ('Delivery Statistics', {
             'fields': ('delivery_summary',),
             'classes': ('collapse',)
+        }),
+        ('Engagement', {
+            'fields': (('unique_open_count', 'open_count'), ('unique_click_count', 'click_count')),
+            'classes': ('collapse',)
         })
     )
     
@@ -84,9 +109,13 @@ class CampaignAdmin(admin.ModelAdmin):
     
     def delivery_stats(self, obj):
         """Display delivery statistics"""
-        total = obj.logs.count()
-        sent = obj.logs.filter(status='sent').count()
-        failed = obj.logs.filter(status='failed').count()
+        # one pass over the (campaign, status) index instead of three counts
+        counts = obj.logs.aggregate(
+            total=Count('id'),
+            sent=Count('id', filter=Q(status='sent')),
+            failed=Count('id', filter=Q(status='failed')),
+        )
+        total, sent, failed = counts['total'], counts['sent'], counts['failed']
         
         if total == 0:
             return format_html('<span style="color: #6c757d;">No deliveries yet</span>')
@@ -98,6 +127,16 @@ class CampaignAdmin(admin.ModelAdmin):
             sent, failed, total
         )
     delivery_stats.short_description = 'Delivery Stats'
+
+    def engagement_stats(self, obj):
+        """Unique opens / clicks (counters kept by campaigns.tracking, no query)"""
+        if not obj.unique_open_count and not obj.unique_click_count:
+            return format_html('<span style="color: #6c757d;">—</span>')
+        return format_html(
+            '<span title="unique opens">👁 {}</span> / <span title="unique clicks">🖱 {}</span>',
+            obj.unique_open_count, obj.unique_click_count
+        )
+    engagement_stats.short_description = 'Opens / Clicks'
     
     def delivery_summary(self, obj):
         """Detailed delivery summary for readonly field"""
@@ -109,9 +148,13 @@ class CampaignAdmin(admin.ModelAdmin):
                 '</div>'
             )
         
-        total = obj.logs.count()
-        sent = obj.logs.filter(status='sent').count()
-        failed = obj.logs.filter(status='failed').count()
+        # one pass over the (campaign, status) index instead of three counts
+        counts = obj.logs.aggregate(
+            total=Count('id'),
+            sent=Count('id', filter=Q(status='sent')),
+            failed=Count('id', filter=Q(status='failed')),
+        )
+        total, sent, failed = counts['total'], counts['sent'], counts['failed']
         
         if total == 0:
             return format_html(
@@ -196,7 +239,7 @@ class CampaignAdmin(admin.ModelAdmin):
         
         if obj and obj.status in [Campaign.IN_PROGRESS, Campaign.COMPLETED]:
             # Make all fields readonly for running or completed campaigns
-            readonly.extend(['name', 'subject', 'content', 'scheduled_time', 'status'])
+            readonly.extend(['name', 'subject', 'content', 'scheduled_time', 'status', 'priority', 'segment'])
         
         return readonly
     
@@ -258,6 +301,8 @@ class RecipientAdmin(admin.ModelAdmin):
     
     form = RecipientForm  # Use custom form with validation
     
+    ordering = ['email']  # Recipient has no default ordering
+    
     list_display = [
         'email',
         'name',
@@ -278,7 +323,8 @@ class RecipientAdmin(admin.ModelAdmin):
     actions = [
         'mark_as_subscribed',
         'mark_as_unsubscribed',
-        'mark_all_as_unsubscribed'
+        'mark_all_as_unsubscribed',
+        'add_to_suppression_list'
     ]
     
     def subscription_badge(self, obj):
@@ -295,24 +341,36 @@ class RecipientAdmin(admin.ModelAdmin):
     
     @admin.action(description='Mark as Subscribed')
     def mark_as_subscribed(self, request, queryset):
-        updated = queryset.update(subscription_status='subscribed')
+        updated = queryset.update(subscription_status='subscribed', updated_on=timezone.now())
         self.message_user(request, f'{updated} recipient(s) marked as subscribed.')
     
     @admin.action(description='Mark as Unsubscribed')
     def mark_as_unsubscribed(self, request, queryset):
-        updated = queryset.update(subscription_status='unsubscribed')
+        updated = queryset.update(subscription_status='unsubscribed', updated_on=timezone.now())
         self.message_user(request, f'{updated} recipient(s) marked as unsubscribed.')
 
     @admin.action(description='Mark all users as Unsubscribed')
     def mark_all_as_unsubscribed(self, request, queryset):
-        total = Recipient.objects.update(subscription_status='unsubscribed')
+        total = Recipient.objects.update(subscription_status='unsubscribed', updated_on=timezone.now())
         self.message_user(request, f'All {total} recipients marked as unsubscribed.')
     
+    @admin.action(description='Add to suppression list (never email again)')
+    def add_to_suppression_list(self, request, queryset):
+        count = 0
+        for email in queryset.values_list('email', flat=True).iterator():
+            suppress(email, reason=Suppression.MANUAL, note=f'Blocked by {request.user}')
+            count += 1
+        self.message_user(request, f'{count} recipient(s) added to the suppression list.')
+    
     # Custom URLs for bulk upload
     def get_urls(self):
         urls = super().get_urls()
         custom_urls = [
             path('bulk-upload/', self.admin_site.admin_view(self.bulk_upload_view), name='campaigns_recipient_bulk_upload'),
+            path('bulk-upload/<int:job_id>/', self.admin_site.admin_view(self.import_job_view), name='campaigns_recipient_import_job'),
+            path('bulk-upload/<int:job_id>/status/', self.admin_site.admin_view(self.import_job_status_view), name='campaigns_recipient_import_job_status'),
+            path('bulk-upload/chunked/', self.admin_site.admin_view(self.chunked_upload_create_view), name='campaigns_recipient_chunked_upload'),
+            path('bulk-upload/<int:job_id>/chunks/', self.admin_site.admin_view(self.chunked_upload_view), name='campaigns_recipient_upload_chunks'),
         ]
         return custom_urls + urls
     
@@ -327,21 +385,16 @@ class RecipientAdmin(admin.ModelAdmin):
                 if form.is_valid():
                     uploaded_file = request.FILES['file']
                     
-                    try:
-                        # Use the parallel importer for fast processing
-                        importer = RecipientImporterParallel(uploaded_file)
-                        result = importer.run()
-                        
-                        # Show success message with stats
-                        messages.success(
-                            request,
-                            f'Successfully imported {result["created"]} recipients. '
-                            f'{result["duplicates_skipped"]} duplicates were skipped.'
-                        )
-                        return redirect('..')
-                        
-                    except Exception as e:
-                        messages.error(request, f'Error importing file: {str(e)}')
+                    # Store the upload and import it in the background (imports queue);
+                    # the request returns immediately whatever the file size
+                    job = ImportJob.objects.create(
+                        file=uploaded_file,
+                        original_name=uploaded_file.name,
+                        update_fields=form.cleaned_data['update_fields'],
+                        created_by=request.user,
+                    )
+                    transaction.on_commit(lambda: run_import_job.delay(job.pk))
+                    return redirect('admin:campaigns_recipient_import_job', job_id=job.pk)
             else:
                 messages.error(
                     request,
@@ -360,9 +413,94 @@ class RecipientAdmin(admin.ModelAdmin):
             'has_view_permission': self.has_view_permission(request),
             'running_campaigns': running_campaigns,  # Pass running campaigns to template
             'running_campaigns_count': running_campaigns.count(),
+            'chunked_threshold': settings.CHUNKED_UPLOAD_THRESHOLD,
+            'chunk_bytes': settings.CHUNKED_UPLOAD_CHUNK_BYTES,
         }
         return render(request, 'admin/campaigns/recipient/bulk_upload.html', context)
     
+    def import_job_view(self, request, job_id):
+        """Progress page of one background import; polls import_job_status_view"""
+        job = get_object_or_404(ImportJob, pk=job_id)
+        context = {
+            'job': job,
+            'title': f'Importing {job.original_name}',
+            'site_title': 'Campaign Admin',
+            'site_header': 'Campaign Administration',
+            'opts': self.model._meta,
+            'has_view_permission': self.has_view_permission(request),
+        }
+        return render(request, 'admin/campaigns/recipient/import_job.html', context)
+    
+    def import_job_status_view(self, request, job_id):
+        """JSON snapshot of an import job for the progress page"""
+        job = get_object_or_404(ImportJob, pk=job_id)
+        phase, rows_processed = job.get_progress()
+        return JsonResponse({
+            'status': job.status,
+            'phase': phase,
+            'phase_display': dict(ImportJob.PHASE_CHOICES).get(phase, phase),
+            'rows_processed': rows_processed,
+            'upload_size': job.upload_size,
+            'upload_offset': job.upload_offset,
+            'stats': job.stats,
+            'error': job.error,
+            'finished': job.is_finished,
+        })
+    
+    def chunked_upload_create_view(self, request):
+        """Start a resumable upload: JSON {"name", "size"} -> job id, offset and URLs"""
+        if request.method != 'POST':
+            return JsonResponse({'error': 'POST required'}, status=405)
+        try:
+            check_campaigns_in_progress()
+            payload = json.loads(request.body or b'{}')
+            update_fields = payload.get('update_fields') or []
+            if not set(update_fields) <= {choice for choice, _ in RecipientUploadForm.UPDATE_CHOICES}:
+                raise ValueError(update_fields)
+            job = start_chunked_upload(
+                str(payload['name']), int(payload['size']), user=request.user, update_fields=update_fields
+            )
+        except ValidationError as e:
+            return JsonResponse({'error': ' '.join(e.messages)}, status=409)
+        except (ValueError, KeyError, TypeError):
+            return JsonResponse({'error': 'Expected JSON with "name", "size" and optional "update_fields"'}, status=400)
+        except ChunkRejected as e:
+            return JsonResponse({'error': str(e)}, status=e.status)
+        return JsonResponse({
+            'job_id': job.pk,
+            'offset': job.upload_offset,
+            'upload_url': reverse('admin:campaigns_recipient_upload_chunks', args=[job.pk]),
+            'job_url': reverse('admin:campaigns_recipient_import_job', args=[job.pk]),
+        }, status=201)
+    
+    def chunked_upload_view(self, request, job_id):
+        """HEAD/GET: current offset (to resume). PATCH: append one checksummed chunk"""
+        job = get_object_or_404(ImportJob, pk=job_id, upload_size__isnull=False)
+        if request.method in ('HEAD', 'GET'):
+            response = JsonResponse({'offset': job.upload_offset, 'size': job.upload_size, 'status': job.status})
+            response['Upload-Offset'] = job.upload_offset
+            response['Upload-Length'] = job.upload_size
+            return response
+        if request.method != 'PATCH':
+            return JsonResponse({'error': 'HEAD, GET or PATCH required'}, status=405)
+        
+        try:
+            offset = int(request.headers.get('Upload-Offset', ''))
+        except ValueError:
+            return JsonResponse({'error': 'Upload-Offset header required'}, status=400)
+        # read the raw stream ourselves: request.body is capped by DATA_UPLOAD_MAX_MEMORY_SIZE
+        data = request.read(2 * settings.CHUNKED_UPLOAD_CHUNK_BYTES + 1)
+        try:
+            job = append_chunk(job.pk, offset, data, request.headers.get('Upload-Checksum', ''))
+        except ChunkRejected as e:
+            response = JsonResponse({'error': str(e), 'offset': e.offset}, status=e.status)
+            if e.offset is not None:
+                response['Upload-Offset'] = e.offset
+            return response
+        response = JsonResponse({'offset': job.upload_offset, 'complete': job.upload_complete})
+        response['Upload-Offset'] = job.upload_offset
+        return response
+    
     def changelist_view(self, request, extra_context=None):
         """Add bulk upload button to the recipient list view"""
         extra_context = extra_context or {}
@@ -409,6 +547,10 @@ class DeliveryLogAdmin(admin.ModelAdmin):
             return format_html(
                 '<span style="background-color: #28a745; color: white; padding: 3px 10px; border-radius: 3px;">Sent</span>'
             )
+        elif obj.status == 'suppressed':
+            return format_html(
+                '<span style="background-color: #6c757d; color: white; padding: 3px 10px; border-radius: 3px;">Suppressed</span>'
+            )
         else:
             return format_html(
                 '<span style="background-color: #dc3545; color: white; padding: 3px 10px; border-radius: 3px;">Failed</span>'
@@ -425,3 +567,115 @@ class DeliveryLogAdmin(admin.ModelAdmin):
     def has_add_permission(self, request):
         """Disable manual creation of delivery logs"""
         return False
+
+
+@admin.register(Suppression)
+class SuppressionAdmin(admin.ModelAdmin):
+    """Admin interface for the global suppression list"""
+    
+    list_display = [
+        '__str__',
+        'domain',
+        'reason',
+        'created_on'
+    ]
+    
+    list_filter = [
+        'reason',
+        'created_on'
+    ]
+    
+    search_fields = [
+        'email',
+        'domain',
+        'note'
+    ]
+    
+    def save_model(self, request, obj, form, change):
+        """Normalize keys so the send-time check matches"""
+        obj.email = obj.email.strip().lower()
+        obj.domain = (obj.domain or email_domain(obj.email)).strip().lower()
+        super().save_model(request, obj, form, change)
+
+
+@admin.register(Segment)
+class SegmentAdmin(admin.ModelAdmin):
+    """Admin interface for audience segments"""
+    
+    list_display = [
+        'name',
+        'match',
+        'member_count',
+        'refreshed_at',
+        'rebuilt_at'
+    ]
+    
+    search_fields = [
+        'name'
+    ]
+    
+    readonly_fields = [
+        'member_count',
+        'refreshed_at',
+        'rebuilt_at',
+        'created_on'
+    ]
+    
+    actions = ['rebuild_membership']
+    
+    def save_model(self, request, obj, form, change):
+        """Changed rules invalidate the precomputed membership: rebuild it"""
+        super().save_model(request, obj, form, change)
+        refresh_segment(obj.pk, full=True)
+        obj.refresh_from_db()
+    
+    @admin.action(description='Rebuild membership now')
+    def rebuild_membership(self, request, queryset):
+        for segment in queryset:
+            refresh_segment(segment.pk, full=True)
+        self.message_user(request, f'{queryset.count()} segment(s) rebuilt.')
+
+
+@admin.register(ImportJob)
+class ImportJobAdmin(admin.ModelAdmin):
+    """Admin interface for background recipient imports"""
+    
+    list_display = [
+        'original_name',
+        'status',
+        'phase',
+        'rows_processed',
+        'created_by',
+        'created_on',
+        'finished_at'
+    ]
+    
+    list_filter = [
+        'status',
+        'created_on'
+    ]
+    
+    search_fields = [
+        'original_name'
+    ]
+    
+    readonly_fields = [
+        'file',
+        'original_name',
+        'status',
+        'phase',
+        'rows_processed',
+        'stats',
+        'error',
+        'update_fields',
+        'upload_size',
+        'upload_offset',
+        'created_by',
+        'created_on',
+        'started_at',
+        'finished_at'
+    ]
+    
+    def has_add_permission(self, request):
+        """Imports are created from the recipient bulk upload page"""
+        return False
@@ -4,3 +4,8 @@ from django.apps import AppConfig
 class CampaignsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'campaigns'
+
+    def ready(self):
+        # Celery signal handlers: per-task query / latency logging, worker metrics exporter, tracing,
+        # on-demand profiler
+        from . import instrumentation, metrics, profiling, tracing  # noqa: F401
@@ -0,0 +1,77 @@
+"""
+Write buffer in the cache (Redis in production) for bursty web traffic.
+
+The web process appends with one incr + one set and never waits on
+PostgreSQL; a periodic task drains the buffer and applies it in bulk. Used
+by one-click unsubscribes (campaigns.unsubscribe) and open/click events
+(campaigns.tracking).
+
+Entries are numbered by an incrementing sequence. An entry whose number was
+taken but not written yet when a drain runs is retried by the next drain
+once, then given up. A drain that fails leaves the buffer as it was, and
+overlapping drains are prevented with a lock.
+"""
+import logging
+
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+ENTRY_TTL = 24 * 3600
+LOCK_TTL = 300
+
+
+class CacheBuffer:
+    def __init__(self, name: str):
+        self.name = name
+        self.seq_key = f"{name}:seq"
+        self.cursor_key = f"{name}:flushed"
+        self.retry_key = f"{name}:retry"
+        self.lock_key = f"{name}:lock"
+
+    def entry_key(self, n):
+        return f"{self.name}:{n}"
+
+    def append(self, value):
+        cache.add(self.seq_key, 0, None)
+        n = cache.incr(self.seq_key)
+        cache.set(self.entry_key(n), value, ENTRY_TTL)
+
+    def drain(self, handle, limit: int = None) -> int:
+        """
+        Pass up to `limit` buffered values (in append order) to `handle`, then
+        drop them. Returns the number of values handled (0 while another drain
+        holds the lock).
+        """
+        if not cache.add(self.lock_key, 1, LOCK_TTL):
+            return 0
+        try:
+            return self._drain(handle, limit)
+        finally:
+            cache.delete(self.lock_key)
+
+    def _drain(self, handle, limit):
+        cache.add(self.seq_key, 0, None)
+        last = cache.get(self.seq_key) or 0
+        cursor = cache.get(self.cursor_key) or 0
+        if last < cursor:  # the sequence was lost (cache flushed) and restarted
+            cursor = 0
+        if limit is not None:
+            last = min(last, cursor + limit)
+        retry = cache.get(self.retry_key) or []
+        numbers = retry + list(range(cursor + 1, last + 1))
+        if not numbers:
+            return 0
+
+        entries = cache.get_many([self.entry_key(n) for n in numbers])
+        dropped = [n for n in retry if self.entry_key(n) not in entries]
+        if dropped:
+            logger.warning(f"Dropped {len(dropped)} {self.name} buffer entries that were never written")
+        missing = [n for n in numbers if n > cursor and self.entry_key(n) not in entries]
+        values = [entries[self.entry_key(n)] for n in numbers if self.entry_key(n) in entries]
+
+        if values:
+            handle(values)
+        cache.set_many({self.cursor_key: last, self.retry_key: missing}, None)
+        cache.delete_many(list(entries))
+        return len(values)
@@ -0,0 +1,67 @@
+"""
+Whole-column (pandas) helpers used by the importers.
+
+Kept apart from utils so that models, the web process and the send path do
+not load pandas / pyarrow just to use the row-level helpers.
+"""
+import json
+import pandas as pd
+
+from .utils import EMAIL_REGEX, attribute_columns
+
+# Arrow-backed strings run strip/lower/regex as native kernels over the whole
+# column; without pyarrow the column helpers fall back to a single Python pass.
+try:
+    import pyarrow  # noqa: F401
+    STRING_DTYPE = "string[pyarrow]"
+except ImportError:
+    STRING_DTYPE = None
+
+def normalize_emails(values) -> pd.Series:
+    """
+    Strip + lowercase a whole column of emails in one vectorized pass.
+    Accepts a pandas Series or any list-like of strings; missing values become "".
+    """
+    series = values if isinstance(values, pd.Series) else pd.Series(list(values), dtype="object")
+    if STRING_DTYPE:
+        return series.astype(STRING_DTYPE).fillna("").str.strip().str.lower()
+    return pd.Series(
+        [e.strip().lower() for e in series.fillna("").astype(str)], index=series.index, dtype="object"
+    )
+
+def valid_email_mask(values, normalized: bool = False) -> pd.Series:
+    """
+    Boolean mask of valid emails, aligned with `values`.
+    Pass normalized=True when the values already went through normalize_emails
+    (they are then matched as-is, without stripping/lowercasing again).
+    """
+    emails = values if normalized else normalize_emails(values)
+    if STRING_DTYPE:
+        return emails.astype(STRING_DTYPE).str.match(EMAIL_REGEX.pattern).fillna(False).astype(bool)
+    return pd.Series([bool(EMAIL_REGEX.match(e)) for e in emails], index=emails.index, dtype=bool)
+
+def json_object_mask(values: pd.Series) -> pd.Series:
+    """
+    Boolean mask of the cells that are empty or hold a JSON object, aligned
+    with `values` (an `attributes` column given as-is in the upload).
+    """
+    def is_object(text):
+        if pd.isna(text) or text == "":
+            return True
+        try:
+            return isinstance(json.loads(text), dict)
+        except (TypeError, ValueError):
+            return False
+    return pd.Series([is_object(v) for v in values], index=values.index, dtype=bool)
+
+def attributes_json(df: pd.DataFrame, mask: pd.Series) -> pd.Series:
+    """
+    JSON object text per masked row built from the extra columns of `df`
+    (keys stripped + lowercased, empty cells left out). Aligned with df[mask].
+    """
+    extras = attribute_columns(df.columns)
+    keys = [str(c).strip().lower() for c in extras]
+    return pd.Series([
+        json.dumps({k: v for k, v in zip(keys, row) if v is not None and v == v and v != ""}, default=str)
+        for row in df.loc[mask, extras].itertuples(index=False, name=None)
+    ], index=df.index[mask], dtype=object)
@@ -20,9 +20,21 @@ def check_campaigns_in_progress():
 
 
 class RecipientUploadForm(forms.Form):
+    UPDATE_CHOICES = [
+        ('name', 'Update names of existing recipients'),
+        ('subscription_status', 'Update subscription status (requires a subscription_status column)'),
+        ('attributes', 'Update custom attributes from the extra columns'),
+    ]
+
     file = forms.FileField(
         help_text="Upload CSV or Excel file containing recipients."
     )
+    update_fields = forms.MultipleChoiceField(
+        choices=UPDATE_CHOICES,
+        required=False,
+        widget=forms.CheckboxSelectMultiple,
+        help_text="Leave unchecked to only add new recipients.",
+    )
     
     def clean_file(self):
         """Validate that no campaigns are running before allowing bulk upload"""
@@ -35,7 +47,7 @@ class RecipientForm(forms.ModelForm):
     
     class Meta:
         model = Recipient
-        fields = ['name', 'email', 'subscription_status']
+        fields = ['name', 'email', 'subscription_status', 'tags', 'attributes']
     
     def clean(self):
         """Validate that no campaigns are running before allowing recipient addition"""
@@ -52,7 +64,7 @@ class CampaignForm(forms.ModelForm):
     
     class Meta:
         model = Campaign
-        fields = ['name', 'subject', 'content', 'scheduled_time', 'status']
+        fields = ['name', 'subject', 'content', 'scheduled_time', 'status', 'priority', 'segment']
         widgets = {
             'name': forms.TextInput(attrs={
                 'class': 'vTextField',
@@ -70,11 +82,16 @@ class CampaignForm(forms.ModelForm):
             'scheduled_time': admin_widgets.AdminSplitDateTime(),
             'status': forms.Select(attrs={
                 'class': 'vTextField'
+            }),
+            'priority': forms.Select(attrs={
+                'class': 'vTextField'
             })
         }
         help_texts = {
             'content': 'You can use HTML tags for formatting.',
             'scheduled_time': 'Leave blank to save as draft. Set a future time (more than 1 hour from now) to schedule.',
+            'priority': 'Share of sender capacity while other campaigns are running at the same time.',
+            'segment': 'Send only to this audience segment. Leave blank to send to every subscribed recipient.',
         }
     
     def clean(self):
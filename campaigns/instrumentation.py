@@ -0,0 +1,106 @@
+"""
+Query-count and latency accounting for units of work.
+
+TaskStats counts the SQL statements a block issues and the time spent in
+the database (through connection.execute_wrapper) next to its wall time.
+
+- every Celery task execution is measured (task_prerun / task_postrun) and
+  logged as one line whose fields are also attached as `extra`, e.g.
+  "task=campaigns.tasks.send_batch queries=4 db_ms=3.1 wall_ms=412.0"
+- tests wrap a call in query_budget(n) to fail when it issues more than n
+  statements (see Test23_QueryBudgets for the per-task budgets)
+
+Savepoint statements are transaction bookkeeping, not queries, and are not
+counted, so budgets hold both inside test transactions and in autocommit.
+"""
+import time
+import logging
+from contextlib import ExitStack, contextmanager
+
+from celery.signals import task_postrun, task_prerun
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+BOOKKEEPING = ("SAVEPOINT", "RELEASE SAVEPOINT", "ROLLBACK TO SAVEPOINT")
+
+
+class BudgetExceeded(AssertionError):
+    pass
+
+
+class TaskStats:
+    """Execute wrapper that tallies statements and database time."""
+
+    def __init__(self, capture=False):
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.wall_seconds = 0.0
+        self.statements = [] if capture else None
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            if not sql.lstrip().upper().startswith(BOOKKEEPING):
+                self.db_seconds += time.perf_counter() - started
+                self.queries += 1
+                if self.statements is not None:
+                    self.statements.append(sql)
+
+    def fields(self) -> dict:
+        return {
+            "queries": self.queries,
+            "db_ms": round(self.db_seconds * 1000, 1),
+            "wall_ms": round(self.wall_seconds * 1000, 1),
+        }
+
+
+@contextmanager
+def measure(capture=False):
+    """Yield a TaskStats that records every statement issued inside the block."""
+    stats = TaskStats(capture)
+    started = time.perf_counter()
+    with ExitStack() as stack:
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(stats))
+        try:
+            yield stats
+        finally:
+            stats.wall_seconds = time.perf_counter() - started
+
+
+@contextmanager
+def query_budget(max_queries: int, max_db_seconds: float = None):
+    """Fail with BudgetExceeded when the block issues more than `max_queries` statements."""
+    with measure(capture=True) as stats:
+        yield stats
+    if stats.queries > max_queries:
+        listing = "\n".join(f"  {i}. {sql}" for i, sql in enumerate(stats.statements, 1))
+        raise BudgetExceeded(f"{stats.queries} queries issued, budget is {max_queries}:\n{listing}")
+    if max_db_seconds is not None and stats.db_seconds > max_db_seconds:
+        raise BudgetExceeded(f"{stats.db_seconds:.3f}s spent in the database, budget is {max_db_seconds}s")
+
+
+# -------------------------
+# Celery: measure every task execution
+# -------------------------
+_running = {}  # task_id -> (ExitStack, TaskStats)
+
+
+@task_prerun.connect
+def _start_task_stats(task_id=None, task=None, **kwargs):
+    stack = ExitStack()
+    _running[task_id] = (stack, stack.enter_context(measure()))
+
+
+@task_postrun.connect
+def _log_task_stats(task_id=None, task=None, state=None, **kwargs):
+    entry = _running.pop(task_id, None)
+    if entry is None:
+        return
+    stack, stats = entry
+    stack.close()
+    fields = {"task": task.name, "task_id": task_id, "state": state, **stats.fields()}
+    logger.info(" ".join(f"{key}={value}" for key, value in fields.items()), extra=fields)
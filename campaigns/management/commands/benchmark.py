@@ -0,0 +1,348 @@
+"""
+Benchmarks for the recipient import path.
+
+Usage:
+    python manage.py benchmark validation --rows 1000000
+    python manage.py benchmark excel --file sample_recipients_100k.xlsx
+    python manage.py benchmark generate --rows 10000000 --format csv --out bench_10m.csv
+    python manage.py benchmark import --rows 1000000 --importer all
+
+`import` runs each importer in a fresh process against the configured
+PostgreSQL database. Generated addresses use BENCH_DOMAINS only and are
+deleted before every run (and afterwards unless --keep).
+"""
+import csv
+import json
+import os
+import random
+import resource
+import tempfile
+import time
+from multiprocessing import get_context
+
+import pandas as pd
+from django.core.files import File
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from openpyxl import Workbook
+
+from campaigns.importer_v1 import RecipientImporter
+from campaigns.importer_v2 import RecipientImporterParallel
+from campaigns.models import Recipient
+from campaigns.columns import STRING_DTYPE, normalize_emails, valid_email_mask
+from campaigns.utils import is_valid_email
+
+BENCH_DOMAINS = ["bench-mail.test", "bench-corp.test", "bench-isp.test", "bench-edu.test", "bench-shop.test"]
+FIRST_NAMES = ["John", "Jane", "Bob", "Alice", "Maria", "Wei", "Fatima", "Ivan", "Priya", "Lucas"]
+LAST_NAMES = ["Doe", "Smith", "Johnson", "Garcia", "Chen", "Khan", "Petrov", "Patel", "Silva", "Brown"]
+IMPORTERS = ("v1", "parallel", "stream")
+
+
+def synthetic_emails(rows: int, invalid_ratio: float = 0.05, seed: int = 42):
+    """Deterministic mix of valid (some padded / upper-case) and invalid addresses."""
+    rng = random.Random(seed)
+    emails = []
+    for i in range(rows):
+        if rng.random() < invalid_ratio:
+            emails.append(rng.choice(["", f"user{i}", f"user{i}@", f"user{i}@example", f"user {i}@example.com"]))
+        elif i % 3 == 0:
+            emails.append(f"  User.{i}@Example.COM ")
+        else:
+            emails.append(f"user.{i}@example.com")
+    return emails
+
+
+def _is_invalid_row(i: int, invalid_ratio: float) -> bool:
+    # a pure function of i (Knuth multiplicative hash), so duplicates can avoid invalid rows
+    return (i * 2654435761 % 2 ** 32) / 2 ** 32 < invalid_ratio
+
+
+def synthetic_recipient(i: int, rng: random.Random, invalid_ratio: float, duplicate_ratio: float):
+    """
+    Row i of a generated upload, in the style of sample_recipients.csv.
+    Duplicates repeat an earlier valid row's address, so nothing has to be
+    remembered while generating.
+    """
+    if _is_invalid_row(i, invalid_ratio):
+        return "Invalid Row", rng.choice(["", f"user{i}", f"user{i}@", f"user{i}@example", f"user {i}@example.com"])
+    if i and rng.random() < duplicate_ratio:
+        j = rng.randrange(i)
+        while j and _is_invalid_row(j, invalid_ratio):
+            j -= 1
+        if not _is_invalid_row(j, invalid_ratio):
+            i = j
+    first, last = FIRST_NAMES[i % len(FIRST_NAMES)], LAST_NAMES[i // len(FIRST_NAMES) % len(LAST_NAMES)]
+    email = f"{first}.{last}.{i}@{BENCH_DOMAINS[i % len(BENCH_DOMAINS)]}"
+    return f"{first} {last}", (f"  {email} " if i % 7 == 0 else email.lower())
+
+
+def generate_recipients(path, rows, fmt="csv", invalid_ratio=0.05, duplicate_ratio=0.05, seed=42):
+    """Write a deterministic name,email file of `rows` rows (streamed, constant memory)."""
+    rng = random.Random(seed)
+    records = (synthetic_recipient(i, rng, invalid_ratio, duplicate_ratio) for i in range(rows))
+    if fmt == "xlsx":
+        workbook = Workbook(write_only=True)
+        sheet = workbook.create_sheet()
+        sheet.append(["name", "email"])
+        for record in records:
+            sheet.append(record)
+        workbook.save(path)
+    else:
+        with open(path, "w", newline="", encoding="utf-8") as fh:
+            writer = csv.writer(fh)
+            writer.writerow(["name", "email"])
+            writer.writerows(records)
+    return path
+
+
+def _peak_rss_mb(who=resource.RUSAGE_SELF):
+    return resource.getrusage(who).ru_maxrss / 1024
+
+
+def _in_child(func, *args):
+    """
+    Run func(*args) in a fresh forked process and return
+    (result, seconds, peak RSS growth in MB) so variants don't share a high-water mark.
+    A plain Process rather than a Pool: the parallel importer starts a Pool of
+    its own, which daemonic pool workers may not do.
+    """
+    connections.close_all()  # the child opens its own database connection
+    ctx = get_context("fork")
+    receiver, sender = ctx.Pipe(duplex=False)
+    child = ctx.Process(target=_measured, args=(sender, func, *args))
+    child.start()
+    sender.close()
+    try:
+        outcome = receiver.recv()
+    except EOFError:
+        outcome = ("error", f"benchmark process exited with code {child.exitcode}")
+    child.join()
+    if outcome[0] == "error":
+        raise CommandError(outcome[1])
+    return outcome[1]
+
+
+def _measured(sender, func, *args):
+    try:
+        # load the string kernels first: a fixed library cost, not per-row memory
+        valid_email_mask(["warm@up.com"])
+        baseline = _peak_rss_mb()
+        started = time.perf_counter()
+        result = func(*args)
+        sender.send(("ok", (result, time.perf_counter() - started, _peak_rss_mb() - baseline)))
+    except Exception as e:
+        sender.send(("error", f"{type(e).__name__}: {e}"))
+    finally:
+        connections.close_all()
+
+
+def _excel_legacy(path):
+    """Former _excel_to_csv: whole workbook as one DataFrame, no validation."""
+    df = pd.read_excel(path)
+    out = f"{path}.legacy.csv"
+    df.to_csv(out, index=False)
+    os.remove(out)
+    return len(df)
+
+
+def _excel_streaming(path):
+    with open(path, "rb") as fh:
+        out = RecipientImporterParallel(fh)._excel_to_csv()
+    with open(out) as fh:
+        rows = sum(1 for _ in fh) - 1
+    os.remove(out)
+    return rows
+
+
+class _TimedImporter(RecipientImporter):
+    """importer_v1 that accounts time spent in database inserts."""
+
+    insert_seconds = 0.0
+
+    def _bulk_insert(self, batch):
+        started = time.perf_counter()
+        try:
+            return super()._bulk_insert(batch)
+        finally:
+            self.insert_seconds += time.perf_counter() - started
+
+
+def _phase_seconds(marks, started, finished):
+    """
+    Durations from the importer's progress reports (first and last time each
+    phase was reported):
+    normalize = Excel pre-pass; split = until the first "loading" report
+    (byte-range planning, staging table); copy = normalize + COPY, which
+    overlap per range or stream; merge = UPSERT + stats.
+    """
+    first = {phase: min(times) for phase, times in marks.items()}
+    loading = first.get("loading", finished)
+    merging = first.get("merging", finished)
+    phases = {}
+    if "reading" in marks:
+        phases["normalize"] = max(marks["reading"]) - started
+        started = max(marks["reading"])
+    phases.update(split=loading - started, copy=merging - loading, merge=finished - merging)
+    return {phase: round(seconds, 3) for phase, seconds in phases.items()}
+
+
+def _import_file(importer, path):
+    """Runs in the child: import `path` once, returning stats and phase timings."""
+    with open(path, "rb") as fh:
+        upload = File(fh, name=os.path.basename(path))
+        started = time.perf_counter()
+        if importer == "v1":
+            runner = _TimedImporter(upload)
+            result = runner.run()
+            finished = time.perf_counter()
+            rows = result["created"] + result["skipped_invalid"] + result["skipped_duplicates"]
+            phases = {"normalize": round(finished - started - runner.insert_seconds, 3),
+                      "insert": round(runner.insert_seconds, 3)}
+        else:
+            marks = {}
+
+            def progress(phase, rows):
+                marks.setdefault(phase, []).append(time.perf_counter())
+
+            runner = RecipientImporterParallel(upload, mode=importer, progress=progress)
+            result = runner.run()
+            finished = time.perf_counter()
+            rows = runner.counts["read"]
+            phases = _phase_seconds(marks, started, finished)
+    return {
+        "rows": rows,
+        "phases": phases,
+        "workers_peak_rss_mb": round(_peak_rss_mb(resource.RUSAGE_CHILDREN), 1),
+        "result": result,
+    }
+
+
+def _delete_bench_recipients():
+    return Recipient.objects.filter(domain__in=BENCH_DOMAINS).delete()[0]
+
+
+class Command(BaseCommand):
+    help = "Benchmark parts of the recipient import pipeline and print JSON results."
+
+    def add_arguments(self, parser):
+        sub = parser.add_subparsers(dest="target", required=True)
+
+        validation = sub.add_parser("validation", help="per-row is_valid_email vs vectorized valid_email_mask")
+        validation.add_argument("--rows", type=int, default=1_000_000)
+        validation.add_argument("--invalid-ratio", type=float, default=0.05)
+
+        excel = sub.add_parser("excel", help="pandas read_excel vs streaming openpyxl reader of RecipientImporterParallel")
+        excel.add_argument("--file", default="sample_recipients_100k.xlsx")
+
+        for name, help_text in [
+            ("generate", "write a deterministic synthetic upload"),
+            ("import", "run the importers against PostgreSQL: rows/sec, peak RSS, phase timings"),
+        ]:
+            command = sub.add_parser(name, help=help_text)
+            command.add_argument("--rows", type=int, default=1_000_000)
+            command.add_argument("--format", choices=["csv", "xlsx"], default="csv")
+            command.add_argument("--invalid-ratio", type=float, default=0.05)
+            command.add_argument("--duplicate-ratio", type=float, default=0.05)
+            command.add_argument("--seed", type=int, default=42)
+            if name == "generate":
+                command.add_argument("--out", help="default: bench_recipients_<rows>.<format>")
+            else:
+                command.add_argument("--file", help="import this file instead of generating one")
+                command.add_argument("--importer", choices=[*IMPORTERS, "all"], default="all")
+                command.add_argument("--keep", action="store_true", help="leave the imported rows in the database")
+
+    def handle(self, *args, **options):
+        result = getattr(self, f"bench_{options['target']}")(options)
+        self.stdout.write(json.dumps(result, indent=2))
+
+    def bench_validation(self, options):
+        emails = synthetic_emails(options["rows"], options["invalid_ratio"])
+        # importers read columns straight into this dtype (read_csv dtype=...)
+        series = pd.Series(emails, dtype=STRING_DTYPE or "object")
+
+        # what the importers used to do: one Python call per row, normalizing again
+        started = time.perf_counter()
+        loop_valid = [is_valid_email(e.strip().lower()) for e in emails]
+        loop_seconds = time.perf_counter() - started
+
+        started = time.perf_counter()
+        mask = valid_email_mask(normalize_emails(series), normalized=True)
+        vector_seconds = time.perf_counter() - started
+
+        if mask.tolist() != loop_valid:
+            raise CommandError("vectorized validation disagrees with is_valid_email")
+        return {
+            "benchmark": "validation",
+            "rows": len(emails),
+            "backend": STRING_DTYPE or "python",
+            "valid": int(mask.sum()),
+            "per_row_seconds": round(loop_seconds, 3),
+            "vectorized_seconds": round(vector_seconds, 3),
+            "per_row_rows_per_sec": int(len(emails) / loop_seconds),
+            "vectorized_rows_per_sec": int(len(emails) / vector_seconds),
+            "speedup": round(loop_seconds / vector_seconds, 2),
+        }
+
+    def bench_generate(self, options):
+        path = options["out"] or f"bench_recipients_{options['rows']}.{options['format']}"
+        started = time.perf_counter()
+        generate_recipients(
+            path, options["rows"], options["format"],
+            options["invalid_ratio"], options["duplicate_ratio"], options["seed"],
+        )
+        return {
+            "benchmark": "generate",
+            "file": path,
+            "rows": options["rows"],
+            "file_mb": round(os.path.getsize(path) / 1024 / 1024, 2),
+            "seconds": round(time.perf_counter() - started, 2),
+        }
+
+    def bench_import(self, options):
+        path, generated = options["file"], False
+        if not path:
+            fd, path = tempfile.mkstemp(suffix=f".{options['format']}")
+            os.close(fd)
+            generate_recipients(
+                path, options["rows"], options["format"],
+                options["invalid_ratio"], options["duplicate_ratio"], options["seed"],
+            )
+            generated = True
+        file_mb = round(os.path.getsize(path) / 1024 / 1024, 2)
+
+        importers = IMPORTERS if options["importer"] == "all" else [options["importer"]]
+        runs = {}
+        try:
+            for importer in importers:
+                _delete_bench_recipients()
+                measured, seconds, rss_mb = _in_child(_import_file, importer, path)
+                runs[importer] = {
+                    "seconds": round(seconds, 2),
+                    "rows_per_sec": int(measured["rows"] / seconds),
+                    "peak_rss_growth_mb": round(rss_mb, 1),
+                    **measured,
+                }
+        finally:
+            if not options["keep"]:
+                _delete_bench_recipients()
+            if generated:
+                os.remove(path)
+
+        return {
+            "benchmark": "import",
+            "file": options["file"] or f"<generated {options['format']}>",
+            "file_mb": file_mb,
+            "importers": runs,
+        }
+
+    def bench_excel(self, options):
+        path = options["file"]
+        legacy_rows, legacy_seconds, legacy_mb = _in_child(_excel_legacy, path)
+        stream_rows, stream_seconds, stream_mb = _in_child(_excel_streaming, path)
+        return {
+            "benchmark": "excel",
+            "file": path,
+            "file_mb": round(os.path.getsize(path) / 1024 / 1024, 2),
+            "legacy": {"rows": legacy_rows, "seconds": round(legacy_seconds, 2), "peak_rss_growth_mb": round(legacy_mb, 1)},
+            "streaming": {"rows_valid": stream_rows, "seconds": round(stream_seconds, 2), "peak_rss_growth_mb": round(stream_mb, 1)},
+        }
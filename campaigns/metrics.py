@@ -0,0 +1,143 @@
+"""
+Prometheus metrics for the sending pipeline.
+
+Series (all prefixed `mailer_`):
+
+- emails_total{provider,status}           sent / failed per provider
+- emails_suppressed_total                 skipped by the suppression list
+- send_seconds{provider}                  one provider call
+- batch_seconds                           one send_batch execution
+- throttle_wait_seconds_total             time send_batch waited for domain slots
+- import_rows_total / import_rows_per_second
+- finalize_lag_seconds                    last delivery -> campaign marked completed
+- upload_bytes_total                      chunked upload bytes received (web)
+- queue_depth{queue}                      broker backlog, read at scrape time (web)
+
+Celery workers run prefork children, so metrics are recorded in
+prometheus_client multiprocess mode when PROMETHEUS_MULTIPROC_DIR is set
+(it must be set in the environment before the process starts). Each worker
+serves its children's combined metrics on METRICS_WORKER_PORT; the web
+process serves its own and the queue depths at /metrics.
+"""
+import os
+import glob
+import logging
+
+from celery.signals import worker_init, worker_process_shutdown, worker_ready
+from django.conf import settings
+
+MULTIPROC_DIR = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+if MULTIPROC_DIR:
+    os.makedirs(MULTIPROC_DIR, exist_ok=True)  # values are mmapped there as soon as metrics are defined
+
+from prometheus_client import (  # noqa: E402
+    REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess, start_http_server,
+)
+from prometheus_client.core import GaugeMetricFamily  # noqa: E402
+
+logger = logging.getLogger(__name__)
+
+
+EMAILS = Counter("mailer_emails_total", "Emails handed to a provider", ["provider", "status"])
+SUPPRESSED = Counter("mailer_emails_suppressed_total", "Emails skipped by the suppression list")
+SEND_SECONDS = Histogram(
+    "mailer_send_seconds", "Duration of one provider call", ["provider"],
+    buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+BATCH_SECONDS = Histogram(
+    "mailer_batch_seconds", "Duration of one send_batch execution",
+    buckets=(0.5, 1, 2.5, 5, 10, 30, 60, 120, 300),
+)
+THROTTLE_WAIT = Counter("mailer_throttle_wait_seconds_total", "Time send_batch waited for per-domain slots")
+IMPORT_ROWS = Counter("mailer_import_rows_total", "Rows read by recipient imports")
+IMPORT_RATE = Gauge(
+    "mailer_import_rows_per_second", "Throughput of the most recent recipient import", multiprocess_mode="mostrecent"
+)
+FINALIZE_LAG = Histogram(
+    "mailer_finalize_lag_seconds", "Time from a campaign's last delivery until it is marked completed",
+    buckets=(1, 5, 15, 30, 60, 120, 300, 600, 1800),
+)
+UPLOAD_BYTES = Counter("mailer_upload_bytes_total", "Chunked upload bytes received")
+
+
+def queue_names() -> list:
+    from .scheduler import PRIORITY_QUEUES
+    routed = {route["queue"] for route in settings.CELERY_TASK_ROUTES.values()}
+    return sorted(routed | set(PRIORITY_QUEUES.values()))
+
+
+def queue_lengths() -> dict:
+    """Pending messages per Celery queue (Redis broker: one list per queue)."""
+    import redis
+    client = redis.Redis.from_url(settings.CELERY_BROKER_URL, socket_timeout=1)
+    pipe = client.pipeline()
+    names = queue_names()
+    for name in names:
+        pipe.llen(name)
+    return dict(zip(names, pipe.execute()))
+
+
+class QueueDepthCollector:
+    """Reads the broker queue lengths at scrape time."""
+
+    def collect(self):
+        family = GaugeMetricFamily("mailer_queue_depth", "Messages waiting in a Celery queue", labels=["queue"])
+        try:
+            lengths = queue_lengths()
+        except Exception as exc:
+            logger.warning(f"Queue depth unavailable: {exc}")
+            lengths = {}
+        for name, length in lengths.items():
+            family.add_metric([name], length)
+        yield family
+
+
+def _multiprocess_registry():
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return registry
+
+
+_web_registry = None
+
+
+def web_registry():
+    """Registry behind the Django /metrics view."""
+    global _web_registry
+    if _web_registry is None:
+        registry = _multiprocess_registry() if MULTIPROC_DIR else REGISTRY
+        registry.register(QueueDepthCollector())
+        _web_registry = registry
+    return _web_registry
+
+
+def render_latest() -> bytes:
+    return generate_latest(web_registry())
+
+
+# -------------------------
+# Celery worker exporter
+# -------------------------
+@worker_init.connect
+def _clear_multiproc_dir(**kwargs):
+    # files of a previous run would be summed into this one
+    if MULTIPROC_DIR:
+        for path in glob.glob(os.path.join(MULTIPROC_DIR, "*.db")):
+            os.remove(path)
+
+
+@worker_ready.connect
+def _start_worker_exporter(sender=None, **kwargs):
+    port = settings.METRICS_WORKER_PORT
+    if not port:
+        return
+    if not MULTIPROC_DIR:
+        logger.warning("PROMETHEUS_MULTIPROC_DIR is not set: only the worker's main process is exported")
+    start_http_server(port, registry=_multiprocess_registry() if MULTIPROC_DIR else REGISTRY)
+    logger.info(f"Worker metrics served on :{port}/metrics")
+
+
+@worker_process_shutdown.connect
+def _mark_child_dead(pid=None, **kwargs):
+    if MULTIPROC_DIR:
+        multiprocess.mark_process_dead(pid or os.getpid())
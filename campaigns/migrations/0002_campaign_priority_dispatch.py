@@ -0,0 +1,33 @@
+# Generated by Django 5.2.8 on 2026-10-19 02:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('campaigns', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='campaign',
+            name='dispatch_completed',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='campaign',
+            name='dispatch_deficit',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='campaign',
+            name='priority',
+            field=models.PositiveSmallIntegerField(choices=[(1, 'Low'), (2, 'Normal'), (3, 'High')], default=2),
+        ),
+        migrations.AddField(
+            model_name='campaign',
+            name='send_cursor',
+            field=models.BigIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.8 on 2026-10-19 02:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('campaigns', '0002_campaign_priority_dispatch'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='campaign',
+            name='batches_in_flight',
+            field=models.IntegerField(default=0),
+        ),
+    ]
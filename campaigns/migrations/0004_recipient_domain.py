@@ -0,0 +1,26 @@
+# Generated by Django 5.2.8 on 2026-10-19 02:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('campaigns', '0003_campaign_batches_in_flight'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipient',
+            name='domain',
+            field=models.CharField(blank=True, editable=False, max_length=255),
+        ),
+        migrations.RunSQL(
+            "UPDATE campaigns_recipient SET domain = split_part(email, '@', 2);",
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+        migrations.AddIndex(
+            model_name='recipient',
+            index=models.Index(fields=['domain', 'id'], name='recipient_domain_id_idx'),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.8 on 2026-10-19 02:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('campaigns', '0004_recipient_domain'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='deliverylog',
+            name='status',
+            field=models.CharField(choices=[('sent', 'Sent'), ('failed', 'Failed'), ('suppressed', 'Suppressed')], max_length=10),
+        ),
+        migrations.CreateModel(
+            name='Suppression',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('email', models.EmailField(blank=True, max_length=254)),
+                ('domain', models.CharField(blank=True, max_length=255)),
+                ('reason', models.CharField(choices=[('bounce', 'Hard bounce'), ('complaint', 'Complaint'), ('manual', 'Manual block')], default='manual', max_length=20)),
+                ('note', models.TextField(blank=True)),
+                ('created_on', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('email', 'domain'), name='unique_suppression')],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.8 on 2026-10-19 03:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('campaigns', '0007_importjob_chunked_upload'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='importjob',
+            name='update_fields',
+            field=models.JSONField(blank=True, default=list),
+        ),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 5.2.8 on 2026-10-19 03:38
+
+import django.contrib.postgres.fields
+import django.contrib.postgres.indexes
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('campaigns', '0008_importjob_update_fields'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Segment',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, unique=True)),
+                ('rules', models.JSONField(blank=True, default=list)),
+                ('match', models.CharField(choices=[('all', 'All rules'), ('any', 'Any rule')], default='all', max_length=3)),
+                ('members', models.BinaryField(default=b'')),
+                ('member_count', models.IntegerField(default=0, editable=False)),
+                ('version', models.IntegerField(default=0, editable=False)),
+                ('refreshed_at', models.DateTimeField(blank=True, editable=False, null=True)),
+                ('rebuilt_at', models.DateTimeField(blank=True, editable=False, null=True)),
+                ('created_on', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='recipient',
+            name='tags',
+            field=django.contrib.postgres.fields.ArrayField(base_field=models.CharField(max_length=64), blank=True, default=list, size=None),
+        ),
+        migrations.AddField(
+            model_name='recipient',
+            name='updated_on',
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+        migrations.AddIndex(
+            model_name='recipient',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['tags'], name='recipient_tags_gin'),
+        ),
+        migrations.AddField(
+            model_name='campaign',
+            name='segment',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='campaigns', to='campaigns.segment'),
+        ),
+    ]
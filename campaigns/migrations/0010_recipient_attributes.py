@@ -0,0 +1,23 @@
+# Generated by Django 5.2.8 on 2026-10-19 03:42
+
+import django.contrib.postgres.indexes
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('campaigns', '0009_segments'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipient',
+            name='attributes',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+        migrations.AddIndex(
+            model_name='recipient',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['attributes'], name='recipient_attributes_gin'),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.2.8 on 2026-10-19 03:46
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('campaigns', '0010_recipient_attributes'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='recipient',
+            options={},
+        ),
+        migrations.AddIndex(
+            model_name='deliverylog',
+            index=models.Index(fields=['campaign', 'status'], name='dlog_campaign_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='deliverylog',
+            index=models.Index(fields=['campaign', 'recipient_email'], name='dlog_campaign_email_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='recipient',
+            index=models.Index(condition=models.Q(('subscription_status', 'subscribed')), fields=['id'], include=('domain',), name='recipient_subscribed_id_idx'),
+        ),
+        # the single-column FK index is dropped only once (campaign, status) covers it
+        migrations.AlterField(
+            model_name='deliverylog',
+            name='campaign',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='logs', to='campaigns.campaign'),
+        ),
+    ]
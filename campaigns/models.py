@@ -1,7 +1,12 @@
+from django.contrib.postgres.fields import ArrayField
+from django.contrib.postgres.indexes import GinIndex
+from django.core.cache import cache
 from django.db import models
 from django.utils import timezone
 from django.contrib.auth import get_user_model
 
+from .utils import email_domain
+
 class Recipient(models.Model):
     SUBSCRIBED = "subscribed"
     UNSUBSCRIBED = "unsubscribed"
@@ -9,14 +14,68 @@ class Recipient(models.Model):
 
     name = models.CharField(max_length=255, blank=True)
     email = models.EmailField(unique=True, db_index=True)
+    # precomputed from email (see save / importers) for per-domain batching and throttling
+    domain = models.CharField(max_length=255, blank=True, editable=False)
     subscription_status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=SUBSCRIBED)
+    tags = ArrayField(models.CharField(max_length=64), default=list, blank=True)
+    # custom fields from extra upload columns ({"city": "Oslo", "plan": "pro"}); GIN-indexed for segment rules
+    attributes = models.JSONField(default=dict, blank=True)
     created_on = models.DateTimeField(auto_now_add=True)
+    # segment refresh watermark: bulk updates and raw-SQL imports must set it too
+    updated_on = models.DateTimeField(auto_now=True, db_index=True)
 
     class Meta:
-            ordering = ["email"]
+            # no default ordering: hot paths order by id (the admin orders by email itself)
+            indexes = [
+                # dispatcher pages / audience counts: index-only scan over subscribed rows in id order
+                models.Index(
+                    fields=["id"], include=["domain"], condition=models.Q(subscription_status="subscribed"),
+                    name="recipient_subscribed_id_idx",
+                ),
+                models.Index(fields=["domain", "id"], name="recipient_domain_id_idx"),
+                GinIndex(fields=["tags"], name="recipient_tags_gin"),
+                GinIndex(fields=["attributes"], name="recipient_attributes_gin"),
+            ]
     
     def __str__(self): return self.email
 
+    def save(self, *args, **kwargs):
+        self.domain = email_domain(self.email)
+        if kwargs.get("update_fields") is not None and "email" in kwargs["update_fields"]:
+            kwargs["update_fields"] = {*kwargs["update_fields"], "domain"}
+        super().save(*args, **kwargs)
+
+class Segment(models.Model):
+    """
+    Saved audience: subscribed recipients matching `rules`. Membership is kept
+    precomputed as a bitmap of recipient ids (campaigns.segments.MemberSet),
+    topped up from Recipient.updated_on and rebuilt periodically.
+
+    rules: [{"field": "domain", "op": "in", "value": ["gmail.com"]},
+            {"field": "tags", "op": "has", "value": "vip"},
+            {"field": "attributes.plan", "op": "eq", "value": "pro"}]
+    """
+    ALL = "all"
+    ANY = "any"
+    MATCH_CHOICES = [(ALL, "All rules"), (ANY, "Any rule")]
+
+    name = models.CharField(max_length=255, unique=True)
+    rules = models.JSONField(default=list, blank=True)
+    match = models.CharField(max_length=3, choices=MATCH_CHOICES, default=ALL)
+    # precomputed membership (see campaigns.segments)
+    members = models.BinaryField(default=b"", editable=False)
+    member_count = models.IntegerField(default=0, editable=False)
+    version = models.IntegerField(default=0, editable=False)  # bumped on every refresh
+    refreshed_at = models.DateTimeField(null=True, blank=True, editable=False)
+    rebuilt_at = models.DateTimeField(null=True, blank=True, editable=False)
+    created_on = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self): return self.name
+
+    def clean(self):
+        from .segments import rules_to_q
+        rules_to_q(self.rules, self.match)  # raises ValidationError on bad rules
+
 class Campaign(models.Model):
     DRAFT = "draft"
     SCHEDULED = "scheduled"
@@ -25,23 +84,160 @@ class Campaign(models.Model):
     STATUS_CHOICES = [
         (DRAFT, "Draft"), (SCHEDULED, "Scheduled"), (IN_PROGRESS, "In Progress"), (COMPLETED, "Completed")
     ]
+    LOW = 1
+    NORMAL = 2
+    HIGH = 3
+    PRIORITY_CHOICES = [(LOW, "Low"), (NORMAL, "Normal"), (HIGH, "High")]
 
     name = models.CharField(max_length=255)
     subject = models.CharField(max_length=255)
     content = models.TextField()  # allow HTML
     scheduled_time = models.DateTimeField(null=True, blank=True)
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=DRAFT)
+    priority = models.PositiveSmallIntegerField(choices=PRIORITY_CHOICES, default=NORMAL)
+    # blank = every subscribed recipient
+    segment = models.ForeignKey(Segment, null=True, blank=True, on_delete=models.PROTECT, related_name="campaigns")
+    # dispatcher state (see campaigns.scheduler): last recipient id handed to a batch,
+    # carried-over round-robin credit, batches enqueued but not yet finished,
+    # and whether every batch has been enqueued
+    send_cursor = models.BigIntegerField(default=0)
+    dispatch_deficit = models.IntegerField(default=0)
+    batches_in_flight = models.IntegerField(default=0)
+    dispatch_completed = models.BooleanField(default=False)
+    # engagement totals, added by campaigns.tracking from buffered open/click events
+    open_count = models.IntegerField(default=0)
+    unique_open_count = models.IntegerField(default=0)
+    click_count = models.IntegerField(default=0)
+    unique_click_count = models.IntegerField(default=0)
     created_by = models.ForeignKey(get_user_model(), null=True, on_delete=models.SET_NULL)
     created_on = models.DateTimeField(auto_now_add=True)
 
     def __str__(self): return self.name
 
+class EngagementEvent(models.Model):
+    """
+    One open (tracking pixel) or click (redirect) of a campaign email.
+    Append-only, written in bulk with COPY by campaigns.tracking; recipient_id
+    is a plain id so deleting a recipient keeps the campaign's history.
+    """
+    OPEN = "open"
+    CLICK = "click"
+    KIND_CHOICES = [(OPEN, "Open"), (CLICK, "Click")]
+
+    # indexed by the (campaign, kind) index below
+    campaign = models.ForeignKey(Campaign, on_delete=models.CASCADE, related_name="events", db_index=False)
+    recipient_id = models.BigIntegerField()
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    url = models.TextField(blank=True)
+    occurred_at = models.DateTimeField()
+
+    class Meta:
+        indexes = [models.Index(fields=["campaign", "kind"], name="event_campaign_kind_idx")]
+
+    def __str__(self): return f"{self.kind} {self.campaign_id}/{self.recipient_id}"
+
+class Suppression(models.Model):
+    """
+    Addresses that must never be mailed. `email` is blank for a domain-wide block.
+    Checked at send time through campaigns.suppression.SuppressionFilter.
+    """
+    BOUNCE = "bounce"
+    COMPLAINT = "complaint"
+    MANUAL = "manual"
+    REASON_CHOICES = [(BOUNCE, "Hard bounce"), (COMPLAINT, "Complaint"), (MANUAL, "Manual block")]
+
+    email = models.EmailField(blank=True)
+    domain = models.CharField(max_length=255, blank=True)
+    reason = models.CharField(max_length=20, choices=REASON_CHOICES, default=MANUAL)
+    note = models.TextField(blank=True)
+    created_on = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=["email", "domain"], name="unique_suppression")]
+
+    def __str__(self): return self.email or f"*@{self.domain}"
+
+class ImportJob(models.Model):
+    """
+    A recipient upload imported in the background on the `imports` Celery queue
+    (see tasks.run_import_job). The admin upload page polls it for progress.
+    """
+    PENDING = "pending"
+    RUNNING = "running"
+    COMPLETED = "completed"
+    FAILED = "failed"
+    STATUS_CHOICES = [(PENDING, "Pending"), (RUNNING, "Running"), (COMPLETED, "Completed"), (FAILED, "Failed")]
+    # pipeline phases reported by RecipientImporterParallel
+    QUEUED = "queued"
+    READING = "reading"    # streaming an Excel workbook into CSV
+    LOADING = "loading"    # parse + validate + COPY into staging
+    MERGING = "merging"    # upsert into campaigns_recipient
+    DONE = "done"
+    PHASE_CHOICES = [
+        (QUEUED, "Queued"), (READING, "Reading workbook"), (LOADING, "Loading rows"), (MERGING, "Merging"), (DONE, "Done")
+    ]
+
+    file = models.FileField(upload_to="imports/%Y/%m/%d/")
+    original_name = models.CharField(max_length=255)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=PENDING)
+    phase = models.CharField(max_length=20, choices=PHASE_CHOICES, default=QUEUED)
+    rows_processed = models.BigIntegerField(default=0)
+    stats = models.JSONField(default=dict, blank=True)  # RecipientImporterParallel.run() result
+    # merge mode: recipient fields overwritten from the file (importer_v2.UPDATABLE_FIELDS)
+    update_fields = models.JSONField(default=list, blank=True)
+    # chunked uploads (see campaigns.uploads): declared size and bytes received so far;
+    # upload_size is null for files sent in one request
+    upload_size = models.BigIntegerField(null=True, blank=True)
+    upload_offset = models.BigIntegerField(default=0)
+    error = models.TextField(blank=True)
+    created_by = models.ForeignKey(get_user_model(), null=True, on_delete=models.SET_NULL)
+    created_on = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ["-created_on"]
+
+    def __str__(self): return f"{self.original_name} ({self.status})"
+
+    @property
+    def is_finished(self): return self.status in (self.COMPLETED, self.FAILED)
+
+    @property
+    def upload_complete(self): return self.upload_size is None or self.upload_offset >= self.upload_size
+
+    # live progress of a running job lives in the cache: it is reported while
+    # the importer's COPY holds the database connection
+    PROGRESS_TTL = 24 * 3600
+
+    def _progress_key(self): return f"import_job:{self.pk}:progress"
+
+    def set_progress(self, phase, rows):
+        cache.set(self._progress_key(), {"phase": phase, "rows_processed": rows}, self.PROGRESS_TTL)
+
+    def get_progress(self):
+        """(phase, rows_processed): live values while running, stored ones once finished."""
+        if self.status == self.RUNNING:
+            live = cache.get(self._progress_key())
+            if live:
+                return live["phase"], live["rows_processed"]
+        return self.phase, self.rows_processed
+
 class DeliveryLog(models.Model):
-    campaign = models.ForeignKey(Campaign, related_name="logs", on_delete=models.CASCADE)
+    # indexed by the (campaign, status) index below
+    campaign = models.ForeignKey(Campaign, related_name="logs", on_delete=models.CASCADE, db_index=False)
     recipient = models.ForeignKey(Recipient, null=True, on_delete=models.SET_NULL)
     recipient_email = models.EmailField(db_index=True)
-    status = models.CharField(max_length=10, choices=[("sent","Sent"),("failed","Failed")])
+    status = models.CharField(max_length=10, choices=[("sent","Sent"),("failed","Failed"),("suppressed","Suppressed")])
     failure_reason = models.TextField(blank=True, null=True)
     sent_at = models.DateTimeField(default=timezone.now)
 
+    class Meta:
+        indexes = [
+            # finalize / delivery stats: per-campaign counts by status from the index alone
+            models.Index(fields=["campaign", "status"], name="dlog_campaign_status_idx"),
+            # campaign report, streamed in recipient_email order without a sort
+            models.Index(fields=["campaign", "recipient_email"], name="dlog_campaign_email_idx"),
+        ]
+
     def __str__(self): return f"{self.campaign.name} to {self.recipient_email} - {self.status}"
\ No newline at end of file
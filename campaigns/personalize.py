@@ -0,0 +1,66 @@
+"""
+Per-recipient placeholders in campaign subject and content.
+
+`{{ name }}` and `{{ email }}` come from the recipient row, `{{ unsubscribe_url }}`
+is the recipient's signed one-click link (see unsubscribe), any other
+`{{ key }}` from Recipient.attributes (missing keys render as ""). Batches
+are fetched with `attributes` deferred and only the keys the campaign
+actually references extracted in SQL (attributes->>'key'), so wide
+attribute sets are never shipped to the sender workers.
+"""
+import re
+from html import escape
+
+from django.db.models.fields.json import KeyTextTransform
+
+from .models import Recipient
+from .unsubscribe import unsubscribe_url
+
+PLACEHOLDER = re.compile(r"\{\{\s*([A-Za-z0-9_.-]+)\s*\}\}")
+BUILTIN_FIELDS = ("name", "email", "unsubscribe_url")
+
+
+def template_fields(campaign) -> list:
+    """Attribute keys referenced by the campaign's subject or content, sorted."""
+    keys = set(PLACEHOLDER.findall(campaign.subject or "")) | set(PLACEHOLDER.findall(campaign.content or ""))
+    return sorted(keys - set(BUILTIN_FIELDS))
+
+
+def fetch_recipients(recipient_ids, keys) -> dict:
+    """
+    {id: Recipient} like in_bulk, without the attributes column; each
+    recipient gets `template_values` holding just the requested keys.
+    """
+    aliases = {f"attr_{i}": key for i, key in enumerate(keys)}
+    queryset = Recipient.objects.filter(pk__in=recipient_ids).defer("attributes").annotate(
+        **{alias: KeyTextTransform(key, "attributes") for alias, key in aliases.items()}
+    )
+    recipients = {}
+    for recipient in queryset:
+        recipient.template_values = {key: getattr(recipient, alias) for alias, key in aliases.items()}
+        recipients[recipient.pk] = recipient
+    return recipients
+
+
+def recipient_values(recipient) -> dict:
+    """Placeholder values of one recipient; the built-in fields win over attributes."""
+    values = getattr(recipient, "template_values", None)
+    if values is None:
+        values = recipient.attributes or {}
+    return {
+        **values, "name": recipient.name, "email": recipient.email,
+        "unsubscribe_url": unsubscribe_url(recipient.pk),
+    }
+
+
+def render(text: str, values: dict, html: bool = True) -> str:
+    """Fill placeholders in `text`; values are HTML-escaped unless html=False."""
+    if not text or "{{" not in text:
+        return text
+
+    def substitute(match):
+        value = values.get(match.group(1))
+        value = "" if value is None else str(value)
+        return escape(value) if html else value
+
+    return PLACEHOLDER.sub(substitute, text)
@@ -0,0 +1,181 @@
+"""
+On-demand sampling profiler for Celery tasks.
+
+Profiling is requested for a target, either a task name
+("campaigns.tasks.send_batch") or a campaign ("campaign:42", which covers
+send_batch / start_campaign_send / finalize_campaign of that campaign), for
+a limited time:
+
+    celery -A mailer_project control profile campaign:42 300
+    # or from a shell: campaigns.profiling.request_profile("campaigns.tasks.send_batch", 300)
+
+(the `profile` remote control command is registered in mailer_project/celery.py,
+which the celery CLI imports without setting up Django).
+
+The requested targets live under one cache key (Redis), so every worker
+process picks them up without a restart; each process re-reads the key at
+most every PROFILE_FLAG_REFRESH_SECONDS, which keeps the cost for tasks
+that are not profiled to a dict lookup.
+
+A selected execution is sampled with a signal timer (SIGPROF on CPU time by
+default, SIGALRM on wall time with PROFILE_CLOCK = "wall" to include time
+spent waiting on providers) every PROFILE_INTERVAL_MS. The stacks are
+appended in collapsed format ("root;frame;frame count") to
+PROFILE_DIR/<hostname>.<pid>.folded, one file per worker process, ready for
+flamegraph.pl or speedscope.
+"""
+import os
+import time
+import signal
+import socket
+import logging
+import threading
+from collections import Counter
+
+from celery.signals import task_postrun, task_prerun
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+TARGETS_KEY = "profile-targets"
+MAX_SECONDS = 3600
+MAX_DEPTH = 128
+CAMPAIGN_TASKS = {
+    "campaigns.tasks.send_batch",
+    "campaigns.tasks.start_campaign_send",
+    "campaigns.tasks.finalize_campaign",
+}
+CLOCKS = {
+    "cpu": (signal.ITIMER_PROF, signal.SIGPROF),
+    "wall": (signal.ITIMER_REAL, signal.SIGALRM),
+}
+
+
+# -------------------------
+# requested targets
+# -------------------------
+def request_profile(target: str, seconds: int = 300) -> dict:
+    """Profile `target` (task name or "campaign:<id>") for `seconds`; 0 cancels. Returns active targets."""
+    seconds = min(int(seconds), MAX_SECONDS)
+    now = time.time()
+    targets = {name: until for name, until in (cache.get(TARGETS_KEY) or {}).items() if until > now}
+    if seconds > 0:
+        targets[target] = now + seconds
+    else:
+        targets.pop(target, None)
+    cache.set(TARGETS_KEY, targets, MAX_SECONDS)
+    logger.info(f"Profiling targets: {sorted(targets) or 'none'}")
+    return targets
+
+
+def active_targets() -> dict:
+    """{target: expires_at} of the requests that have not expired yet."""
+    now = time.time()
+    return {name: until for name, until in (cache.get(TARGETS_KEY) or {}).items() if until > now}
+
+
+_targets = {}
+_targets_read_at = float("-inf")
+
+
+def _current_targets() -> dict:
+    global _targets, _targets_read_at
+    now = time.monotonic()
+    if now - _targets_read_at >= settings.PROFILE_FLAG_REFRESH_SECONDS:
+        _targets = active_targets()
+        _targets_read_at = now
+    return _targets
+
+
+def selected(task_name: str, args) -> str:
+    """Target under which this execution should be profiled, or None."""
+    targets = _current_targets()
+    if not targets:
+        return None
+    now = time.time()
+    if targets.get(task_name, 0) > now:
+        return task_name
+    if task_name in CAMPAIGN_TASKS and args:
+        target = f"campaign:{args[0]}"
+        if targets.get(target, 0) > now:
+            return target
+    return None
+
+
+# -------------------------
+# sampler
+# -------------------------
+def _collapse(frame) -> str:
+    names = []
+    while frame is not None and len(names) < MAX_DEPTH:
+        names.append(f"{frame.f_globals.get('__name__', '?')}:{frame.f_code.co_name}")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+class Sampler:
+    """Counts the stacks seen on each timer tick (main thread only)."""
+
+    def __init__(self, interval: float, clock: str = "cpu"):
+        self.interval = interval
+        self.timer, self.signum = CLOCKS[clock]
+        self.stacks = Counter()
+        self._previous = None
+
+    def _sample(self, signum, frame):
+        self.stacks[_collapse(frame)] += 1
+
+    def start(self) -> bool:
+        if threading.current_thread() is not threading.main_thread():
+            logger.warning("Profiler needs the main thread (prefork pool); execution not sampled")
+            return False
+        self._previous = signal.signal(self.signum, self._sample)
+        signal.setitimer(self.timer, self.interval, self.interval)
+        return True
+
+    def stop(self):
+        signal.setitimer(self.timer, 0)
+        signal.signal(self.signum, self._previous if self._previous is not None else signal.SIG_DFL)
+
+    @property
+    def samples(self) -> int:
+        return sum(self.stacks.values())
+
+    def folded(self, root: str) -> str:
+        return "".join(f"{root};{stack} {count}\n" for stack, count in self.stacks.items())
+
+
+def output_path(hostname: str = None) -> str:
+    hostname = (hostname or socket.gethostname()).replace(os.sep, "_")
+    return os.path.join(settings.PROFILE_DIR, f"{hostname}.{os.getpid()}.folded")
+
+
+# -------------------------
+# Celery: sample selected task executions
+# -------------------------
+_running = {}  # task_id -> (Sampler, root frame)
+
+
+@task_prerun.connect
+def _start_sampler(task_id=None, task=None, args=None, **kwargs):
+    target = selected(task.name, args)
+    if target is None:
+        return
+    sampler = Sampler(settings.PROFILE_INTERVAL_MS / 1000, settings.PROFILE_CLOCK)
+    if sampler.start():
+        _running[task_id] = (sampler, f"{task.name} [{target}]")
+
+
+@task_postrun.connect
+def _write_samples(task_id=None, task=None, **kwargs):
+    entry = _running.pop(task_id, None)
+    if entry is None:
+        return
+    sampler, root = entry
+    sampler.stop()
+    path = output_path(getattr(task.request, "hostname", None))
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "a") as out:
+        out.write(sampler.folded(root))
+    logger.info(f"Profiled {root} ({task_id}): {sampler.samples} samples -> {path}")
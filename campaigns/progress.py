@@ -0,0 +1,129 @@
+"""
+Live campaign progress kept in the cache (Redis in production).
+
+start_campaign_send records the audience size, send_batch adds what each
+batch did (sent / failed / suppressed) and finalize_campaign marks the end,
+so a progress snapshot is one get_many and never touches PostgreSQL:
+
+    {"campaign": 42, "status": "in_progress", "total": 10000, "sent": 5200,
+     "failed": 12, "suppressed": 40, "pending": 4748, "rate": 85.3, "eta_seconds": 56}
+
+`rate` is recipients handled per second over the last RATE_WINDOW seconds
+(counted in RATE_BUCKET-second buckets); `eta_seconds` is pending / rate.
+Keys expire PROGRESS_TTL after the campaign started. Updates are best
+effort: a cache outage is logged and never fails (and so retries) a batch.
+
+The endpoints serve staff sessions, or anyone holding the campaign's
+token (make_token, HMAC-SHA256 with PROGRESS_SECRET_KEY) as `?token=`,
+e.g. a wallboard.
+"""
+import time
+import logging
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+
+from . import signing
+
+logger = logging.getLogger(__name__)
+
+PROGRESS_TTL = 7 * 24 * 3600
+RATE_BUCKET = 5
+RATE_WINDOW = 60
+COUNTERS = ("sent", "failed", "suppressed")
+KEY_SALT = "campaigns.progress"
+
+
+def make_token(campaign_id: int) -> str:
+    """Read access to one campaign's progress."""
+    return signing.signature(str(campaign_id), KEY_SALT, settings.PROGRESS_SECRET_KEY)
+
+
+def valid_token(campaign_id: int, token: str) -> bool:
+    return signing.verify(str(campaign_id), token or "", KEY_SALT, settings.PROGRESS_SECRET_KEY)
+
+
+def _key(campaign_id, name):
+    return f"progress:{campaign_id}:{name}"
+
+
+def _incr(key, amount, ttl=PROGRESS_TTL):
+    cache.add(key, 0, ttl)
+    try:
+        return cache.incr(key, amount)
+    except ValueError:
+        # expired between add and incr
+        cache.set(key, amount, ttl)
+        return amount
+
+
+def best_effort(func):
+    @wraps(func)
+    def wrapper(campaign_id, *args, **kwargs):
+        try:
+            func(campaign_id, *args, **kwargs)
+        except Exception as exc:
+            logger.warning(f"Progress of Campaign ID: {campaign_id} not updated ({func.__name__}): {exc}")
+    return wrapper
+
+
+@best_effort
+def start(campaign_id: int, total: int):
+    """Register the audience size; counters survive a re-run of start_campaign_send."""
+    cache.set_many({
+        _key(campaign_id, "total"): total,
+        _key(campaign_id, "status"): "in_progress",
+    }, PROGRESS_TTL)
+    cache.add(_key(campaign_id, "started_at"), time.time(), PROGRESS_TTL)
+    for name in COUNTERS:
+        cache.add(_key(campaign_id, name), 0, PROGRESS_TTL)
+
+
+@best_effort
+def record(campaign_id: int, sent: int = 0, failed: int = 0, suppressed: int = 0):
+    """Add one batch's outcome."""
+    done = 0
+    for name, amount in zip(COUNTERS, (sent, failed, suppressed)):
+        if amount:
+            _incr(_key(campaign_id, name), amount)
+            done += amount
+    if done:
+        bucket = int(time.time()) // RATE_BUCKET
+        _incr(_key(campaign_id, f"rate:{bucket}"), done, RATE_WINDOW + RATE_BUCKET)
+
+
+@best_effort
+def finish(campaign_id: int, status: str = "completed"):
+    cache.set(_key(campaign_id, "status"), status, PROGRESS_TTL)
+
+
+def snapshot(campaign_id: int, now: float = None) -> dict:
+    """Current progress, or None when nothing was recorded for the campaign."""
+    now = time.time() if now is None else now
+    current = int(now) // RATE_BUCKET
+    buckets = [_key(campaign_id, f"rate:{bucket}") for bucket in range(current - RATE_WINDOW // RATE_BUCKET + 1, current + 1)]
+    names = ["total", "status", "started_at", *COUNTERS]
+    values = cache.get_many([_key(campaign_id, name) for name in names] + buckets)
+    if _key(campaign_id, "total") not in values:
+        return None
+
+    state = {name: values.get(_key(campaign_id, name)) for name in names}
+    counts = {name: int(state[name] or 0) for name in COUNTERS}
+    total = int(state["total"])
+    pending = max(0, total - sum(counts.values()))
+
+    # recent throughput; a campaign younger than the window is averaged over its age
+    recent = sum(int(values.get(key) or 0) for key in buckets)
+    elapsed = min(RATE_WINDOW, max(1.0, now - (state["started_at"] or now)))
+    rate = recent / elapsed
+    done = state["status"] != "in_progress"
+    return {
+        "campaign": campaign_id,
+        "status": state["status"],
+        "total": total,
+        **counts,
+        "pending": 0 if done else pending,
+        "rate": round(rate, 1),
+        "eta_seconds": 0 if done or not pending else (round(pending / rate) if rate else None),
+    }
@@ -2,17 +2,23 @@ import logging
 from django.conf import settings
 from django.core.mail import EmailMessage
 
+from .metrics import EMAILS, SEND_SECONDS
+from .personalize import recipient_values, render
+from .tracing import span
+from .tracking import instrument
+from .unsubscribe import list_unsubscribe_headers
+
 logger = logging.getLogger(__name__)
 
 # Try SendGrid first (if API key present); otherwise fallback to SMTP
 try:
     from sendgrid import SendGridAPIClient
-    from sendgrid.helpers.mail import Mail
+    from sendgrid.helpers.mail import Header, Mail
     SENDGRID_AVAILABLE = True
 except Exception:
     SENDGRID_AVAILABLE = False
 
-def send_via_sendgrid(subject: str, html_content: str, recipient_email: str, from_email=None):
+def send_via_sendgrid(subject: str, html_content: str, recipient_email: str, from_email=None, headers=None):
     """Send email via SendGrid API"""
     if not SENDGRID_AVAILABLE:
         raise RuntimeError("SendGrid package not installed")
@@ -29,18 +35,21 @@ def send_via_sendgrid(subject: str, html_content: str, recipient_email: str, fro
         subject=subject,
         html_content=html_content,
     )
+    for key, value in (headers or {}).items():
+        message.add_header(Header(key, value))
     
     client = SendGridAPIClient(api_key)
     response = client.send(message)
     logger.info(f"SendGrid sent email to {recipient_email}: Status {response.status_code}")
     return response.status_code, response.body
 
-def send_via_smtp(subject: str, html_content: str, recipient_email: str, from_email=None):
+def send_via_smtp(subject: str, html_content: str, recipient_email: str, from_email=None, headers=None):
     msg = EmailMessage(
         subject=subject,
         body=html_content,
         from_email=from_email or settings.DEFAULT_FROM_EMAIL,
         to=[recipient_email],
+        headers=headers,
     )
     msg.content_subtype = "html"
     # Use django's email connection (configured by settings)
@@ -53,24 +62,36 @@ def send_email_to_recipient(campaign, recipient):
     Attempt to send email via provider, fallback to SMTP.
     Raises exception on irrecoverable failure.
     """
-    subject = campaign.subject
-    html = campaign.content  # content should be safe / sanitized upstream
+    values = recipient_values(recipient)
+    subject = render(campaign.subject, values, html=False)
+    html = render(campaign.content, values)  # content should be safe / sanitized upstream
+    html = instrument(html, campaign.pk, recipient.pk)  # click redirects + open pixel
     email = recipient.email
+    # RFC 8058 one-click unsubscribe (List-Unsubscribe + List-Unsubscribe-Post)
+    headers = list_unsubscribe_headers(recipient.pk)
 
     # Rate limiting / pacing could be handled here (sleep between requests) but
     # prefer Celery rate_limit at task level. Minimal backoff on provider errors.
+    provider = "smtp"
     try:
         if settings.SENDGRID_API_KEY and SENDGRID_AVAILABLE:
-            code, _ = send_via_sendgrid(subject, html, email)
+            provider = "sendgrid"
+            with span("provider.send", provider=provider), SEND_SECONDS.labels(provider).time():
+                code, _ = send_via_sendgrid(subject, html, email, headers=headers)
             if 200 <= int(code) < 300:
+                EMAILS.labels(provider, "sent").inc()
                 return "sent"
             # non-2xx from provider => fallback to smtp
+            provider = "smtp"
         # Fallback to SMTP
-        code, _ = send_via_smtp(subject, html, email)
+        with span("provider.send", provider=provider), SEND_SECONDS.labels(provider).time():
+            code, _ = send_via_smtp(subject, html, email, headers=headers)
         if code and int(code) < 400:
+            EMAILS.labels(provider, "sent").inc()
             return "sent"
         raise RuntimeError(f"SMTP returned code {code}")
     except Exception as exc:
+        EMAILS.labels(provider, "failed").inc()
         logger.exception("Failed to send email to %s: %s", email, exc)
         raise
 
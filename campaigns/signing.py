@@ -0,0 +1,21 @@
+"""
+Short HMAC-SHA256 signatures for links in emails (unsubscribe, tracking).
+
+Each purpose has its own salt and secret, so a token minted for one can
+never be replayed against another. Verifying is pure computation: no
+database access.
+"""
+import base64
+
+from django.utils.crypto import constant_time_compare, salted_hmac
+
+SIGNATURE_BYTES = 16  # 128 bits, 22 URL-safe characters
+
+
+def signature(value: str, salt: str, secret: str) -> str:
+    digest = salted_hmac(salt, value, secret=secret, algorithm="sha256").digest()
+    return base64.urlsafe_b64encode(digest[:SIGNATURE_BYTES]).rstrip(b"=").decode()
+
+
+def verify(value: str, given: str, salt: str, secret: str) -> bool:
+    return bool(secret) and constant_time_compare(given, signature(value, salt, secret))
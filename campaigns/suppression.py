@@ -0,0 +1,149 @@
+"""
+Global suppression list check for the send path.
+
+Suppressed addresses (hard bounces, complaints, manual blocks) live in the
+Suppression table, keyed by normalized email or by whole domain. Every sender
+process keeps a Bloom filter of those keys in memory:
+
+- it is rebuilt from the database every SUPPRESSION_REBUILD_SECONDS (to drop
+  deleted entries) and topped up incrementally every
+  SUPPRESSION_REFRESH_SECONDS; the top-up re-reads the last REFRESH_ID_OVERLAP
+  ids below the highest one seen, because ids are allocated at insert but
+  become visible at commit, so a slower transaction can commit a lower id
+  after a higher one was already read
+- a negative answer is final, so almost every recipient is cleared with one
+  hash and no query
+- positive answers from one batch are confirmed with a single database query
+"""
+import re
+import time
+import logging
+import smtplib
+
+from django.conf import settings
+from django.db.models import Q
+
+from .bloom import BloomFilter
+from .models import Suppression
+from .utils import email_domain
+
+try:
+    from python_http_client.exceptions import HTTPError as SendGridHTTPError  # installed with sendgrid
+except Exception:
+    SendGridHTTPError = None
+
+logger = logging.getLogger(__name__)
+
+# SendGrid v3 error fields that point at a recipient address, e.g. "personalizations.0.to.0.email"
+SENDGRID_RECIPIENT_FIELD = re.compile(r"personalizations\.\d+\.(to|cc|bcc)\.\d+\.email")
+
+MIN_CAPACITY = 100_000
+FETCH_CHUNK = 10_000
+REFRESH_ID_OVERLAP = 1_000
+
+
+def email_key(email: str) -> str:
+    return f"e:{email}"
+
+
+def domain_key(domain: str) -> str:
+    return f"d:{domain}"
+
+
+def suppress(email: str = "", domain: str = "", reason: str = Suppression.MANUAL, note: str = ""):
+    """Add an address (or a whole domain if only `domain` is given) to the suppression list."""
+    email = (email or "").strip().lower()
+    domain = (domain or email_domain(email)).strip().lower()
+    obj, _ = Suppression.objects.get_or_create(
+        email=email, domain=domain, defaults={"reason": reason, "note": note}
+    )
+    return obj
+
+
+def is_hard_bounce(exc: Exception) -> bool:
+    """
+    The provider rejected the recipient permanently: SMTP 5xx (e.g. unknown
+    mailbox), or a SendGrid 400 whose errors name the recipient address.
+    SendGrid accepts (202) most deliverable-looking addresses and bounces
+    them later; those asynchronous bounces are not seen here.
+    """
+    if isinstance(exc, smtplib.SMTPRecipientsRefused):
+        return any(500 <= code < 600 for code, _ in exc.recipients.values())
+    if SendGridHTTPError is not None and isinstance(exc, SendGridHTTPError) and exc.status_code == 400:
+        try:
+            errors = exc.to_dict.get("errors") or []
+            return any(SENDGRID_RECIPIENT_FIELD.fullmatch(str(error.get("field") or "")) for error in errors)
+        except (AttributeError, TypeError, ValueError):
+            return False  # not the JSON error body of the v3 API
+    return False
+
+
+class SuppressionFilter:
+
+    def __init__(self):
+        self.bloom = None
+        self.last_id = 0
+        self.built_at = 0.0
+        self.refreshed_at = 0.0
+
+    def _rebuild(self):
+        count = Suppression.objects.count()
+        bloom = BloomFilter(max(MIN_CAPACITY, count * 2), settings.SUPPRESSION_BLOOM_ERROR_RATE)
+        last_id = 0
+        rows = Suppression.objects.order_by().values_list("id", "email", "domain").iterator(chunk_size=FETCH_CHUNK)
+        for pk, email, domain in rows:
+            bloom.add(email_key(email) if email else domain_key(domain))
+            last_id = max(last_id, pk)
+        self.bloom, self.last_id = bloom, last_id
+        self.built_at = self.refreshed_at = time.monotonic()
+        logger.info(f"Suppression filter rebuilt with {count} entries ({len(bloom.bits) // 1024} KB)")
+
+    def _refresh(self):
+        # adding a key twice is harmless; the overlap catches late commits
+        since = max(0, self.last_id - REFRESH_ID_OVERLAP)
+        rows = Suppression.objects.filter(id__gt=since).order_by("id").values_list("id", "email", "domain")
+        for pk, email, domain in rows.iterator(chunk_size=FETCH_CHUNK):
+            self.bloom.add(email_key(email) if email else domain_key(domain))
+            self.last_id = max(self.last_id, pk)
+        self.refreshed_at = time.monotonic()
+
+    def _ensure_fresh(self):
+        now = time.monotonic()
+        if self.bloom is None or self.bloom.is_full or now - self.built_at >= settings.SUPPRESSION_REBUILD_SECONDS:
+            self._rebuild()
+        elif now - self.refreshed_at >= settings.SUPPRESSION_REFRESH_SECONDS:
+            self._refresh()
+
+    def suppressed_emails(self, recipients) -> set:
+        """Emails of `recipients` that are on the suppression list."""
+        self._ensure_fresh()
+        bloom = self.bloom
+        candidates = [
+            r for r in recipients
+            if email_key(r.email) in bloom or domain_key(r.domain) in bloom
+        ]
+        if not candidates:
+            return set()
+
+        # confirm bloom hits with one query
+        emails = {r.email for r in candidates}
+        domains = {r.domain for r in candidates}
+        confirmed = Suppression.objects.filter(Q(email__in=emails) | Q(email="", domain__in=domains))
+        blocked_emails, blocked_domains = set(), set()
+        for email, domain in confirmed.values_list("email", "domain"):
+            if email:
+                blocked_emails.add(email)
+            else:
+                blocked_domains.add(domain)
+        return {r.email for r in candidates if r.email in blocked_emails or r.domain in blocked_domains}
+
+
+_filter = None
+
+
+def get_suppression_filter() -> SuppressionFilter:
+    """Per-process filter (each Celery worker child builds its own)."""
+    global _filter
+    if _filter is None:
+        _filter = SuppressionFilter()
+    return _filter
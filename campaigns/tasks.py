@@ -1,20 +1,33 @@
 import csv
 import os
+import time
 import logging
+from collections import Counter, defaultdict, deque
 from io import StringIO
 
 from celery import shared_task, Task
-from django.db import transaction
+from django.db import connection, transaction
+from django.db.models import F, Max
 from django.conf import settings
+from django.core.cache import cache
 from django.core.mail import EmailMessage
 
-from .models import Campaign, Recipient, DeliveryLog
+from . import progress, scheduler, tracking, unsubscribe
+from .metrics import BATCH_SECONDS, FINALIZE_LAG, IMPORT_RATE, IMPORT_ROWS, SUPPRESSED, THROTTLE_WAIT
+from .models import Campaign, Recipient, DeliveryLog, Suppression, ImportJob, Segment
+from .personalize import fetch_recipients, template_fields
 from .providers import get_rate_limit_for_provider, send_email_to_recipient
+from .segments import get_members, refresh_segment
+from .suppression import get_suppression_filter, is_hard_bounce, suppress
+from .throttle import DomainThrottle
+from .tracing import campaign_trace, remember_campaign_trace, span, under
 
 logger = logging.getLogger(__name__)
 
 BATCH_SIZE = int(os.getenv("CAMPAIGN_BATCH_SIZE", 200))
 LOG_BATCH = 500  # delivery log bulk size
+DOMAIN_DEFER_SECONDS = int(os.getenv("DOMAIN_DEFER_SECONDS", 30))  # retry delay for throttled domains
+REFILL_DEDUPE_SECONDS = 2  # at most one refill pass queued per window (beat is the backstop)
 
 class BaseTaskWithRetry(Task):
     autoretry_for = (Exception,)
@@ -31,87 +44,265 @@ def check_scheduled_campaigns(self):
     logger.info("Checking for scheduled campaigns to start...")
     from django.utils import timezone as django_timezone
     now = django_timezone.now()  # Use Django timezone-aware now (respects USE_TZ and TIME_ZONE)
-    campaigns = Campaign.objects.filter(status=Campaign.SCHEDULED, scheduled_time__lte=now)
-    for c in campaigns:
-        # idempotency: mark as IN_PROGRESS inside transaction if still SCHEDULED
-        with transaction.atomic():
-            refreshed = Campaign.objects.select_for_update().get(pk=c.pk)
-
-            if refreshed.status != Campaign.SCHEDULED:
-                # Scenario: Two Celery beat schedulers running simultaneously (avoid double start_campaign_send)
-                continue
-            refreshed.status = Campaign.IN_PROGRESS
-            refreshed.save(update_fields=["status"])
-        # spawn starter task
-        start_campaign_send.delay(refreshed.pk)
-    logger.info(f"Found and started {campaigns.count()} scheduled campaigns.")
+    # idempotency: claim all due campaigns at once under row locks; a second beat
+    # scheduler running simultaneously skips the locked rows (no double start_campaign_send)
+    with transaction.atomic():
+        due = list(
+            Campaign.objects.select_for_update(skip_locked=True)
+            .filter(status=Campaign.SCHEDULED, scheduled_time__lte=now)
+            .values_list("pk", flat=True)
+        )
+        if due:
+            Campaign.objects.filter(pk__in=due).update(status=Campaign.IN_PROGRESS)
+    # spawn starter tasks
+    for campaign_id in due:
+        start_campaign_send.delay(campaign_id)
+    logger.info(f"Found and started {len(due)} scheduled campaigns.")
 
 @shared_task(name="campaigns.tasks.start_campaign_send")
 def start_campaign_send(campaign_id: int):
     """
-    Break recipients into batches and enqueue send_batch tasks.
-    Uses chunked DB querying to avoid loading all recipients at once.
+    Register the campaign with the batch dispatcher.
+    Batches are not enqueued here: dispatch_campaign_batches drips them into the
+    per-priority sender queues, sharing capacity fairly with other campaigns.
     """
     logger.info(f"Starting campaign send for Campaign ID: {campaign_id}")
-    # frequently-used recipient queryset (attached filtering here)
-    recipients_qs = Recipient.objects.filter(subscription_status="subscribed").order_by("id")
-    total = recipients_qs.count()
+    remember_campaign_trace(campaign_id)
+    total = campaign_audience_size(Campaign.objects.get(pk=campaign_id))
+    progress.start(campaign_id, total)
     if total == 0:
         # nothing to do: finalize immediately
+        Campaign.objects.filter(pk=campaign_id).update(dispatch_completed=True)
         finalize_campaign.delay(campaign_id)
         return
 
-    # chunk by id ranges for memory-efficiency
-    # fetch ids in pages to avoid large offsets
-    page_size = BATCH_SIZE
-    offset = 0
-    while offset < total:
-        ids = list(recipients_qs.values_list("id", flat=True)[offset:offset+page_size])
-        if not ids:
-            break
-        # enqueue send batch
-        send_batch.apply_async(args=[campaign_id, ids], queue="senders")
-        offset += page_size
-    logger.info(f"Enqueued send batches for {total} recipients in campaign ID: {campaign_id}")
+    # No batches are produced here. The dispatcher reads recipients lazily from
+    # Campaign.send_cursor, so a re-run resumes where the campaign left off.
+    # Serve the first batches now instead of waiting for the next beat tick.
+    dispatch_campaign_batches.delay()
+    logger.info(f"Registered {total} recipients of campaign ID: {campaign_id} with the dispatcher")
     # Optionally enqueue a finalizer that runs after tasks finish (we schedule with ETA or rely on finalizer to run after some time)
     # Simpler: schedule a finalize attempt after a reasonable TTL (e.g., 5 minutes + estimate)
     finalize_campaign.apply_async(args=[campaign_id], countdown=300)
 
-@shared_task(bind=True, name="campaigns.tasks.send_batch", base=BaseTaskWithRetry, rate_limit=get_rate_limit_for_provider())
+@shared_task(name="campaigns.tasks.dispatch_campaign_batches")
+def dispatch_campaign_batches(budget: int = None):
+    """
+    Run every few seconds (via beat) and whenever a campaign's outstanding batches
+    drop below the refill low-water mark. Enqueue the next batches of all
+    IN_PROGRESS campaigns using deficit round-robin weighted by campaign priority,
+    never exceeding scheduler.SEND_WINDOW outstanding batches per campaign.
+    Campaign rows are locked with SKIP LOCKED so overlapping runs never hand out
+    the same recipients twice.
+    """
+    budget = scheduler.BATCHES_PER_TICK if budget is None else budget
+    with transaction.atomic():
+        campaigns = {
+            c.pk: c for c in Campaign.objects.select_for_update(skip_locked=True)
+            .filter(status=Campaign.IN_PROGRESS, dispatch_completed=False)
+            .order_by("-priority", "id")
+        }
+        if not campaigns:
+            return {"dispatched": 0}
+
+        recipients_qs = Recipient.objects.filter(subscription_status="subscribed").order_by("id")
+
+        def next_rows(campaign):
+            if campaign.segment_id is None:
+                rows = list(recipients_qs.filter(id__gt=campaign.send_cursor).values_list("id", "domain")[:BATCH_SIZE])
+                if rows:
+                    campaign.send_cursor = rows[-1][0]
+                return rows
+            # segment: next member ids straight from the precomputed bitmap
+            members = get_members(campaign.segment_id)
+            while True:
+                ids = members.ids_after(campaign.send_cursor, BATCH_SIZE)
+                if not ids:
+                    return []
+                campaign.send_cursor = ids[-1]
+                rows = list(recipients_qs.filter(id__in=ids).values_list("id", "domain"))
+                if rows:  # else all deleted/unsubscribed since the last refresh
+                    return rows
+
+        traces = {}
+
+        def enqueue(campaign_id, ids, queue):
+            # batches join the campaign's trace, not the dispatcher tick's
+            with under(traces[campaign_id]):
+                send_batch.apply_async(args=[campaign_id, ids], queue=queue)
+
+        def take(campaign_id):
+            campaign = campaigns[campaign_id]
+            rows = next_rows(campaign)
+            if not rows:
+                return False
+            ids = plan_batch(rows)
+            queue = scheduler.queue_for_priority(campaign.priority)
+            if campaign_id not in traces:
+                traces[campaign_id] = campaign_trace(campaign_id)
+            # enqueue only once the cursor move is committed
+            transaction.on_commit(lambda ids=ids, queue=queue: enqueue(campaign_id, ids, queue))
+            return True
+
+        flows = [
+            scheduler.Flow(
+                c.pk, scheduler.PRIORITY_WEIGHTS[c.priority], c.dispatch_deficit,
+                capacity=scheduler.SEND_WINDOW - c.batches_in_flight,
+            )
+            for c in campaigns.values()
+        ]
+        dispatched = scheduler.deficit_round_robin(flows, budget, take)
+
+        for flow in flows:
+            campaign = campaigns[flow.key]
+            campaign.dispatch_deficit = flow.deficit
+            campaign.dispatch_completed = flow.exhausted
+            # row is locked, so concurrent releases from send_batch wait for us
+            campaign.batches_in_flight += dispatched[flow.key]
+            campaign.save(update_fields=["send_cursor", "dispatch_deficit", "batches_in_flight", "dispatch_completed"])
+            if flow.exhausted:
+                logger.info(f"All batches dispatched for Campaign ID: {flow.key}")
+
+    logger.info(f"Dispatched {sum(dispatched.values())} batches across {len(campaigns)} campaigns: {dispatched}")
+    return {"dispatched": sum(dispatched.values()), "per_campaign": dispatched}
+
+def campaign_audience_size(campaign):
+    """Recipients a campaign targets. A segment is topped up first so a new campaign sees recent changes."""
+    if campaign.segment_id is None:
+        return Recipient.objects.filter(subscription_status="subscribed").count()
+    return refresh_segment(campaign.segment_id).member_count
+
+def plan_batch(rows):
+    """
+    Group one page of (id, domain) rows by recipient domain and interleave the
+    groups (gmail, outlook, yahoo, gmail, ...), so a batch never hammers a single
+    receiving domain with consecutive sends. Largest domains lead each round.
+    """
+    by_domain = defaultdict(deque)
+    for recipient_id, domain in rows:
+        by_domain[domain].append(recipient_id)
+
+    ordered = []
+    groups = sorted(by_domain.values(), key=len, reverse=True)
+    while groups:
+        for group in groups:
+            ordered.append(group.popleft())
+        groups = [group for group in groups if group]
+    return ordered
+
+def release_batch_slot(campaign_id: int):
+    """
+    Free one slot of the campaign's dispatch window and ask the dispatcher for
+    more work once the campaign drains to the low-water mark.
+    The decrement returns the new count (UPDATE ... RETURNING), so batches
+    finishing concurrently each see their own value; every release at or
+    below the mark asks, since an exact match could be skipped by both. A
+    release with no slot held (a retried batch) changes nothing and asks nothing.
+    The asks are deduplicated with a short cache lock: one pass refills every
+    campaign, so the last batches finishing together queue it only once.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"UPDATE {Campaign._meta.db_table} SET batches_in_flight = batches_in_flight - 1 "
+            "WHERE id = %s AND batches_in_flight > 0 RETURNING batches_in_flight, dispatch_completed",
+            [campaign_id],
+        )
+        state = cursor.fetchone()
+    if state and not state[1] and state[0] <= scheduler.REFILL_LOW_WATER:
+        if cache.add("dispatch-refill", 1, REFILL_DEDUPE_SECONDS):
+            dispatch_campaign_batches.delay()
+
+def defer_recipients(campaign_id: int, recipient_ids: list, queue: str):
+    """Re-enqueue throttled recipients as a new (outstanding) batch after a short delay."""
+    Campaign.objects.filter(pk=campaign_id).update(batches_in_flight=F("batches_in_flight") + 1)
+    send_batch.apply_async(args=[campaign_id, recipient_ids], queue=queue, countdown=DOMAIN_DEFER_SECONDS)
+
+def flush_delivery_logs(campaign_id: int, logs: list) -> int:
+    """Write a chunk of delivery logs and add their outcome to the live progress counters."""
+    with span("deliverylog.flush", rows=len(logs)):
+        DeliveryLog.objects.bulk_create(logs, ignore_conflicts=True)
+    outcome = Counter(log.status for log in logs)
+    progress.record(campaign_id, sent=outcome["sent"], failed=outcome["failed"], suppressed=outcome["suppressed"])
+    return len(logs)
+
+class SendBatchTask(BaseTaskWithRetry):
+    def on_failure(self, exc, task_id, args, kwargs, einfo):
+        # retries exhausted: the batch is no longer outstanding
+        campaign_id = args[0] if args else kwargs.get("campaign_id")
+        release_batch_slot(campaign_id)
+        super().on_failure(exc, task_id, args, kwargs, einfo)
+
+@shared_task(bind=True, name="campaigns.tasks.send_batch", base=SendBatchTask, rate_limit=get_rate_limit_for_provider())
 def send_batch(self, campaign_id: int, recipient_ids: list):
     """
     Send emails to one batch of recipients.
     - rate_limit decorator helps respect provider constraints (per worker).
-    - Uses bulk_create for DeliveryLog for efficiency.
+    - Recipients are sent in the planned (domain-interleaved) order; per-domain
+      rate/concurrency caps are enforced via DomainThrottle and recipients of a
+      saturated domain are deferred to a follow-up batch instead of waiting.
+    - Suppressed addresses (bounces, complaints, blocks) are skipped and logged
+      as "suppressed"; the check is an in-memory Bloom filter per worker.
+    - Uses bulk_create for DeliveryLog for efficiency; each flush also adds to the
+      campaign's live progress counters (see progress).
+    - Placeholders are filled per recipient; the batch read extracts only the
+      attribute keys the campaign uses instead of whole attribute objects.
     """
     logger.info(f"Sending batch for Campaign ID: {campaign_id} to {len(recipient_ids)} recipients.")
+    started = time.monotonic()
     campaign = Campaign.objects.get(pk=campaign_id)
-    recipients = list(Recipient.objects.filter(id__in=recipient_ids))
+    # only the attribute keys the templates reference are read (see personalize)
+    recipients = fetch_recipients(recipient_ids, template_fields(campaign))
+    suppressed = get_suppression_filter().suppressed_emails(recipients.values())
+    throttle = DomainThrottle()
+    saturated = set()
+    deferred = []
     logs = []
     created_logs = 0
-    for r in recipients:
+    for recipient_id in recipient_ids:
+        r = recipients.get(recipient_id)
+        if r is None:
+            continue
+        if r.email in suppressed:
+            SUPPRESSED.inc()
+            logs.append(DeliveryLog(campaign=campaign, recipient=r, recipient_email=r.email, status="suppressed"))
+            continue
+        if r.domain in saturated or not throttle.acquire(r.domain):
+            saturated.add(r.domain)
+            deferred.append(r.pk)
+            continue
         try:
             send_email_to_recipient(campaign, r)
             logs.append(DeliveryLog(campaign=campaign, recipient=r, recipient_email=r.email, status="sent"))
         except Exception as exc:
             logs.append(DeliveryLog(campaign=campaign, recipient=r, recipient_email=r.email, status="failed", failure_reason=str(exc)))
+            if is_hard_bounce(exc):
+                suppress(r.email, reason=Suppression.BOUNCE, note=str(exc)[:500])
+        finally:
+            throttle.release(r.domain)
         # flush logs in chunks to keep memory low
         if len(logs) >= LOG_BATCH:
-            DeliveryLog.objects.bulk_create(logs, ignore_conflicts=True)
-            created_logs += len(logs)
+            created_logs += flush_delivery_logs(campaign_id, logs)
             logs = []
     if logs:
-        DeliveryLog.objects.bulk_create(logs, ignore_conflicts=True)
-        created_logs += len(logs)
+        created_logs += flush_delivery_logs(campaign_id, logs)
+    if deferred:
+        queue = (self.request.delivery_info or {}).get("routing_key") or "senders"
+        defer_recipients(campaign_id, deferred, queue)
+        logger.info(f"Deferred {len(deferred)} recipients of Campaign ID: {campaign_id} (throttled domains: {sorted(saturated)})")
+    release_batch_slot(campaign_id)
+    BATCH_SECONDS.observe(time.monotonic() - started)
+    THROTTLE_WAIT.inc(throttle.waited)
     logger.info(f"Completed sending batch for Campaign ID: {campaign_id} to {len(recipient_ids)} recipients.")
-    return {"created_logs": created_logs, "batch_size": len(recipient_ids)}
+    return {"created_logs": created_logs, "batch_size": len(recipient_ids), "deferred": len(deferred), "throttle_wait": round(throttle.waited, 3)}
 
 @shared_task(name="campaigns.tasks.finalize_campaign", bind=True)
 def finalize_campaign(self, campaign_id: int):
     """
-    Determine whether all recipients have a DeliveryLog and mark campaign completed.
+    Mark the campaign completed once the dispatcher has handed out every
+    recipient (dispatch_completed) and no batch is outstanding
+    (batches_in_flight, which covers deferred follow-up batches too).
     Generate a CSV report and email admin.
-    This is safe to call multiple times; it checks counts and only mark COMPLETED when appropriate.
+    This is safe to call multiple times; it only marks COMPLETED when appropriate.
     """
     logger.info(f"Finalizing campaign ID: {campaign_id} [Task: {self.request.id}]")
     campaign = Campaign.objects.get(pk=campaign_id)
@@ -120,24 +311,26 @@ def finalize_campaign(self, campaign_id: int):
         logger.warning(f"Campaign ID: {campaign_id} is not IN_PROGRESS (status: {campaign.status}). Skipping finalization. [Task: {self.request.id}]")
         return {"status": "skipped", "reason": f"Campaign status is {campaign.status}"}
 
-    # Determine total intended recipients (for this example, all subscribed users)
-    recipients_qs = Recipient.objects.filter(subscription_status="subscribed")
-    total_expected = recipients_qs.count()
-
-    # count logs for this campaign
-    logs_count = DeliveryLog.objects.filter(campaign=campaign).count()
-
-    # If logs_count < total_expected, we assume not all batches have finished yet.
-    # You may improve this by tracking enqueued batches. Here we ensure we don't prematurely mark completed.
-    if logs_count < total_expected:
+    # Done is what the dispatcher says, not a log count against the audience:
+    # a segment or the subscriber list can grow or shrink during the send, and
+    # the live size would then never match the logs written.
+    if not campaign.dispatch_completed or campaign.batches_in_flight > 0:
         # Re-check later
-        logger.info(f"Campaign ID: {campaign_id} not yet complete ({logs_count}/{total_expected} logs). Rechecking later. [Task: {self.request.id}]")
+        logger.info(f"Campaign ID: {campaign_id} not yet complete (dispatch completed: {campaign.dispatch_completed}, {campaign.batches_in_flight} batches in flight). Rechecking later. [Task: {self.request.id}]")
         finalize_campaign.apply_async(args=[campaign_id], countdown=120)  # re-check in 2 minutes
-        return {"status": "pending", "logs_count": logs_count, "total_expected": total_expected}
+        return {"status": "pending", "dispatch_completed": campaign.dispatch_completed, "batches_in_flight": campaign.batches_in_flight}
+
+    logs_count = DeliveryLog.objects.filter(campaign=campaign).count()
 
     # All done -> mark completed
     campaign.status = Campaign.COMPLETED
     campaign.save(update_fields=["status"])
+    progress.finish(campaign_id, Campaign.COMPLETED)
+    # once per campaign: how long the campaign sat finished before we noticed
+    from django.utils import timezone as django_timezone
+    last_sent = DeliveryLog.objects.filter(campaign=campaign).aggregate(last=Max("sent_at"))["last"]
+    if last_sent:
+        FINALIZE_LAG.observe(max(0.0, (django_timezone.now() - last_sent).total_seconds()))
 
     # Generate and send CSV report
     send_campaign_report.delay(campaign_id)
@@ -177,3 +370,102 @@ def send_campaign_report(campaign_id: int):
     buffer.close()
     logger.info(f"Report for Campaign ID: {campaign_id} sent to admin.")
     return {"rows": logs_qs.count()}
+
+@shared_task(name="campaigns.tasks.run_import_job")
+def run_import_job(job_id: int):
+    """
+    Import an uploaded recipient file in the background (queue "imports").
+    Live progress goes to the cache (ImportJob.set_progress): the importer may
+    report it while its COPY holds the database connection. Phase, rows and
+    stats are stored on the job when it finishes.
+    """
+    from django.utils import timezone as django_timezone
+    from .importer_v2 import RecipientImporterParallel
+
+    job = ImportJob.objects.get(pk=job_id)
+    if job.status != ImportJob.PENDING:
+        logger.warning(f"Import job {job_id} is already {job.status}; skipping")
+        return {"status": job.status}
+
+    ImportJob.objects.filter(pk=job_id).update(status=ImportJob.RUNNING, started_at=django_timezone.now())
+    last = {"phase": ImportJob.QUEUED, "rows": 0}
+
+    def progress(phase, rows):
+        last.update(phase=phase, rows=rows)
+        job.set_progress(phase, rows)
+
+    # chunked upload still arriving: parse and COPY what is there while the rest comes in
+    mode = None if job.upload_complete else "stream"
+    try:
+        if mode == "stream":
+            from .uploads import open_tailing
+            source = open_tailing(job)
+        else:
+            source = job.file.open("rb")
+        started = time.monotonic()
+        with source:
+            importer = RecipientImporterParallel(source, mode=mode, progress=progress, update_fields=job.update_fields)
+            result = importer.run()
+        IMPORT_ROWS.inc(importer.counts["read"])
+        IMPORT_RATE.set(importer.counts["read"] / max(time.monotonic() - started, 1e-6))
+    except Exception as e:
+        logger.exception(f"Import job {job_id} ({job.original_name}) failed in phase {last['phase']}")
+        with transaction.atomic():
+            # locked like append_chunk: a last chunk landing right now either sees
+            # FAILED and re-queues, or has already landed and is seen here
+            job = ImportJob.objects.select_for_update().get(pk=job_id)
+            job.status, job.phase, job.rows_processed = ImportJob.FAILED, last["phase"], last["rows"]
+            job.error, job.finished_at = str(e), django_timezone.now()
+            job.save(update_fields=["status", "phase", "rows_processed", "error", "finished_at"])
+            if mode == "stream":
+                from .uploads import restart_failed_import
+                if restart_failed_import(job):
+                    return {"status": ImportJob.PENDING}
+        return {"status": ImportJob.FAILED}
+
+    # the stats are kept; the upload itself is no longer needed
+    job.file.delete(save=False)
+    ImportJob.objects.filter(pk=job_id).update(
+        status=ImportJob.COMPLETED,
+        phase=ImportJob.DONE,
+        rows_processed=importer.counts["read"],
+        stats=result,
+        file="",
+        finished_at=django_timezone.now(),
+    )
+    logger.info(f"Import job {job_id} ({job.original_name}) completed: {result}")
+    return {"status": ImportJob.COMPLETED, **result}
+
+@shared_task(name="campaigns.tasks.cleanup_import_staging_tables")
+def cleanup_import_staging_tables():
+    """
+    Run hourly (via beat). Drop recipient import staging tables left behind
+    by imports that crashed before their own cleanup.
+    """
+    from .importer_v2 import drop_stale_staging_tables
+    dropped = drop_stale_staging_tables()
+    if dropped:
+        logger.warning(f"Dropped {len(dropped)} orphaned import staging tables: {', '.join(dropped)}")
+    return {"dropped": dropped}
+
+@shared_task(name="campaigns.tasks.refresh_segments")
+def refresh_segments():
+    """
+    Run every SEGMENT_REFRESH_SECONDS (via beat). Top up the membership of every
+    segment from recently changed recipients (full rebuild once per
+    SEGMENT_REBUILD_SECONDS).
+    """
+    refreshed = {}
+    for segment_id in Segment.objects.values_list("id", flat=True):
+        refreshed[segment_id] = refresh_segment(segment_id).member_count
+    return {"segments": refreshed}
+
+@shared_task(name="campaigns.tasks.flush_unsubscribes")
+def flush_unsubscribes():
+    """Apply one-click unsubscribes buffered by the web process (beat, every few seconds)."""
+    return {"unsubscribed": unsubscribe.flush_pending()}
+
+@shared_task(name="campaigns.tasks.flush_engagement_events")
+def flush_engagement_events():
+    """Store open/click events buffered by the web process and update campaign counters (beat)."""
+    return {"stored": tracking.flush_events()}
@@ -1,26 +1,116 @@
 """
 Unit Tests for Campaign Email System
-Tests the 4 most critical functionalities:
+Tests the most critical functionalities:
 1. Scheduled campaigns are detected and started
 2. Emails are sent to recipients in batches
 3. Campaigns are finalized when all emails are sent
 4. CSV reports are generated and sent to admin
+5. Concurrent campaigns share sender capacity fairly
+6. Campaign batches are produced lazily within a bounded window
+7. Batches are sharded by recipient domain and throttled per domain
+8. Suppressed addresses are filtered at send time
+9. Emails are validated a whole column at a time
+10. Excel uploads are streamed row by row
+11. Uploads can be streamed straight into COPY without temp files
+12. CSV uploads are normalized in parallel by byte range
+13. Import summaries come straight from the merge
+14. Each import stages into its own table; orphans are cleaned up
+15. Uploads are imported by a background job with progress
+16. Large files are uploaded in resumable, checksummed chunks
+17. The v1 importer dedupes against the database batch by batch
+18. Merge imports update changed names and statuses in one statement
+19. Benchmark uploads are generated deterministically with the requested mix
+20. Campaigns target segments through precomputed membership
+21. Extra upload columns become recipient attributes used by segments and templates
+22. Hot queries are served by indexes (no sequential scans or sorts)
+23. Celery tasks stay within their query budgets and log per-task stats
+24. The sending pipeline records Prometheus metrics and serves them at /metrics
+25. A campaign's tasks form one trace (when OpenTelemetry is installed)
+26. Selected task executions are sampled into collapsed-stack profiles on demand
+27. Live campaign progress (JSON and SSE) is served from cache counters to staff or token holders
+28. One-click unsubscribe: signed links in every email, buffered bulk updates
+29. Open/click tracking: signed pixel and redirects, buffered events stored with COPY
 """
 
+import io
+import re
+import json
+import os
+import base64
+import hashlib
+import shutil
+import signal
+import smtplib
+import subprocess
+import sys
+import tempfile
+import threading
+import time
 from datetime import timedelta
+from types import SimpleNamespace
+from unittest import skipIf, skipUnless
 from unittest.mock import patch
+from urllib.parse import unquote
 
-from django.test import TestCase
+import pandas as pd
+from celery import Celery
+from celery.worker.control import Panel
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.contrib import admin
+from django.core.exceptions import ValidationError
+from django.http import Http404
+from django.test import RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.utils import timezone
 from django.core import mail
+from django.db import close_old_connections, connection
+from django.core.signals import request_finished
 from django.conf import settings
+from django.urls import reverse
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from openpyxl import Workbook
+from prometheus_client import REGISTRY
 
-from .models import Campaign, Recipient, DeliveryLog
+from . import profiling, progress, scheduler, tracing, tracking, unsubscribe
+from .bloom import BloomFilter
+from .management.commands.benchmark import BENCH_DOMAINS, _phase_seconds, generate_recipients
+from .importer_v1 import RecipientImporter
+from .instrumentation import BudgetExceeded, measure, query_budget
+from .metrics import queue_names
+from .views import (
+    campaign_progress_stream, campaign_progress_view, click_view, metrics_view, open_pixel_view, progress_events,
+    unsubscribe_view,
+)
+from .importer_v2 import (
+    RecipientImporterParallel,
+    RowStream,
+    _range_rows,
+    STAGING_PREFIX,
+    staging_table_name,
+)
+from .models import Campaign, Recipient, DeliveryLog, Suppression, ImportJob, Segment, EngagementEvent
+from .personalize import fetch_recipients, recipient_values, render, template_fields
+from .providers import send_email_to_recipient
+from .segments import MemberSet, refresh_segment, rules_to_q
+from .suppression import SendGridHTTPError, SuppressionFilter, get_suppression_filter, is_hard_bounce, suppress
+from .uploads import ChunkRejected, UploadStalled, append_chunk, open_tailing, start_chunked_upload
+from .throttle import DomainThrottle
+from .columns import normalize_emails, valid_email_mask
+from .utils import is_valid_email
 from .tasks import (
     check_scheduled_campaigns,
+    start_campaign_send,
+    dispatch_campaign_batches,
     send_batch,
+    release_batch_slot,
+    plan_batch,
     finalize_campaign,
-    send_campaign_report
+    send_campaign_report,
+    cleanup_import_staging_tables,
+    run_import_job,
+    flush_unsubscribes,
+    flush_engagement_events,
 )
 
 
@@ -176,15 +266,18 @@ class Test3_CampaignFinalization(TestCase):
     
     NOTE: finalize_campaign uses polling with countdown delays:
     - Initial call: countdown=300s (5 minutes) from start_campaign_send
-    - Retry calls: countdown=120s (2 minutes) if not all logs ready
+    - Retry calls: countdown=120s (2 minutes) while the dispatcher is not done
+      or batches are still in flight
     """
     
     def setUp(self):
+        # every recipient handed out by the dispatcher, no batch outstanding
         self.campaign = Campaign.objects.create(
             name="Test Campaign",
             subject="Test Subject",
             content="<h1>Test Email</h1>",
-            status=Campaign.IN_PROGRESS
+            status=Campaign.IN_PROGRESS,
+            dispatch_completed=True,
         )
         
         # Create 4 recipients
@@ -229,7 +322,8 @@ class Test3_CampaignFinalization(TestCase):
         Test campaign reschedules if not all emails sent yet.
         Task will reschedule with countdown=120s (2 minutes) to check again.
         """
-        # Create logs for only 2 out of 4 recipients
+        # Logs for only 2 out of 4 recipients: the other batch is still in flight
+        Campaign.objects.filter(pk=self.campaign.pk).update(batches_in_flight=1)
         for recipient in self.recipients[:2]:
             DeliveryLog.objects.create(
                 campaign=self.campaign,
@@ -253,8 +347,16 @@ class Test3_CampaignFinalization(TestCase):
         
         # Verify return value shows pending
         self.assertEqual(result['status'], 'pending')
-        self.assertEqual(result['logs_count'], 2)
-        self.assertEqual(result['total_expected'], 4)
+        self.assertEqual(result['batches_in_flight'], 1)
+
+    @patch('campaigns.tasks.finalize_campaign.apply_async')
+    def test_campaign_reschedules_until_dispatch_completes(self, mock_reschedule):
+        """Recipients the dispatcher has not handed out yet keep the campaign open"""
+        Campaign.objects.filter(pk=self.campaign.pk).update(dispatch_completed=False)
+        result = finalize_campaign(self.campaign.pk)
+        self.assertEqual(result['status'], 'pending')
+        self.assertFalse(result['dispatch_completed'])
+        mock_reschedule.assert_called_once()
     
     def test_skips_already_completed_campaigns(self):
         """Test finalization skips campaigns that are already completed"""
@@ -378,6 +480,1940 @@ class Test4_ReportGeneration(TestCase):
         self.assertEqual(result['rows'], 3)
 
 
+class Test5_FairScheduling(TestCase):
+    """
+    TEST #5: Verify concurrent campaigns share sender capacity by priority
+    instead of the first campaign draining the queue before anyone else
+    """
+
+    def setUp(self):
+        for i in range(10):
+            Recipient.objects.create(email=f"user{i}@example.com", name=f"User{i}")
+        self.big = Campaign.objects.create(
+            name="Newsletter", subject="News", content="<p>News</p>",
+            status=Campaign.IN_PROGRESS, priority=Campaign.LOW
+        )
+        self.urgent = Campaign.objects.create(
+            name="Urgent", subject="Urgent", content="<p>Urgent</p>",
+            status=Campaign.IN_PROGRESS, priority=Campaign.HIGH
+        )
+
+    def test_round_robin_shares_by_weight(self):
+        """Each round hands out batches in proportion to the priority weights"""
+        flows = [scheduler.Flow("high", 4), scheduler.Flow("low", 1)]
+        dispatched = scheduler.deficit_round_robin(flows, 10, lambda key: True)
+        self.assertEqual(dispatched, {"high": 8, "low": 2})
+
+    def test_workers_serve_high_priority_queue_first(self):
+        """With both queues backlogged, a sender worker drains senders.high before senders.low"""
+        from kombu.utils.scheduling import cycle_by_name
+
+        def serve(strategy, count):
+            # kombu's Redis channel: BRPOP over the queues in cycle order, then rotate the served queue
+            backlog = {scheduler.PRIORITY_QUEUES[Campaign.HIGH]: 50, scheduler.PRIORITY_QUEUES[Campaign.LOW]: 50}
+            cycle = cycle_by_name(strategy)()
+            cycle.update(scheduler.SENDER_QUEUES)
+            served = []
+            for _ in range(count):
+                queue = next(q for q in cycle.consume(len(scheduler.SENDER_QUEUES)) if backlog.get(q))
+                backlog[queue] -= 1
+                served.append(queue)
+                cycle.rotate(queue)
+            return served
+
+        served = serve(settings.CELERY_BROKER_TRANSPORT_OPTIONS["queue_order_strategy"], 40)
+        self.assertEqual(served.count("senders.high"), 40)
+        # kombu's default would split the worker evenly whatever the priority
+        self.assertEqual(serve("round_robin", 40).count("senders.high"), 20)
+
+    def test_exhausted_flow_gives_up_its_share(self):
+        """A campaign with nothing left does not hold back the others"""
+        remaining = {"small": 1}
+        def take(key):
+            if key in remaining:
+                remaining[key] -= 1
+                return remaining[key] >= 0
+            return True
+        flows = [scheduler.Flow("small", 4), scheduler.Flow("big", 1)]
+        dispatched = scheduler.deficit_round_robin(flows, 6, take)
+        self.assertEqual(dispatched, {"small": 1, "big": 5})
+        self.assertTrue(flows[0].exhausted)
+        self.assertEqual(flows[0].deficit, 0)
+
+    @patch('campaigns.tasks.BATCH_SIZE', 2)
+    @patch('campaigns.tasks.send_batch.apply_async')
+    def test_dispatch_uses_priority_queues(self, mock_apply):
+        """Batches go to per-priority queues and advance each campaign's cursor"""
+        with self.captureOnCommitCallbacks(execute=True):
+            result = dispatch_campaign_batches(budget=5)
+
+        self.assertEqual(result["dispatched"], 5)
+        queues = [c.kwargs["queue"] for c in mock_apply.call_args_list]
+        self.assertEqual(queues.count("senders.high"), 4)
+        self.assertEqual(queues.count("senders.low"), 1)
+
+        self.urgent.refresh_from_db()
+        self.assertEqual(self.urgent.send_cursor, Recipient.objects.order_by("id")[7].pk)
+
+    @patch('campaigns.tasks.send_batch.apply_async')
+    def test_dispatch_marks_campaign_completed(self, mock_apply):
+        """Once every recipient is handed out the campaign leaves the rotation"""
+        with self.captureOnCommitCallbacks(execute=True):
+            dispatch_campaign_batches(budget=10)
+
+        self.urgent.refresh_from_db()
+        self.big.refresh_from_db()
+        self.assertTrue(self.urgent.dispatch_completed)
+        self.assertTrue(self.big.dispatch_completed)
+        self.assertEqual(mock_apply.call_count, 2)
+
+    @patch('campaigns.tasks.finalize_campaign.apply_async')
+    @patch('campaigns.tasks.dispatch_campaign_batches.delay')
+    @patch('campaigns.tasks.send_batch.apply_async')
+    def test_start_does_not_enqueue_batches(self, mock_apply, mock_dispatch, mock_finalize):
+        """Starting a campaign only registers it with the dispatcher"""
+        start_campaign_send(self.big.pk)
+        mock_apply.assert_not_called()
+        mock_dispatch.assert_called_once()
+
+
+LOCMEM_CACHES = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class Test6_DispatchBackpressure(TestCase):
+    """
+    TEST #6: Verify a campaign never has more than SEND_WINDOW batches
+    outstanding on the broker, and is refilled as batches complete
+    """
+
+    def setUp(self):
+        cache.clear()
+        for i in range(20):
+            Recipient.objects.create(email=f"user{i}@example.com", name=f"User{i}")
+        self.campaign = Campaign.objects.create(
+            name="Big", subject="Big", content="<p>Big</p>", status=Campaign.IN_PROGRESS
+        )
+
+    @patch('campaigns.scheduler.SEND_WINDOW', 3)
+    @patch('campaigns.tasks.BATCH_SIZE', 2)
+    @patch('campaigns.tasks.send_batch.apply_async')
+    def test_window_caps_outstanding_batches(self, mock_apply):
+        """Only SEND_WINDOW batches are enqueued however large the budget"""
+        with self.captureOnCommitCallbacks(execute=True):
+            dispatch_campaign_batches(budget=100)
+            dispatch_campaign_batches(budget=100)
+
+        self.assertEqual(mock_apply.call_count, 3)
+        self.campaign.refresh_from_db()
+        self.assertEqual(self.campaign.batches_in_flight, 3)
+        self.assertFalse(self.campaign.dispatch_completed)
+
+    @patch('campaigns.scheduler.SEND_WINDOW', 3)
+    @patch('campaigns.tasks.BATCH_SIZE', 2)
+    @patch('campaigns.tasks.send_batch.apply_async')
+    def test_dispatch_resumes_from_cursor(self, mock_apply):
+        """Freed slots are filled with the recipients after the stored cursor"""
+        with self.captureOnCommitCallbacks(execute=True):
+            dispatch_campaign_batches(budget=100)
+        Campaign.objects.filter(pk=self.campaign.pk).update(batches_in_flight=0)
+        with self.captureOnCommitCallbacks(execute=True):
+            dispatch_campaign_batches(budget=100)
+
+        sent_ids = [i for c in mock_apply.call_args_list for i in c.kwargs["args"][1]]
+        self.assertEqual(sent_ids, list(Recipient.objects.order_by("id").values_list("id", flat=True)[:12]))
+
+    @patch('campaigns.scheduler.REFILL_LOW_WATER', 1)
+    @patch('campaigns.tasks.dispatch_campaign_batches.delay')
+    def test_release_requests_refill_at_low_water(self, mock_dispatch):
+        """Finishing a batch frees a slot and triggers a refill at the low-water mark"""
+        Campaign.objects.filter(pk=self.campaign.pk).update(batches_in_flight=3)
+        release_batch_slot(self.campaign.pk)
+        mock_dispatch.assert_not_called()
+        release_batch_slot(self.campaign.pk)
+        mock_dispatch.assert_called_once()
+
+        self.campaign.refresh_from_db()
+        self.assertEqual(self.campaign.batches_in_flight, 1)
+
+    @patch('campaigns.scheduler.REFILL_LOW_WATER', 2)
+    @patch('campaigns.tasks.dispatch_campaign_batches.delay')
+    def test_refill_not_lost_when_releases_race(self, mock_dispatch):
+        """A release that lands below the mark (a concurrent one passed it) still asks for a refill"""
+        Campaign.objects.filter(pk=self.campaign.pk).update(batches_in_flight=2)  # 3 -> 2 seen by nobody
+        release_batch_slot(self.campaign.pk)
+        mock_dispatch.assert_called_once()
+
+        Campaign.objects.filter(pk=self.campaign.pk).update(batches_in_flight=1, dispatch_completed=True)
+        cache.clear()
+        release_batch_slot(self.campaign.pk)
+        mock_dispatch.assert_called_once()  # nothing left to dispatch
+        self.assertEqual(Campaign.objects.get(pk=self.campaign.pk).batches_in_flight, 0)
+
+    @patch('campaigns.scheduler.REFILL_LOW_WATER', 4)
+    @patch('campaigns.tasks.dispatch_campaign_batches.delay')
+    def test_refill_requests_are_deduplicated(self, mock_dispatch):
+        """The last batches finishing together queue one dispatch pass, not one each"""
+        Campaign.objects.filter(pk=self.campaign.pk).update(batches_in_flight=4)
+        for _ in range(4):
+            release_batch_slot(self.campaign.pk)
+        mock_dispatch.assert_called_once()
+        self.assertEqual(Campaign.objects.get(pk=self.campaign.pk).batches_in_flight, 0)
+
+
+
+@override_settings(CACHES=LOCMEM_CACHES, DOMAIN_THROTTLE_MAX_WAIT=0)
+class Test7_DomainSharding(TestCase):
+    """
+    TEST #7: Verify batches interleave recipient domains and that per-domain
+    caps defer the overflow instead of hammering one receiver
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.campaign = Campaign.objects.create(
+            name="Domains", subject="Hi", content="<p>Hi</p>", status=Campaign.IN_PROGRESS
+        )
+        self.gmail = [
+            Recipient.objects.create(email=f"user{i}@gmail.com", name=f"G{i}") for i in range(4)
+        ]
+        self.other = [
+            Recipient.objects.create(email=f"user{i}@example.com", name=f"E{i}") for i in range(2)
+        ]
+
+    def test_domain_is_precomputed(self):
+        """Recipient.domain is derived from the email on save"""
+        self.assertEqual(self.gmail[0].domain, "gmail.com")
+        self.assertEqual(Recipient.objects.filter(domain="example.com").count(), 2)
+
+    def test_plan_batch_interleaves_domains(self):
+        """The planner alternates domains instead of keeping id order"""
+        rows = [(1, "gmail.com"), (2, "gmail.com"), (3, "gmail.com"), (4, "yahoo.com"), (5, "aol.com")]
+        self.assertEqual(plan_batch(rows), [1, 4, 5, 2, 3])
+
+    @override_settings(DOMAIN_THROTTLE_LIMITS={"gmail.com": {"rate": 2}})
+    @patch('campaigns.tasks.dispatch_campaign_batches.delay')
+    @patch('campaigns.tasks.send_batch.apply_async')
+    @patch('campaigns.tasks.send_email_to_recipient')
+    def test_saturated_domain_is_deferred(self, mock_send, mock_apply, mock_dispatch):
+        """Recipients over the domain's rate cap are re-enqueued, others are sent"""
+        Campaign.objects.filter(pk=self.campaign.pk).update(batches_in_flight=1)
+        ids = plan_batch([(r.pk, r.domain) for r in self.gmail + self.other])
+        with patch('campaigns.throttle.time.time', return_value=1000.0):
+            result = send_batch(self.campaign.pk, ids)
+
+        self.assertEqual(mock_send.call_count, 4)
+        self.assertEqual(result["deferred"], 2)
+        deferred_ids = mock_apply.call_args.kwargs["args"][1]
+        self.assertEqual(set(deferred_ids), {r.pk for r in self.gmail[2:]})
+
+        # this batch's slot is handed over to the deferred follow-up batch
+        self.campaign.refresh_from_db()
+        self.assertEqual(self.campaign.batches_in_flight, 1)
+
+    @override_settings(DOMAIN_THROTTLE_LIMITS={"gmail.com": {"concurrency": 1}})
+    def test_concurrency_slots_are_released(self):
+        """A concurrency slot is free again after release"""
+        throttle = DomainThrottle(max_wait=0)
+        self.assertTrue(throttle.acquire("gmail.com"))
+        self.assertFalse(throttle.acquire("gmail.com"))
+        throttle.release("gmail.com")
+        self.assertTrue(throttle.acquire("gmail.com"))
+
+
+@override_settings(SUPPRESSION_REFRESH_SECONDS=0)
+class Test8_SuppressionList(TestCase):
+    """
+    TEST #8: Verify bounced, complained and blocked addresses are never mailed
+    """
+
+    def setUp(self):
+        self.campaign = Campaign.objects.create(
+            name="Suppressed", subject="Hi", content="<p>Hi</p>", status=Campaign.IN_PROGRESS
+        )
+        self.ok = Recipient.objects.create(email="ok@example.com", name="OK")
+        self.bounced = Recipient.objects.create(email="bounced@example.com", name="Bounced")
+        self.trap = Recipient.objects.create(email="anyone@spamtrap.test", name="Trap")
+
+    def test_bloom_filter_has_no_false_negatives(self):
+        """Every added key is reported present"""
+        bloom = BloomFilter(1000, 0.01)
+        keys = [f"user{i}@example.com" for i in range(1000)]
+        for key in keys:
+            bloom.add(key)
+        self.assertTrue(all(key in bloom for key in keys))
+        false_positives = sum(f"other{i}@example.com" in bloom for i in range(1000))
+        self.assertLess(false_positives, 50)
+
+    @patch('campaigns.tasks.send_email_to_recipient')
+    def test_suppressed_recipients_are_skipped(self, mock_send):
+        """Email and domain-wide suppressions are logged, not sent"""
+        suppress("Bounced@Example.com", reason=Suppression.BOUNCE)
+        suppress(domain="spamtrap.test")
+
+        send_batch(self.campaign.pk, [self.ok.pk, self.bounced.pk, self.trap.pk])
+
+        mock_send.assert_called_once()
+        self.assertEqual(mock_send.call_args.args[1], self.ok)
+        statuses = dict(DeliveryLog.objects.filter(campaign=self.campaign).values_list("recipient_email", "status"))
+        self.assertEqual(statuses, {
+            "ok@example.com": "sent",
+            "bounced@example.com": "suppressed",
+            "anyone@spamtrap.test": "suppressed",
+        })
+
+    def test_bloom_hits_are_confirmed_in_database(self):
+        """A false positive from the filter does not suppress anyone"""
+        checker = get_suppression_filter()
+        checker.suppressed_emails([])
+        checker.bloom.add("e:ok@example.com")
+        self.assertEqual(checker.suppressed_emails([self.ok]), set())
+
+    def test_refresh_catches_entries_committed_out_of_id_order(self):
+        """An entry with a lower id than one already seen is still picked up"""
+        checker = SuppressionFilter()
+        checker.suppressed_emails([])
+        late = suppress("bounced@example.com", reason=Suppression.BOUNCE)
+        seen = suppress("ok@example.com")
+        # the higher id was read before the lower one's transaction committed
+        checker.bloom.add("e:ok@example.com")
+        checker.last_id = seen.pk
+        self.assertLess(late.pk, seen.pk)
+
+        self.assertEqual(
+            checker.suppressed_emails([self.ok, self.bounced]), {"ok@example.com", "bounced@example.com"}
+        )
+
+    @patch('campaigns.tasks.send_email_to_recipient')
+    def test_hard_bounce_is_suppressed(self, mock_send):
+        """A permanent SMTP rejection adds the address to the suppression list"""
+        mock_send.side_effect = smtplib.SMTPRecipientsRefused(
+            {"bounced@example.com": (550, b"5.1.1 User unknown")}
+        )
+        send_batch(self.campaign.pk, [self.bounced.pk])
+        self.assertTrue(
+            Suppression.objects.filter(email="bounced@example.com", reason=Suppression.BOUNCE).exists()
+        )
+
+    @patch('campaigns.tasks.send_email_to_recipient')
+    def test_sendgrid_rejection_is_suppressed(self, mock_send):
+        """A SendGrid 400 on the recipient address is a hard bounce; other API errors are not"""
+        def error(status, field):
+            body = json.dumps({"errors": [{"message": "Does not contain a valid address.", "field": field}]})
+            return SendGridHTTPError(status, "error", body.encode(), {})
+
+        self.assertFalse(is_hard_bounce(error(400, "from.email")))
+        self.assertFalse(is_hard_bounce(error(401, None)))
+        self.assertFalse(is_hard_bounce(SendGridHTTPError(400, "Bad Request", b"<html>", {})))
+        mock_send.side_effect = error(400, "personalizations.0.to.0.email")
+        send_batch(self.campaign.pk, [self.bounced.pk])
+        self.assertTrue(
+            Suppression.objects.filter(email="bounced@example.com", reason=Suppression.BOUNCE).exists()
+        )
+
+
+class Test9_VectorizedValidation(TestCase):
+    """
+    TEST #9: Verify whole-column email normalization/validation matches
+    the per-row is_valid_email and is used by the importers
+    """
+
+    def test_mask_matches_per_row_validation(self):
+        """The mask agrees with is_valid_email row by row"""
+        emails = [" John@Example.COM ", "bad", "", None, "a@b.co", "x@y", "user name@example.com"]
+        mask = valid_email_mask(emails)
+        expected = [is_valid_email(e or "") for e in emails]
+        self.assertEqual(mask.tolist(), expected)
+
+    def test_normalize_keeps_index(self):
+        """Normalized values stay aligned with the input Series"""
+        series = pd.Series(["  A@B.COM", None], index=[10, 11])
+        normalized = normalize_emails(series)
+        self.assertEqual(list(normalized.index), [10, 11])
+        self.assertEqual(list(normalized), ["a@b.com", ""])
+
+    def test_v1_importer_uses_vectorized_validation(self):
+        """CSV import skips invalid rows and normalizes emails"""
+        upload = SimpleUploadedFile(
+            "recipients.csv",
+            b"name,email\nJohn, John@Example.com \nBad,not-an-email\nNo Email,\n",
+        )
+        result = RecipientImporter(upload).run()
+        self.assertEqual(result["created"], 1)
+        self.assertEqual(result["skipped_invalid"], 2)
+        self.assertTrue(Recipient.objects.filter(email="john@example.com", domain="example.com").exists())
+
+
+
+class Test10_StreamingExcelImport(TestCase):
+    """
+    TEST #10: Verify .xlsx uploads are read in chunks and only valid,
+    normalized rows reach the COPY input
+    """
+
+    def _xlsx(self, rows):
+        workbook = Workbook()
+        sheet = workbook.active
+        sheet.append(["Name", "Email"])
+        for row in rows:
+            sheet.append(row)
+        buffer = io.BytesIO()
+        workbook.save(buffer)
+        return SimpleUploadedFile("recipients.xlsx", buffer.getvalue())
+
+    def _read_output(self, upload):
+        path = RecipientImporterParallel(upload)._excel_to_csv()
+        try:
+            return pd.read_csv(path, keep_default_na=False).values.tolist()
+        finally:
+            os.remove(path)
+
+    def test_only_valid_rows_are_written(self):
+        """Invalid, empty and ragged rows are dropped, emails normalized"""
+        upload = self._xlsx([
+            ["John", " John@Example.COM "],
+            ["Bad", "not-an-email"],
+            [None, None],
+            ["Only name"],
+        ])
+        self.assertEqual(self._read_output(upload), [["John", "john@example.com"]])
+
+    def test_rows_span_several_chunks(self):
+        """Rows are not lost at chunk boundaries"""
+        upload = self._xlsx([[f"User {i}", f"user{i}@example.com"] for i in range(25)])
+        with patch("campaigns.importer_v2.EXCEL_CHUNK", 10):
+            rows = self._read_output(upload)
+        self.assertEqual(len(rows), 25)
+        self.assertEqual(rows[-1], ["User 24", "user24@example.com"])
+
+
+class Test11_StreamingCopyImport(TestCase):
+    """
+    TEST #11: Verify stream mode feeds normalized rows into COPY FROM STDIN
+    and merges them like the parallel pipeline
+    """
+
+    def test_row_stream_reads_in_blocks(self):
+        """Small reads return the same CSV text as one full read"""
+        rows = [("John", "john@example.com"), ("Jane, Jr.", "jane@example.com")]
+        stream = RowStream(rows)
+        blocks = []
+        while True:
+            block = stream.read(7)
+            if not block:
+                break
+            self.assertLessEqual(len(block), 7)
+            blocks.append(block)
+        self.assertEqual("".join(blocks), RowStream(rows).read())
+        self.assertEqual(stream.rows, 2)
+
+    def test_stream_mode_imports_valid_rows(self):
+        """Valid rows are inserted with their domain, existing emails skipped"""
+        Recipient.objects.create(name="Existing", email="existing@example.com")
+        upload = SimpleUploadedFile(
+            "recipients.csv",
+            b"name,email\nJohn, John@Example.com \nBad,not-an-email\nOld,existing@example.com\n",
+        )
+        result = RecipientImporterParallel(upload, mode="stream").run()
+
+        self.assertTrue(Recipient.objects.filter(email="john@example.com", domain="example.com").exists())
+        self.assertEqual(Recipient.objects.count(), 2)
+        self.assertEqual(result["created"], 1)
+
+    def test_unknown_mode_is_rejected(self):
+        """A typo in RECIPIENT_IMPORT_MODE fails loudly"""
+        upload = SimpleUploadedFile("recipients.csv", b"name,email\n")
+        with self.assertRaises(ValueError):
+            RecipientImporterParallel(upload, mode="bogus")
+
+
+class Test12_ParallelRangeNormalize(TestCase):
+    """
+    TEST #12: Verify the upload is cut into byte ranges of whole records,
+    even when quoted fields contain newlines, and no row is lost or split
+    """
+
+    def setUp(self):
+        lines = ["name,email"]
+        for i in range(200):
+            name = f'"Line one\nline ""{i}"", two"' if i % 5 == 0 else f"User {i}"
+            lines.append(f"{name},User{i}@Example.com")
+        with tempfile.NamedTemporaryFile("w", suffix=".csv", delete=False) as fh:
+            fh.write("\n".join(lines) + "\n")
+        self.path = fh.name
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def test_ranges_hold_whole_records(self):
+        """Rows from all ranges equal one sequential parse of the file"""
+        with patch("campaigns.importer_v2.MIN_RANGE_BYTES", 256), \
+                patch("campaigns.importer_v2.RANGE_BYTES", 256):
+            tasks = RecipientImporterParallel._plan_ranges(self.path)
+        self.assertGreater(len(tasks), 5)
+
+        rows = [tuple(row) for task in tasks for row in _range_rows(*task, {"read": 0})]
+        with open(self.path, "rb") as fh:
+            upload = SimpleUploadedFile("recipients.csv", fh.read())
+        expected = [tuple(row) for row in RecipientImporterParallel(upload)._iter_clean_rows()]
+
+        self.assertEqual(len(rows), 200)
+        self.assertEqual(rows, expected)
+        self.assertIn(('Line one\nline "0", two', "user0@example.com"), rows)
+
+    def test_header_only_file_has_no_work(self):
+        """An upload with only a header spawns no workers"""
+        with open(self.path, "w") as fh:
+            fh.write("name,email\n")
+        self.assertEqual(RecipientImporterParallel._plan_ranges(self.path), [])
+
+
+class Test13_ImportSummary(TestCase):
+    """
+    TEST #13: Verify the import summary separates created, in-file duplicate,
+    already-existing and invalid rows
+    """
+
+    def test_summary_counts(self):
+        """Each skipped row is reported under exactly one reason"""
+        Recipient.objects.create(name="Existing", email="existing@example.com")
+        upload = SimpleUploadedFile(
+            "recipients.csv",
+            b"name,email\n"
+            b"New,new@example.com\n"
+            b"New again, NEW@example.com\n"
+            b"Existing,existing@example.com\n"
+            b"Bad,not-an-email\n"
+            b"Empty,\n",
+        )
+        result = RecipientImporterParallel(upload, mode="stream").run()
+
+        self.assertEqual(result["created"], 1)
+        self.assertEqual(result["duplicates_in_file"], 1)
+        self.assertEqual(result["already_existing"], 1)
+        self.assertEqual(result["invalid"], 2)
+        self.assertEqual(result["duplicates_skipped"], 2)
+        self.assertEqual(Recipient.objects.get(email="new@example.com").name, "New")
+
+
+class Test14_StagingTables(TestCase):
+    """
+    TEST #14: Verify imports get unique staging table names and that
+    staging tables of crashed imports are dropped once stale
+    """
+
+    def _tables(self):
+        with connection.cursor() as cur:
+            cur.execute("SELECT tablename FROM pg_tables WHERE tablename LIKE %s;", [STAGING_PREFIX + "%"])
+            return {row[0] for row in cur.fetchall()}
+
+    def _create(self, name):
+        with connection.cursor() as cur:
+            cur.execute(f"CREATE UNLOGGED TABLE {name} (name TEXT, email TEXT);")
+
+    def test_names_are_unique(self):
+        """Two imports started in the same second never share a table"""
+        names = {staging_table_name() for _ in range(50)}
+        self.assertEqual(len(names), 50)
+
+    def test_only_stale_tables_are_dropped(self):
+        """A crashed import's table is dropped, a running import's table is kept"""
+        stale = f"{STAGING_PREFIX}1000000000_deadbeef"
+        fresh = staging_table_name()
+        self._create(stale)
+        self._create(fresh)
+
+        result = cleanup_import_staging_tables()
+
+        self.assertEqual(result["dropped"], [stale])
+        self.assertEqual(self._tables(), {fresh})
+
+
+@override_settings(RECIPIENT_IMPORT_MODE="stream", CACHES=LOCMEM_CACHES)
+class Test15_BackgroundImportJobs(TestCase):
+    """
+    TEST #15: Verify uploads return immediately with a queued ImportJob and
+    that the job records phase, rows processed and final stats
+    """
+
+    def setUp(self):
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media, ignore_errors=True)
+        override = self.settings(MEDIA_ROOT=media)
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def _job(self, name, content):
+        return ImportJob.objects.create(file=SimpleUploadedFile(name, content), original_name=name)
+
+    def test_job_records_stats(self):
+        """A finished job is completed with the importer's summary"""
+        job = self._job("recipients.csv", b"name,email\nJohn,john@example.com\nBad,nope\nJohn,JOHN@example.com\n")
+
+        run_import_job(job.pk)
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, ImportJob.COMPLETED)
+        self.assertEqual(job.phase, ImportJob.DONE)
+        self.assertEqual(job.rows_processed, 3)
+        self.assertEqual(job.stats["created"], 1)
+        self.assertEqual(job.stats["invalid"], 1)
+        self.assertIsNotNone(job.finished_at)
+        self.assertFalse(job.file)  # stored upload removed after success
+
+    def test_progress_is_live_while_running(self):
+        """A running job reports the importer's latest phase and row count"""
+        job = self._job("recipients.csv", b"name,email\n")
+        job.status = ImportJob.RUNNING
+        job.set_progress(ImportJob.LOADING, 50_000)
+        self.assertEqual(job.get_progress(), (ImportJob.LOADING, 50_000))
+
+    def test_failed_import_is_recorded(self):
+        """An unreadable file marks the job failed with the error"""
+        job = self._job("recipients.xlsx", b"not really a workbook")
+
+        run_import_job(job.pk)
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, ImportJob.FAILED)
+        self.assertTrue(job.error)
+
+    def test_upload_view_queues_job(self):
+        """The admin upload stores the file, queues the job and points to its progress page"""
+        model_admin = admin.site._registry[Recipient]
+        request = RequestFactory().post(
+            "/admin/campaigns/recipient/bulk-upload/",
+            {"file": SimpleUploadedFile("recipients.csv", b"name,email\nJohn,john@example.com\n")},
+        )
+        request.user = get_user_model().objects.create_superuser("admin", "admin@example.com", "pass")
+
+        with patch("campaigns.admin.run_import_job.delay") as delay, \
+                self.captureOnCommitCallbacks(execute=True):
+            response = model_admin.bulk_upload_view(request)
+
+        job = ImportJob.objects.get()
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(response.url, f"/admin/campaigns/recipient/bulk-upload/{job.pk}/")
+        delay.assert_called_once_with(job.pk)
+        self.assertFalse(Recipient.objects.exists())  # nothing imported inside the request
+
+        status = json.loads(model_admin.import_job_status_view(request, job.pk).content)
+        self.assertEqual(status["status"], ImportJob.PENDING)
+        self.assertFalse(status["finished"])
+
+def sha256_header(data):
+    return "sha256 " + base64.b64encode(hashlib.sha256(data).digest()).decode()
+
+
+@override_settings(RECIPIENT_IMPORT_MODE="stream", CACHES=LOCMEM_CACHES)
+class Test16_ChunkedUploads(TestCase):
+    """
+    TEST #16: Verify chunked uploads are written in order, reject bad
+    offsets and checksums, and that the importer can read a file that is
+    still arriving
+    """
+
+    CONTENT = b"name,email\nJohn,john@example.com\nJane,jane@example.com\n"
+
+    def setUp(self):
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media, ignore_errors=True)
+        override = self.settings(MEDIA_ROOT=media)
+        override.enable()
+        self.addCleanup(override.disable)
+        delay = patch("campaigns.tasks.run_import_job.delay")
+        self.delay = delay.start()
+        self.addCleanup(delay.stop)
+
+    def _send(self, job, offset, data):
+        return append_chunk(job.pk, offset, data, sha256_header(data))
+
+    def test_chunks_are_assembled_in_order(self):
+        """Chunks sent at the current offset build the declared file"""
+        job = start_chunked_upload("recipients.csv", len(self.CONTENT))
+        job = self._send(job, 0, self.CONTENT[:20])
+        job = self._send(job, 20, self.CONTENT[20:])
+
+        self.assertTrue(job.upload_complete)
+        with open(job.file.path, "rb") as fh:
+            self.assertEqual(fh.read(), self.CONTENT)
+
+    def test_offset_mismatch_returns_server_offset(self):
+        """A chunk for the wrong offset is refused with the offset to resume from"""
+        job = start_chunked_upload("recipients.csv", len(self.CONTENT))
+        self._send(job, 0, self.CONTENT[:20])
+
+        with self.assertRaises(ChunkRejected) as ctx:
+            self._send(job, 0, self.CONTENT[:20])  # retry of a chunk that already landed
+        self.assertEqual(ctx.exception.status, 409)
+        self.assertEqual(ctx.exception.offset, 20)
+
+    def test_bad_checksum_is_not_written(self):
+        """A corrupted chunk is rejected and the offset does not move"""
+        job = start_chunked_upload("recipients.csv", len(self.CONTENT))
+
+        with self.assertRaises(ChunkRejected) as ctx:
+            append_chunk(job.pk, 0, self.CONTENT[:20], sha256_header(b"something else"))
+        self.assertEqual(ctx.exception.status, 460)
+        job.refresh_from_db()
+        self.assertEqual(job.upload_offset, 0)
+
+    def test_csv_import_is_queued_at_start_excel_at_end(self):
+        """CSV imports start with the upload, Excel imports once the last chunk arrives"""
+        with self.captureOnCommitCallbacks(execute=True):
+            csv_job = start_chunked_upload("recipients.csv", len(self.CONTENT))
+            xlsx_job = start_chunked_upload("recipients.xlsx", 4)
+        self.delay.assert_called_once_with(csv_job.pk)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self._send(xlsx_job, 0, b"PK\x03\x04")
+        self.delay.assert_called_with(xlsx_job.pk)
+
+    def test_tailing_reader_waits_for_more_data(self):
+        """The reader blocks until later chunks arrive instead of hitting EOF early"""
+        job = start_chunked_upload("recipients.csv", len(self.CONTENT))
+        self._send(job, 0, self.CONTENT[:20])
+
+        def arrive_later():
+            # written directly: the job row is not visible outside the test transaction
+            with open(job.file.path, "ab") as fh:
+                fh.write(self.CONTENT[20:])
+
+        late = threading.Timer(0.3, arrive_later)
+        late.start()
+        self.addCleanup(late.cancel)
+
+        with open_tailing(job, stall_timeout=5) as reader:
+            self.assertEqual(reader.read(), self.CONTENT)
+
+    def test_tailing_reader_gives_up_on_stalled_upload(self):
+        """An upload that stops sending fails the reader after the stall timeout"""
+        job = start_chunked_upload("recipients.csv", len(self.CONTENT))
+        self._send(job, 0, self.CONTENT[:20])
+
+        with open_tailing(job, stall_timeout=0.3) as reader:
+            with self.assertRaises(UploadStalled):
+                reader.read()
+
+    @override_settings(CHUNKED_UPLOAD_STALL_SECONDS=0.3)
+    def test_stalled_import_restarts_when_upload_resumes(self):
+        """A streaming import that gave up is queued again once the resumed upload completes"""
+        job = start_chunked_upload("recipients.csv", len(self.CONTENT))
+        self._send(job, 0, self.CONTENT[:20])
+
+        run_import_job(job.pk)  # the client goes quiet mid-upload
+        job.refresh_from_db()
+        self.assertEqual(job.status, ImportJob.FAILED)
+        self.assertFalse(Recipient.objects.exists())
+
+        with self.captureOnCommitCallbacks(execute=True):
+            job = self._send(job, 20, self.CONTENT[20:])
+        self.delay.assert_called_with(job.pk)
+        self.assertEqual(job.status, ImportJob.PENDING)
+        self.assertEqual(job.error, "")
+
+        run_import_job(job.pk)
+        job.refresh_from_db()
+        self.assertEqual(job.status, ImportJob.COMPLETED)
+        self.assertEqual(job.stats["created"], 2)
+
+    def test_tailing_reader_bounds_streaming_time(self):
+        """A slow but live upload stops the streaming read after max_seconds"""
+        job = start_chunked_upload("recipients.csv", len(self.CONTENT))
+        self._send(job, 0, self.CONTENT[:20])
+
+        with open_tailing(job, stall_timeout=5, max_seconds=0) as reader:
+            with self.assertRaisesRegex(UploadStalled, "imported once complete"):
+                reader.read()
+
+    def test_import_job_reads_completed_chunked_upload(self):
+        """run_import_job imports a chunked upload once all bytes are there"""
+        job = start_chunked_upload("recipients.csv", len(self.CONTENT))
+        self._send(job, 0, self.CONTENT)
+
+        run_import_job(job.pk)
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, ImportJob.COMPLETED)
+        self.assertEqual(job.stats["created"], 2)
+
+    def test_patch_view(self):
+        """The admin chunk endpoint maps offsets and checksums to tus-style responses"""
+        model_admin = admin.site._registry[Recipient]
+        user = get_user_model().objects.create_superuser("admin", "admin@example.com", "pass")
+        factory = RequestFactory()
+
+        request = factory.post(
+            "/admin/campaigns/recipient/bulk-upload/chunked/",
+            json.dumps({"name": "recipients.csv", "size": len(self.CONTENT)}),
+            content_type="application/json",
+        )
+        request.user = user
+        created = json.loads(model_admin.chunked_upload_create_view(request).content)
+        self.assertEqual(created["offset"], 0)
+
+        def patch_chunk(offset, data, checksum=None):
+            request = factory.generic(
+                "PATCH", created["upload_url"], data,
+                HTTP_UPLOAD_OFFSET=str(offset), HTTP_UPLOAD_CHECKSUM=checksum or sha256_header(data),
+            )
+            request.user = user
+            return model_admin.chunked_upload_view(request, created["job_id"])
+
+        response = patch_chunk(0, self.CONTENT[:20])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Upload-Offset"], "20")
+        self.assertEqual(patch_chunk(0, self.CONTENT[:20]).status_code, 409)
+        self.assertEqual(patch_chunk(20, self.CONTENT[20:], sha256_header(b"x")).status_code, 460)
+        self.assertTrue(json.loads(patch_chunk(20, self.CONTENT[20:]).content)["complete"])
+
+class Test17_V1ImporterDeduplication(TestCase):
+    """
+    TEST #17: Verify importer_v1 skips existing and repeated emails without
+    loading the recipient table, with and without the Bloom prefilter
+    """
+
+    CSV = (
+        b"name,email\n"
+        b"Old,old@example.com\n"
+        b"First,new@example.com\n"
+        b"Second,NEW@example.com\n"
+        b"Other,other@example.com\n"
+        b"Again,new@example.com\n"
+    )
+
+    def setUp(self):
+        Recipient.objects.create(name="Old", email="old@example.com")
+        batch = patch("campaigns.importer_v1.BATCH_SIZE", 2)  # duplicates span batches
+        batch.start()
+        self.addCleanup(batch.stop)
+
+    def _run(self, **kwargs):
+        return RecipientImporter(SimpleUploadedFile("recipients.csv", self.CSV), **kwargs).run()
+
+    def test_duplicates_resolved_by_database(self):
+        """Existing and repeated emails are counted as duplicates; first name wins"""
+        result = self._run(prefilter=False)
+        self.assertEqual(result, {"created": 2, "skipped_invalid": 0, "skipped_duplicates": 3})
+        self.assertEqual(Recipient.objects.get(email="new@example.com").name, "First")
+        self.assertEqual(Recipient.objects.get(email="other@example.com").domain, "example.com")
+
+    def test_bloom_prefilter_gives_same_result(self):
+        """The prefilter only avoids sending known rows; counts are unchanged"""
+        self.assertEqual(self._run(prefilter=True), {"created": 2, "skipped_invalid": 0, "skipped_duplicates": 3})
+        self.assertEqual(Recipient.objects.count(), 3)
+
+    def test_table_is_not_loaded_into_memory(self):
+        """Without the prefilter no query reads the whole email column"""
+        with patch.object(RecipientImporter, "_existing_filter") as existing:
+            self._run(prefilter=False)
+        existing.assert_not_called()
+
+class Test18_MergeImport(TestCase):
+    """
+    TEST #18: Verify merge mode inserts new recipients and updates only the
+    selected fields of existing ones, and only where the value changed
+    """
+
+    CSV = (
+        b"name,email,subscription_status\n"
+        b"Ann Renamed,ann@example.com,subscribed\n"
+        b"Bob,bob@example.com,Unsubscribed\n"
+        b",cat@example.com,subscribed\n"
+        b"New,new@example.com,unsubscribed\n"
+        b"No Status,dan@example.com,\n"
+    )
+
+    def setUp(self):
+        Recipient.objects.create(name="Ann", email="ann@example.com")
+        Recipient.objects.create(name="Bob", email="bob@example.com")
+        Recipient.objects.create(name="Cat", email="cat@example.com")
+
+    def _run(self, mode, update_fields):
+        upload = SimpleUploadedFile("recipients.csv", self.CSV)
+        return RecipientImporterParallel(upload, mode=mode, update_fields=update_fields).run()
+
+    def test_merge_updates_changed_rows(self):
+        """Changed names and statuses are updated; blank names never overwrite"""
+        result = self._run("stream", ["name", "subscription_status"])
+        self.assertEqual(result["created"], 1)
+        self.assertEqual(result["updated"], 2)        # ann renamed, bob unsubscribed
+        self.assertEqual(result["already_existing"], 3)
+        self.assertEqual(result["invalid"], 1)        # status column required
+        self.assertEqual(Recipient.objects.get(email="ann@example.com").name, "Ann Renamed")
+        self.assertEqual(Recipient.objects.get(email="bob@example.com").subscription_status, Recipient.UNSUBSCRIBED)
+        self.assertEqual(Recipient.objects.get(email="cat@example.com").name, "Cat")
+        self.assertEqual(Recipient.objects.get(email="new@example.com").subscription_status, Recipient.UNSUBSCRIBED)
+
+        # re-running the same file changes nothing
+        self.assertEqual(self._run("stream", ["name", "subscription_status"])["updated"], 0)
+
+    def test_parallel_ranges_carry_status(self):
+        """Parallel workers stage the normalized status column alongside name and email"""
+        with tempfile.NamedTemporaryFile("wb", suffix=".csv", delete=False) as fh:
+            fh.write(self.CSV)
+        self.addCleanup(os.remove, fh.name)
+
+        (task,) = RecipientImporterParallel._plan_ranges(fh.name)
+        rows = [tuple(row) for row in _range_rows(*task, {"read": 0}, ("name", "email", "subscription_status"))]
+        self.assertIn(("Bob", "bob@example.com", "unsubscribed"), rows)
+        self.assertEqual(len(rows), 4)
+
+    def test_only_selected_fields_are_updated(self):
+        """Updating names leaves subscription status untouched"""
+        result = self._run("stream", ["name"])
+        self.assertEqual(result["updated"], 1)
+        bob = Recipient.objects.get(email="bob@example.com")
+        self.assertEqual(bob.subscription_status, Recipient.SUBSCRIBED)
+
+    def test_insert_only_by_default(self):
+        """Without update fields existing recipients are skipped, names default to blank"""
+        result = self._run("stream", [])
+        self.assertNotIn("updated", result)
+        self.assertEqual(result["created"], 2)
+        self.assertEqual(Recipient.objects.get(email="ann@example.com").name, "Ann")
+        self.assertEqual(Recipient.objects.get(email="dan@example.com").name, "No Status")
+
+    def test_first_row_of_the_file_wins_whatever_the_load_order(self):
+        """Duplicates are settled by file position, not by the order ranges were staged"""
+        with connection.cursor() as cur:
+            cur.execute(
+                "CREATE TEMP TABLE merge_order (name TEXT, email TEXT, subscription_status TEXT, "
+                "attributes JSONB, source_row BIGINT)"
+            )
+            # the worker of the later range finished (and was staged) first
+            cur.execute(
+                "INSERT INTO merge_order (name, email, source_row) VALUES "
+                "('Ann Later', 'ann@example.com', 9000), ('Ann First', 'ann@example.com', 12)"
+            )
+            result = RecipientImporterParallel._merge(cur, "merge_order", 2, 2, ("name",))
+        self.assertEqual(result["updated"], 1)
+        self.assertEqual(result["duplicates_in_file"], 1)
+        self.assertEqual(Recipient.objects.get(email="ann@example.com").name, "Ann First")
+
+    def test_unknown_field_is_rejected(self):
+        """Only UPDATABLE_FIELDS may be overwritten"""
+        with self.assertRaises(ValueError):
+            RecipientImporterParallel(SimpleUploadedFile("r.csv", b"name,email\n"), update_fields=["email"])
+
+class Test19_BenchmarkGenerator(TestCase):
+    """
+    TEST #19: Verify the benchmark generator writes reproducible uploads with
+    the requested share of invalid and duplicated rows
+    """
+
+    def _generate(self, fmt="csv", **kwargs):
+        fd, path = tempfile.mkstemp(suffix=f".{fmt}")
+        os.close(fd)
+        self.addCleanup(os.remove, path)
+        return generate_recipients(path, 2_000, fmt, **kwargs)
+
+    def test_same_seed_same_file(self):
+        """Two runs with one seed produce identical files"""
+        with open(self._generate(), "rb") as a, open(self._generate(), "rb") as b:
+            self.assertEqual(a.read(), b.read())
+
+    def test_invalid_and_duplicate_ratios(self):
+        """Invalid and repeated addresses appear at roughly the requested rates"""
+        df = pd.read_csv(self._generate(invalid_ratio=0.1, duplicate_ratio=0.2), dtype=str, keep_default_na=False)
+        emails = normalize_emails(df["email"])
+        valid = valid_email_mask(emails, normalized=True)
+        duplicates = emails[valid].duplicated().sum()
+
+        self.assertEqual(len(df), 2_000)
+        self.assertAlmostEqual((~valid).mean(), 0.1, delta=0.03)
+        self.assertAlmostEqual(duplicates / valid.sum(), 0.2, delta=0.05)
+        self.assertTrue(emails[valid].str.split("@").str[1].isin(BENCH_DOMAINS).all())
+
+    def test_xlsx_matches_csv(self):
+        """The Excel variant holds the same rows as the CSV one"""
+        csv_rows = pd.read_csv(self._generate("csv"), dtype=str, keep_default_na=False)
+        xlsx_rows = pd.read_excel(self._generate("xlsx"), dtype=str).fillna("")
+        self.assertEqual(csv_rows.values.tolist(), xlsx_rows.values.tolist())
+
+    def test_phase_seconds_from_progress_marks(self):
+        """Phase durations are cut at the first report of each phase"""
+        marks = {"reading": [1.0, 3.0], "loading": [4.0, 6.0], "merging": [9.0]}
+        self.assertEqual(
+            _phase_seconds(marks, 0.0, 10.0),
+            {"normalize": 3.0, "split": 1.0, "copy": 5.0, "merge": 1.0},
+        )
+
+class Test20_Segments(TestCase):
+    """
+    TEST #20: Verify segment membership is precomputed from the rules,
+    follows recipient changes incrementally and drives campaign dispatch
+    """
+
+    def setUp(self):
+        self.gmail = [
+            Recipient.objects.create(email=f"user{i}@gmail.com", name=f"G{i}", tags=["vip"] if i % 2 else [])
+            for i in range(4)
+        ]
+        self.other = Recipient.objects.create(email="user@example.com", name="E", tags=["vip"])
+        self.segment = Segment.objects.create(
+            name="Gmail VIPs",
+            rules=[{"field": "domain", "op": "eq", "value": "gmail.com"}, {"field": "tags", "op": "has", "value": "vip"}],
+        )
+
+    def _member_ids(self):
+        segment = Segment.objects.get(pk=self.segment.pk)
+        return MemberSet(segment.members).ids_after(0, 100)
+
+    def test_member_set_ids_after(self):
+        """The bitmap returns member ids after a cursor in order"""
+        members = MemberSet()
+        for recipient_id in (3, 9, 700, 70_000):
+            members.add(recipient_id)
+        members.discard(9)
+        self.assertEqual(members.ids_after(0, 10), [3, 700, 70_000])
+        self.assertEqual(members.ids_after(3, 1), [700])
+        self.assertEqual(len(MemberSet(members.to_bytes())), 3)
+
+    def test_rebuild_matches_rules(self):
+        """Only subscribed recipients matching every rule are members"""
+        segment = refresh_segment(self.segment.pk)
+        self.assertEqual(segment.member_count, 2)
+        self.assertEqual(self._member_ids(), [self.gmail[1].pk, self.gmail[3].pk])
+
+    @override_settings(SEGMENT_REFRESH_OVERLAP_SECONDS=0)
+    def test_incremental_refresh_follows_changes(self):
+        """Changed recipients are re-evaluated without a rebuild"""
+        rebuilt_at = refresh_segment(self.segment.pk).rebuilt_at
+        self.gmail[0].tags = ["vip"]
+        self.gmail[0].save()
+        Recipient.objects.filter(pk=self.gmail[1].pk).update(
+            subscription_status=Recipient.UNSUBSCRIBED, updated_on=timezone.now()
+        )
+
+        segment = refresh_segment(self.segment.pk)
+        self.assertEqual(segment.rebuilt_at, rebuilt_at)  # topped up, not rebuilt
+        self.assertEqual(segment.member_count, 2)
+        self.assertEqual(self._member_ids(), [self.gmail[0].pk, self.gmail[3].pk])
+
+    def test_imports_move_the_watermark(self):
+        """Rows inserted by the COPY importer are picked up by the next refresh"""
+        refresh_segment(self.segment.pk)
+        upload = SimpleUploadedFile("recipients.csv", b"name,email\nNew,new@gmail.com\n")
+        RecipientImporterParallel(upload, mode="stream").run()
+        Recipient.objects.filter(email="new@gmail.com").update(tags=["vip"])  # no updated_on bump needed
+
+        segment = refresh_segment(self.segment.pk)
+        self.assertIn(Recipient.objects.get(email="new@gmail.com").pk, self._member_ids())
+        self.assertEqual(segment.member_count, 3)
+
+    def test_bad_rules_are_rejected(self):
+        """Unknown fields or operators fail validation"""
+        with self.assertRaises(ValidationError):
+            rules_to_q([{"field": "password", "op": "eq", "value": "x"}])
+        self.assertEqual(
+            Recipient.objects.filter(rules_to_q([
+                {"field": "domain", "op": "eq", "value": "example.com"},
+                {"field": "name", "op": "eq", "value": "G0"},
+            ], Segment.ANY)).count(),
+            2,
+        )
+
+    @patch('campaigns.tasks.send_batch.apply_async')
+    def test_dispatch_reads_segment_members(self, mock_apply):
+        """A segment campaign only dispatches the precomputed members"""
+        refresh_segment(self.segment.pk)
+        Campaign.objects.create(
+            name="VIP", subject="Hi", content="<p>Hi</p>", status=Campaign.IN_PROGRESS, segment=self.segment
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            dispatch_campaign_batches(budget=10)
+
+        sent_ids = sorted(i for c in mock_apply.call_args_list for i in c.kwargs["args"][1])
+        self.assertEqual(sent_ids, [self.gmail[1].pk, self.gmail[3].pk])
+
+    @override_settings(CACHES=LOCMEM_CACHES, DOMAIN_THROTTLE_MAX_WAIT=0, SUPPRESSION_REFRESH_SECONDS=0)
+    @patch('campaigns.tasks.send_campaign_report.delay')
+    @patch('campaigns.tasks.dispatch_campaign_batches.delay')
+    @patch('campaigns.tasks.send_email_to_recipient')
+    @patch('campaigns.tasks.send_batch.apply_async')
+    def test_finalize_ignores_segment_growth_during_send(self, mock_apply, mock_send, mock_dispatch, mock_report):
+        """A member who joins after dispatch does not keep the campaign open"""
+        refresh_segment(self.segment.pk)
+        campaign = Campaign.objects.create(
+            name="VIP", subject="Hi", content="<p>Hi</p>", status=Campaign.IN_PROGRESS, segment=self.segment
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            dispatch_campaign_batches(budget=10)
+            dispatch_campaign_batches(budget=10)
+        Recipient.objects.create(email="late@gmail.com", tags=["vip"])
+        self.assertEqual(refresh_segment(self.segment.pk).member_count, 3)
+
+        for call in mock_apply.call_args_list:
+            send_batch(*call.kwargs["args"])
+        result = finalize_campaign(campaign.pk)
+
+        self.assertEqual(result, {"status": "completed", "logs_count": 2})
+        campaign.refresh_from_db()
+        self.assertEqual(campaign.status, Campaign.COMPLETED)
+
+class Test21_RecipientAttributes(TestCase):
+    """
+    TEST #21: Verify extra upload columns are stored as JSONB attributes,
+    can be filtered by segment rules and fill template placeholders
+    """
+
+    CSV = (
+        b"name,email,City,plan\n"
+        b"Ann,ann@example.com,Oslo,pro\n"
+        b"Bob,bob@example.com,,free\n"
+        b"Bad,not-an-email,Rome,pro\n"
+    )
+
+    def test_stream_import_stores_extra_columns(self):
+        """Extra columns land in attributes in the COPY pass; empty cells are left out"""
+        result = RecipientImporterParallel(SimpleUploadedFile("recipients.csv", self.CSV), mode="stream").run()
+        self.assertEqual(result["created"], 2)
+        self.assertEqual(Recipient.objects.get(email="ann@example.com").attributes, {"city": "Oslo", "plan": "pro"})
+        self.assertEqual(Recipient.objects.get(email="bob@example.com").attributes, {"plan": "free"})
+
+    def test_merge_adds_attribute_keys(self):
+        """Merging attributes keeps stored keys and overwrites the file's keys"""
+        Recipient.objects.create(email="ann@example.com", name="Ann", attributes={"plan": "free", "vip": "yes"})
+        upload = SimpleUploadedFile("recipients.csv", self.CSV)
+        result = RecipientImporterParallel(upload, mode="stream", update_fields=["attributes"]).run()
+        self.assertEqual(result["updated"], 1)
+        self.assertEqual(
+            Recipient.objects.get(email="ann@example.com").attributes, {"plan": "pro", "vip": "yes", "city": "Oslo"}
+        )
+
+    def test_attributes_column_must_hold_json_objects(self):
+        """An `attributes` column is stored as the object; text, lists and scalars make the row invalid"""
+        upload = SimpleUploadedFile("recipients.csv", (
+            b"email,attributes\n"
+            b'ann@example.com,"{""plan"": ""pro""}"\n'
+            b"bob@example.com,gold\n"
+            b'cat@example.com,"[1, 2]"\n'
+            b"dan@example.com,7\n"
+            b"eve@example.com,\n"
+        ))
+        Recipient.objects.create(email="eve@example.com", attributes={"vip": "yes"})
+        result = RecipientImporterParallel(upload, mode="stream", update_fields=["attributes"]).run()
+        self.assertEqual((result["created"], result["invalid"]), (1, 3))
+        self.assertEqual(Recipient.objects.get(email="ann@example.com").attributes, {"plan": "pro"})
+        self.assertEqual(Recipient.objects.get(email="eve@example.com").attributes, {"vip": "yes"})
+        self.assertFalse(Recipient.objects.filter(email="bob@example.com").exists())
+
+    def test_excel_and_v1_imports_store_attributes(self):
+        """Excel streaming and the v1 importer fill attributes too"""
+        workbook = Workbook()
+        workbook.active.append(["Name", "Email", "Plan"])
+        workbook.active.append(["Ann", "ann@example.com", "pro"])
+        buffer = io.BytesIO()
+        workbook.save(buffer)
+        RecipientImporterParallel(SimpleUploadedFile("recipients.xlsx", buffer.getvalue()), mode="stream").run()
+        self.assertEqual(Recipient.objects.get(email="ann@example.com").attributes, {"plan": "pro"})
+
+        result = RecipientImporter(SimpleUploadedFile("more.csv", b"email,Plan\ncat@example.com,team\n")).run()
+        self.assertEqual(result["created"], 1)
+        self.assertEqual(Recipient.objects.get(email="cat@example.com").attributes, {"plan": "team"})
+
+    def test_segment_rules_on_attributes(self):
+        """attributes.<key> rules filter with containment and key checks"""
+        Recipient.objects.create(email="a@example.com", attributes={"plan": "pro", "city": "Oslo"})
+        Recipient.objects.create(email="b@example.com", attributes={"plan": "free"})
+        Recipient.objects.create(email="c@example.com")
+
+        def emails(rules, match=Segment.ALL):
+            return sorted(Recipient.objects.filter(rules_to_q(rules, match)).values_list("email", flat=True))
+
+        self.assertEqual(emails([{"field": "attributes.plan", "op": "eq", "value": "pro"}]), ["a@example.com"])
+        self.assertEqual(
+            emails([{"field": "attributes.plan", "op": "in", "value": ["pro", "free"]}]), ["a@example.com", "b@example.com"]
+        )
+        self.assertEqual(emails([{"field": "attributes.city", "op": "exists", "value": False}]), ["b@example.com", "c@example.com"])
+        self.assertEqual(emails([{"field": "attributes.plan", "op": "ne", "value": "pro"}]), ["b@example.com", "c@example.com"])
+        with self.assertRaises(ValidationError):
+            rules_to_q([{"field": "attributes.plan", "op": "gt", "value": "a"}])
+
+    @override_settings(SENDGRID_API_KEY="")
+    @patch('campaigns.providers.send_via_smtp', return_value=(250, b"OK"))
+    def test_batch_fetch_renders_referenced_keys(self, mock_smtp):
+        """Only referenced keys are fetched; placeholders are filled and escaped"""
+        recipient = Recipient.objects.create(
+            email="ann@example.com", name="Ann", attributes={"city": "<Oslo>", "notes": "x" * 1000}
+        )
+        campaign = Campaign.objects.create(name="Hello", subject="Hi {{ name }}", content="<p>{{city}} {{ plan }}</p>")
+        self.assertEqual(template_fields(campaign), ["city", "plan"])
+
+        fetched = fetch_recipients([recipient.pk], template_fields(campaign))[recipient.pk]
+        self.assertIn("attributes", fetched.get_deferred_fields())
+        self.assertEqual(fetched.template_values, {"city": "<Oslo>", "plan": None})
+
+        send_email_to_recipient(campaign, fetched)
+        subject, html, email = mock_smtp.call_args.args
+        self.assertEqual((subject, html, email), ("Hi Ann", "<p>&lt;Oslo&gt; </p>", "ann@example.com"))
+        self.assertEqual(render("{{ email }}", {"email": "a&b@example.com"}, html=False), "a&b@example.com")
+
+class Test22_QueryPlans(TestCase):
+    """
+    TEST #22: Verify the hot recipient and delivery-log queries are planned
+    as index scans over seeded data, without sequential scans or sorts
+    """
+
+    HOT_TABLES = {"campaigns_recipient", "campaigns_deliverylog"}
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.campaign = Campaign.objects.create(name="Plans", subject="S", content="C")
+        other = Campaign.objects.create(name="Other", subject="S", content="C")
+        with connection.cursor() as cursor:
+            cursor.execute("""
+                INSERT INTO campaigns_recipient
+                    (name, email, domain, subscription_status, tags, attributes, created_on, updated_on)
+                SELECT '', 'user' || i || '@d' || (i % 50) || '.test', 'd' || (i % 50) || '.test',
+                       CASE WHEN i % 10 = 0 THEN 'unsubscribed' ELSE 'subscribed' END, '{}', '{}', NOW(), NOW()
+                FROM generate_series(1, 20000) AS i
+            """)
+            cursor.execute("""
+                INSERT INTO campaigns_deliverylog (campaign_id, recipient_email, status, sent_at)
+                SELECT CASE WHEN i %% 4 = 0 THEN %s ELSE %s END, 'user' || i || '@d.test',
+                       CASE WHEN i %% 20 = 0 THEN 'failed' ELSE 'sent' END, NOW()
+                FROM generate_series(1, 20000) AS i
+            """, [cls.campaign.pk, other.pk])
+            cursor.execute("ANALYZE campaigns_recipient")
+            cursor.execute("ANALYZE campaigns_deliverylog")
+
+    def setUp(self):
+        # a sequential scan still gets planned when no index can serve the query
+        with connection.cursor() as cursor:
+            cursor.execute("SET LOCAL enable_seqscan = off")
+
+    def _plans(self, run):
+        """EXPLAIN every query `run` issues against the hot tables."""
+        with CaptureQueriesContext(connection) as queries:
+            run()
+        plans = []
+        with connection.cursor() as cursor:
+            for query in queries.captured_queries:
+                if not any(table in query["sql"] for table in self.HOT_TABLES):
+                    continue
+                cursor.execute("EXPLAIN (FORMAT JSON) " + query["sql"])
+                plans.append(cursor.fetchone()[0][0]["Plan"])
+        self.assertTrue(plans)
+        return plans
+
+    @staticmethod
+    def _nodes(plan):
+        yield plan
+        for child in plan.get("Plans", ()):
+            yield from Test22_QueryPlans._nodes(child)
+
+    def assertIndexed(self, run, index=None):
+        for plan in self._plans(run):
+            nodes = list(self._nodes(plan))
+            for node in nodes:
+                self.assertFalse(
+                    node["Node Type"] == "Seq Scan" and node.get("Relation Name") in self.HOT_TABLES,
+                    f"sequential scan on {node.get('Relation Name')}",
+                )
+                self.assertNotIn(node["Node Type"], ("Sort", "Incremental Sort"))
+            if index:
+                self.assertIn(index, [node.get("Index Name") for node in nodes])
+
+    def test_default_recipient_queryset_is_unordered(self):
+        """Recipient has no default ORDER BY"""
+        self.assertNotIn("ORDER BY", str(Recipient.objects.filter(subscription_status="subscribed").query))
+
+    def test_dispatch_pages_use_partial_index(self):
+        """Dispatcher pages and audience counts read the subscribed partial index in id order"""
+        # the page may walk either id-ordered index (no visibility map inside a test transaction)
+        page = Recipient.objects.filter(subscription_status="subscribed", id__gt=5000).order_by("id")
+        self.assertIndexed(lambda: list(page.values_list("id", "domain")[:200]))
+        self.assertIndexed(
+            lambda: Recipient.objects.filter(subscription_status="subscribed").count(), "recipient_subscribed_id_idx"
+        )
+
+    def test_segment_pages_are_index_lookups(self):
+        """Segment dispatch filters a page of member ids without scanning the table"""
+        ids = list(Recipient.objects.order_by("id").values_list("id", flat=True)[100:300])
+        self.assertIndexed(
+            lambda: list(Recipient.objects.filter(subscription_status="subscribed", id__in=ids).values_list("id", "domain"))
+        )
+
+    def test_delivery_log_counts_use_campaign_index(self):
+        """finalize_campaign's count and the admin delivery stats use the (campaign, status) index"""
+        self.assertIndexed(
+            lambda: DeliveryLog.objects.filter(campaign=self.campaign).count(), "dlog_campaign_status_idx"
+        )
+        campaign_admin = admin.site._registry[Campaign]
+        self.assertIndexed(lambda: campaign_admin.delivery_stats(self.campaign), "dlog_campaign_status_idx")
+
+    def test_report_streams_in_index_order(self):
+        """The campaign report reads logs in recipient_email order without sorting"""
+        rows = DeliveryLog.objects.filter(campaign=self.campaign).order_by("recipient_email").values(
+            "recipient_email", "status", "failure_reason", "sent_at"
+        )
+        self.assertIndexed(lambda: list(rows[:100]), "dlog_campaign_email_idx")
+
+@override_settings(CACHES=LOCMEM_CACHES, DOMAIN_THROTTLE_MAX_WAIT=0)
+class Test23_QueryBudgets(TestCase):
+    """
+    TEST #23: Verify each task issues a fixed number of queries per unit of
+    work (no N+1) and that task executions are logged with their stats
+    """
+
+    def setUp(self):
+        self.campaign = Campaign.objects.create(
+            name="Budget", subject="Hi {{ name }}", content="<p>{{ city }}</p>", status=Campaign.IN_PROGRESS
+        )
+        Recipient.objects.bulk_create(
+            Recipient(email=f"user{i}@d{i % 7}.test", domain=f"d{i % 7}.test", attributes={"city": "Oslo"})
+            for i in range(200)
+        )
+        self.ids = list(Recipient.objects.order_by("id").values_list("id", flat=True))
+        # the per-worker suppression filter is warm after a worker's first batch
+        get_suppression_filter()._ensure_fresh()
+
+    @patch('campaigns.tasks.send_email_to_recipient')
+    def test_send_batch_budget(self, mock_send):
+        """send_batch of 200: campaign, recipients, log insert, slot release"""
+        with query_budget(4):
+            send_batch(self.campaign.pk, self.ids)
+        self.assertEqual(mock_send.call_count, 200)
+
+        with measure() as small:
+            send_batch(self.campaign.pk, self.ids[:20])
+        self.assertEqual(small.queries, 4)  # independent of the batch size
+
+    @patch('campaigns.tasks.send_campaign_report.delay')
+    def test_finalize_budget(self, mock_report):
+        """finalize_campaign: campaign, log count, status update, last delivery time"""
+        Campaign.objects.filter(pk=self.campaign.pk).update(dispatch_completed=True)
+        DeliveryLog.objects.bulk_create(
+            DeliveryLog(campaign=self.campaign, recipient_id=i, recipient_email=f"{i}@d.test", status="sent")
+            for i in self.ids
+        )
+        with query_budget(4):
+            finalize_campaign(self.campaign.pk)
+        mock_report.assert_called_once()
+
+    @patch('campaigns.tasks.finalize_campaign.apply_async')
+    @patch('campaigns.tasks.dispatch_campaign_batches.delay')
+    def test_start_campaign_send_budget(self, mock_dispatch, mock_finalize):
+        """start_campaign_send: campaign and audience count"""
+        with query_budget(2):
+            start_campaign_send(self.campaign.pk)
+        mock_dispatch.assert_called_once()
+
+    @patch('campaigns.tasks.start_campaign_send.delay')
+    def test_check_scheduled_budget_is_constant(self, mock_start):
+        """Due campaigns are claimed with one locking select and one update, however many"""
+        for i in range(5):
+            Campaign.objects.create(
+                name=f"Due {i}", subject="S", content="C", status=Campaign.SCHEDULED,
+                scheduled_time=timezone.now() - timedelta(minutes=1),
+            )
+        with query_budget(2):
+            check_scheduled_campaigns()
+        self.assertEqual(mock_start.call_count, 5)
+        self.assertEqual(Campaign.objects.filter(status=Campaign.SCHEDULED).count(), 0)
+
+    def test_budget_overrun_lists_queries(self):
+        """Going over budget fails with the offending statements"""
+        with self.assertRaisesRegex(BudgetExceeded, "2 queries issued, budget is 1"):
+            with query_budget(1):
+                Recipient.objects.count()
+                Campaign.objects.count()
+
+    @patch('campaigns.tasks.send_email_to_recipient')
+    def test_task_runs_are_logged_with_stats(self, mock_send):
+        """Each task execution logs its query count, database and wall time as fields"""
+        with self.assertLogs("campaigns.instrumentation", level="INFO") as logs:
+            send_batch.apply(args=[self.campaign.pk, self.ids[:10]])
+        record = logs.records[-1]
+        self.assertEqual(record.task, "campaigns.tasks.send_batch")
+        self.assertEqual(record.queries, 4)
+        self.assertGreaterEqual(record.wall_ms, record.db_ms)
+        self.assertIn("queries=4", record.getMessage())
+
+@override_settings(CACHES=LOCMEM_CACHES, DOMAIN_THROTTLE_MAX_WAIT=0, SENDGRID_API_KEY="", SUPPRESSION_REFRESH_SECONDS=0)
+class Test24_Metrics(TestCase):
+    """
+    TEST #24: Verify sends, batches, suppressions and finalization are
+    counted and that the web process exposes them with queue depths
+    """
+
+    def setUp(self):
+        self.campaign = Campaign.objects.create(name="Metrics", subject="S", content="C", status=Campaign.IN_PROGRESS)
+        self.ids = [Recipient.objects.create(email=f"user{i}@example.com").pk for i in range(3)]
+
+    @staticmethod
+    def sample(name, **labels):
+        return REGISTRY.get_sample_value(name, labels) or 0
+
+    @patch('campaigns.providers.send_via_smtp')
+    def test_sends_and_batches_are_counted(self, mock_smtp):
+        """Sent/failed per provider, send latency and batch duration are recorded"""
+        mock_smtp.side_effect = [(250, b"OK"), smtplib.SMTPException("down"), (250, b"OK")]
+        sent = self.sample("mailer_emails_total", provider="smtp", status="sent")
+        failed = self.sample("mailer_emails_total", provider="smtp", status="failed")
+        latencies = self.sample("mailer_send_seconds_count", provider="smtp")
+        batches = self.sample("mailer_batch_seconds_count")
+
+        send_batch(self.campaign.pk, self.ids)
+
+        self.assertEqual(self.sample("mailer_emails_total", provider="smtp", status="sent") - sent, 2)
+        self.assertEqual(self.sample("mailer_emails_total", provider="smtp", status="failed") - failed, 1)
+        self.assertEqual(self.sample("mailer_send_seconds_count", provider="smtp") - latencies, 3)
+        self.assertEqual(self.sample("mailer_batch_seconds_count") - batches, 1)
+
+    @patch('campaigns.tasks.send_email_to_recipient')
+    def test_suppressed_recipients_are_counted(self, mock_send):
+        """Suppressed addresses increment their own counter"""
+        suppress("user0@example.com")
+        before = self.sample("mailer_emails_suppressed_total")
+        send_batch(self.campaign.pk, self.ids)
+        self.assertEqual(self.sample("mailer_emails_suppressed_total") - before, 1)
+
+    @patch('campaigns.tasks.send_campaign_report.delay')
+    def test_finalize_lag_is_observed(self, mock_report):
+        """Completing a campaign records the lag since its last delivery"""
+        Campaign.objects.filter(pk=self.campaign.pk).update(dispatch_completed=True)
+        for recipient_id in self.ids:
+            DeliveryLog.objects.create(
+                campaign=self.campaign, recipient_id=recipient_id, recipient_email="x@example.com", status="sent",
+                sent_at=timezone.now() - timedelta(seconds=30),
+            )
+        before = self.sample("mailer_finalize_lag_seconds_count")
+        finalize_campaign(self.campaign.pk)
+        self.assertEqual(self.sample("mailer_finalize_lag_seconds_count") - before, 1)
+
+    @override_settings(METRICS_ALLOWED_NETWORKS=["127.0.0.0/8"])
+    @patch('campaigns.metrics.queue_lengths', return_value={"senders.high": 7, "scheduler": 0})
+    def test_metrics_endpoint(self, mock_lengths):
+        """/metrics serves the pipeline series and the broker queue depths"""
+        self.assertEqual(reverse("metrics"), "/metrics")
+        response = metrics_view(RequestFactory().get("/metrics"))
+        self.assertEqual(response.status_code, 200)
+        body = response.content.decode()
+        self.assertIn('mailer_queue_depth{queue="senders.high"} 7.0', body)
+        self.assertIn("mailer_emails_total", body)
+        self.assertTrue({"senders", "senders.high", "scheduler", "imports"} <= set(queue_names()))
+
+    @override_settings(METRICS_ALLOWED_NETWORKS=["10.0.0.0/8"], METRICS_BEARER_TOKEN="scrape-secret")
+    @patch('campaigns.metrics.queue_lengths', return_value={})
+    def test_metrics_endpoint_is_restricted(self, mock_lengths):
+        """/metrics answers allowed networks and the bearer token only"""
+        factory = RequestFactory()
+        self.assertEqual(metrics_view(factory.get("/metrics", REMOTE_ADDR="203.0.113.5")).status_code, 403)
+        self.assertEqual(metrics_view(factory.get("/metrics", REMOTE_ADDR="10.1.2.3")).status_code, 200)
+        self.assertEqual(metrics_view(factory.get(
+            "/metrics", REMOTE_ADDR="203.0.113.5", HTTP_AUTHORIZATION="Bearer wrong"
+        )).status_code, 403)
+        self.assertEqual(metrics_view(factory.get(
+            "/metrics", REMOTE_ADDR="203.0.113.5", HTTP_AUTHORIZATION="Bearer scrape-secret"
+        )).status_code, 200)
+
+    @override_settings(METRICS_ALLOWED_NETWORKS=[], METRICS_BEARER_TOKEN="")
+    @patch('campaigns.metrics.queue_lengths', return_value={})
+    def test_metrics_endpoint_is_closed_by_default(self, mock_lengths):
+        """Without allowed networks or a token nobody can scrape the web process"""
+        self.assertEqual(metrics_view(RequestFactory().get("/metrics")).status_code, 403)
+
+@override_settings(CACHES=LOCMEM_CACHES, DOMAIN_THROTTLE_MAX_WAIT=0, SENDGRID_API_KEY="", SUPPRESSION_REFRESH_SECONDS=0)
+class Test25_Tracing(TestCase):
+    """
+    TEST #25: Verify tracing is inert unless configured, and that once on, a
+    campaign's tasks, queries, provider calls and log flushes share one trace
+    """
+
+    def setUp(self):
+        self.campaign = Campaign.objects.create(name="Traced", subject="S", content="C", status=Campaign.IN_PROGRESS)
+        self.ids = [Recipient.objects.create(email=f"user{i}@example.com").pk for i in range(3)]
+        self.addCleanup(tracing.shutdown)
+
+    def _configure(self):
+        from opentelemetry.sdk.trace.export.in_memory_span_exporter import InMemorySpanExporter
+        exporter = InMemorySpanExporter()
+        self.assertTrue(tracing.configure(exporter=exporter))
+        return exporter
+
+    @patch('campaigns.tasks.finalize_campaign.apply_async')
+    @patch('campaigns.tasks.dispatch_campaign_batches.delay')
+    def test_off_by_default(self, mock_dispatch, mock_finalize):
+        """Without an exporter nothing is traced or stored"""
+        self.assertFalse(tracing.configure())  # TRACING_EXPORTER defaults to "none"
+        with tracing.span("anything") as current:
+            self.assertIsNone(current)
+        start_campaign_send(self.campaign.pk)
+        self.assertIsNone(cache.get(f"campaign-trace:{self.campaign.pk}"))
+        self.assertIsNone(tracing.campaign_trace(self.campaign.pk))
+
+    @skipIf(tracing.OTEL_AVAILABLE, "opentelemetry-sdk is installed")
+    @override_settings(TRACING_EXPORTER="file")
+    def test_missing_sdk_keeps_tracing_off(self):
+        """Asking for an exporter without the SDK logs a warning instead of failing"""
+        with self.assertLogs("campaigns.tracing", level="WARNING"):
+            self.assertFalse(tracing.configure())
+        self.assertFalse(tracing.enabled())
+
+    @skipUnless(tracing.OTEL_AVAILABLE, "opentelemetry-sdk not installed")
+    @patch('campaigns.providers.send_via_smtp', return_value=(250, b"OK"))
+    def test_send_batch_span_tree(self, mock_smtp):
+        """A batch's queries, provider calls and log flush are children of its task span"""
+        exporter = self._configure()
+        send_batch.apply(args=[self.campaign.pk, self.ids])
+
+        spans = exporter.get_finished_spans()
+        (task_span,) = [s for s in spans if s.name == "celery.task campaigns.tasks.send_batch"]
+        names = [s.name for s in spans if s.parent and s.parent.span_id == task_span.context.span_id]
+        self.assertEqual(names.count("provider.send"), 3)
+        self.assertIn("db.query", names)
+        self.assertEqual({s.context.trace_id for s in spans}, {task_span.context.trace_id})
+        (flush,) = [s for s in spans if s.name == "deliverylog.flush"]
+        self.assertEqual(flush.attributes["rows"], 3)
+
+    @skipUnless(tracing.OTEL_AVAILABLE, "opentelemetry-sdk not installed")
+    @patch('campaigns.tasks.finalize_campaign.apply_async')
+    @patch('campaigns.tasks.dispatch_campaign_batches.delay')
+    def test_batches_join_the_campaign_trace(self, mock_dispatch, mock_finalize):
+        """Batches enqueued by a later dispatcher tick carry the campaign's trace context"""
+        from opentelemetry import trace
+        exporter = self._configure()
+        start_campaign_send.apply(args=[self.campaign.pk])
+        (start_span,) = [s for s in exporter.get_finished_spans() if s.name.endswith("start_campaign_send")]
+
+        enqueued_traces = []
+        with patch('campaigns.tasks.send_batch.apply_async',
+                   side_effect=lambda **kw: enqueued_traces.append(trace.get_current_span().get_span_context().trace_id)):
+            with self.captureOnCommitCallbacks(execute=True):
+                dispatch_campaign_batches(budget=1)
+        self.assertEqual(enqueued_traces, [start_span.context.trace_id])
+
+    @skipUnless(tracing.OTEL_AVAILABLE, "opentelemetry-sdk not installed")
+    def test_unforked_pools_are_configured_at_worker_init(self):
+        """The solo imports worker sets tracing up in worker_init; prefork waits for its children"""
+        with tempfile.NamedTemporaryFile(suffix=".jsonl") as out, \
+                self.settings(TRACING_EXPORTER="file", TRACING_FILE=out.name):
+            tracing._configure_unforked_worker(sender=SimpleNamespace(pool_cls="prefork"))
+            self.assertFalse(tracing.enabled())
+            tracing._configure_unforked_worker(sender=SimpleNamespace(pool_cls="solo"))
+            self.assertTrue(tracing.enabled())
+
+@override_settings(CACHES=LOCMEM_CACHES, DOMAIN_THROTTLE_MAX_WAIT=0, SENDGRID_API_KEY="", SUPPRESSION_REFRESH_SECONDS=0,
+                   PROFILE_FLAG_REFRESH_SECONDS=0, PROFILE_CLOCK="wall", PROFILE_INTERVAL_MS=1)
+class Test26_Profiler(TestCase):
+    """
+    TEST #26: Verify profiling is requested per task name or campaign through
+    the cache, and that selected executions write collapsed stacks per worker
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.profile_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.profile_dir, ignore_errors=True)
+        self.campaign = Campaign.objects.create(name="Profiled", subject="S", content="C", status=Campaign.IN_PROGRESS)
+        self.ids = [Recipient.objects.create(email=f"user{i}@example.com").pk for i in range(3)]
+
+    def test_targets(self):
+        """Task-name and campaign targets select executions until they expire or are cancelled"""
+        self.assertIsNone(profiling.selected("campaigns.tasks.send_batch", [self.campaign.pk, []]))
+
+        profiling.request_profile(f"campaign:{self.campaign.pk}", 60)
+        self.assertEqual(profiling.selected("campaigns.tasks.send_batch", [self.campaign.pk, []]), f"campaign:{self.campaign.pk}")
+        self.assertIsNone(profiling.selected("campaigns.tasks.send_batch", [self.campaign.pk + 1, []]))
+        self.assertIsNone(profiling.selected("campaigns.tasks.run_import_job", [self.campaign.pk]))
+
+        profiling.request_profile("campaigns.tasks.run_import_job", 60)
+        self.assertEqual(profiling.selected("campaigns.tasks.run_import_job", [1]), "campaigns.tasks.run_import_job")
+
+        profiling.request_profile(f"campaign:{self.campaign.pk}", 0)
+        self.assertEqual(list(profiling.active_targets()), ["campaigns.tasks.run_import_job"])
+        with patch('campaigns.profiling.time.time', return_value=time.time() + 120):
+            self.assertEqual(profiling.active_targets(), {})
+
+    def test_remote_control_command(self):
+        """`celery control profile <target> <seconds>` reaches the workers, which store the request"""
+        # the broadcast goes through the broker to a worker's mailbox node, which
+        # dispatches it to the registered handler as a running worker does
+        app = Celery("control-test", broker="memory://", fixups=[])
+        with app.connection_for_write() as conn:
+            node = app.control.mailbox.Node("worker@test", handlers=Panel.data, channel=conn.default_channel)
+            node.listen()
+            app.control.broadcast(
+                "profile", arguments={"target": "campaigns.tasks.send_batch", "seconds": 30}, connection=conn
+            )
+            conn.drain_events(timeout=5)
+        self.assertIn("campaigns.tasks.send_batch", profiling.active_targets())
+
+    def test_cli_knows_the_control_command(self):
+        """The celery CLI, which only imports mailer_project.celery, accepts `control profile`"""
+        env = {**os.environ, "CELERY_BROKER_URL": "memory://", "CELERY_RESULT_BACKEND": "cache+memory://"}
+        result = subprocess.run(
+            [sys.executable, "-m", "celery", "-A", "mailer_project", "control", "profile", "campaign:42", "10",
+             "--timeout", "0.5"],
+            cwd=settings.BASE_DIR, env=env, capture_output=True, text=True, timeout=60,
+        )
+        self.assertNotIn("not recognized", result.stderr)
+        self.assertIn("No nodes replied", result.stderr)  # sent: nobody listens on this broker
+
+    def _slow_smtp(self, *args, **kwargs):
+        time.sleep(0.02)
+        return (250, b"OK")
+
+    def test_selected_batch_is_sampled(self):
+        """A profiled send_batch appends flamegraph lines to the worker's .folded file"""
+        profiling.request_profile(f"campaign:{self.campaign.pk}", 60)
+        with override_settings(PROFILE_DIR=self.profile_dir), \
+                patch('campaigns.providers.send_via_smtp', side_effect=self._slow_smtp):
+            send_batch.apply(args=[self.campaign.pk, self.ids])
+            path = profiling.output_path()
+
+        self.assertEqual(os.listdir(self.profile_dir), [os.path.basename(path)])
+        with open(path) as f:
+            lines = f.read().splitlines()
+        self.assertTrue(lines)
+        for line in lines:
+            stack, count = line.rsplit(" ", 1)
+            self.assertTrue(stack.startswith(f"campaigns.tasks.send_batch [campaign:{self.campaign.pk}];"))
+            self.assertGreater(int(count), 0)
+        self.assertTrue(any("campaigns.tasks:send_batch" in line for line in lines))
+        self.assertEqual(DeliveryLog.objects.filter(campaign=self.campaign, status="sent").count(), 3)
+
+    @patch('campaigns.providers.send_via_smtp', return_value=(250, b"OK"))
+    def test_unselected_batch_is_not_sampled(self, mock_smtp):
+        """Without a matching request nothing is written and no timer is left behind"""
+        profiling.request_profile(f"campaign:{self.campaign.pk + 1}", 60)
+        with override_settings(PROFILE_DIR=self.profile_dir):
+            send_batch.apply(args=[self.campaign.pk, self.ids])
+        self.assertEqual(os.listdir(self.profile_dir), [])
+        self.assertEqual(signal.getitimer(signal.ITIMER_REAL), (0.0, 0.0))
+
+@override_settings(CACHES=LOCMEM_CACHES, DOMAIN_THROTTLE_MAX_WAIT=0, SENDGRID_API_KEY="", SUPPRESSION_REFRESH_SECONDS=0,
+                   PROGRESS_SECRET_KEY="test-progress-key")
+class Test27_CampaignProgress(TestCase):
+    """
+    TEST #27: Verify senders keep per-campaign progress counters in the cache
+    and that the JSON and SSE endpoints report them without database queries
+    to staff sessions and holders of the campaign's token only
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.factory = RequestFactory()
+        self.campaign = Campaign.objects.create(name="Live", subject="S", content="C", status=Campaign.IN_PROGRESS)
+        self.ids = [Recipient.objects.create(email=f"user{i}@example.com").pk for i in range(4)]
+
+    @patch('campaigns.tasks.finalize_campaign.apply_async')
+    @patch('campaigns.tasks.dispatch_campaign_batches.delay')
+    @patch('campaigns.providers.send_via_smtp')
+    def _send_one_batch(self, mock_smtp, mock_dispatch, mock_finalize):
+        mock_smtp.side_effect = [(250, b"OK"), smtplib.SMTPException("down")]
+        suppress("user0@example.com")
+        start_campaign_send(self.campaign.pk)
+        send_batch(self.campaign.pk, self.ids[:3])
+
+    def test_counters_follow_the_send(self):
+        """Audience, sent, failed, suppressed, pending, rate and ETA come from the counters"""
+        self._send_one_batch()
+        snapshot = progress.snapshot(self.campaign.pk)
+        self.assertEqual(
+            {k: snapshot[k] for k in ("status", "total", "sent", "failed", "suppressed", "pending")},
+            {"status": "in_progress", "total": 4, "sent": 1, "failed": 1, "suppressed": 1, "pending": 1},
+        )
+        self.assertGreater(snapshot["rate"], 0)
+        self.assertEqual(snapshot["eta_seconds"], round(1 / snapshot["rate"]))
+
+        # nothing handled within the rate window: no rate, no ETA
+        later = progress.snapshot(self.campaign.pk, now=time.time() + 2 * progress.RATE_WINDOW)
+        self.assertEqual((later["rate"], later["eta_seconds"]), (0, None))
+
+    @patch('campaigns.tasks.send_campaign_report.delay')
+    def test_finalize_marks_completed(self, mock_report):
+        """A finalized campaign reports completed with nothing pending"""
+        Campaign.objects.filter(pk=self.campaign.pk).update(dispatch_completed=True)
+        progress.start(self.campaign.pk, 1)
+        DeliveryLog.objects.bulk_create([DeliveryLog(campaign=self.campaign, recipient_email=f"user{i}@example.com", status="sent") for i in range(4)])
+        finalize_campaign(self.campaign.pk)
+        snapshot = progress.snapshot(self.campaign.pk)
+        self.assertEqual((snapshot["status"], snapshot["pending"], snapshot["eta_seconds"]), ("completed", 0, 0))
+
+    @patch('campaigns.providers.send_via_smtp', return_value=(250, b"OK"))
+    def test_cache_outage_does_not_fail_the_batch(self, mock_smtp):
+        """Progress updates are best effort: the batch still completes and logs"""
+        with patch('campaigns.progress.cache.incr', side_effect=ConnectionError("redis down")), \
+                self.assertLogs("campaigns.progress", level="WARNING"):
+            send_batch(self.campaign.pk, self.ids)
+        self.assertEqual(DeliveryLog.objects.filter(campaign=self.campaign, status="sent").count(), 4)
+
+    def test_json_endpoint(self):
+        """The JSON endpoint answers from the cache alone, 404 when nothing was recorded"""
+        url = reverse("campaign-progress", args=[self.campaign.pk]) + f"?token={progress.make_token(self.campaign.pk)}"
+        self.assertEqual(campaign_progress_view(self.factory.get(url), self.campaign.pk).status_code, 404)
+
+        self._send_one_batch()
+        with self.assertNumQueries(0):
+            response = campaign_progress_view(self.factory.get(url), self.campaign.pk)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content)["sent"], 1)
+
+    def test_sse_stream(self):
+        """The stream sends progress events and ends once the campaign completes"""
+        self._send_one_batch()
+        events = progress_events(self.campaign.pk, interval=0, duration=0)
+        self.assertEqual(next(events), "retry: 0\n\n")
+        event = next(events)
+        self.assertTrue(event.startswith("event: progress\ndata: "))
+        self.assertEqual(json.loads(event.split("data: ", 1)[1])["failed"], 1)
+        self.assertEqual(list(events), [])  # duration elapsed: the client reconnects
+
+        progress.finish(self.campaign.pk)
+        url = reverse("campaign-progress-stream", args=[self.campaign.pk]) + f"?token={progress.make_token(self.campaign.pk)}"
+        with override_settings(PROGRESS_STREAM_INTERVAL=0, PROGRESS_STREAM_SECONDS=60), self.assertNumQueries(0):
+            response = campaign_progress_stream(self.factory.get(url), self.campaign.pk)
+            body = b"".join(response.streaming_content).decode()
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+        self.assertEqual(body.count("event: progress"), 1)
+        self.assertIn('"status": "completed"', body)
+
+    def test_access_needs_token_or_staff(self):
+        """Anonymous requests and tokens of other campaigns are refused; staff sessions pass"""
+        self._send_one_batch()
+        url = reverse("campaign-progress", args=[self.campaign.pk])
+        self.assertEqual(campaign_progress_view(self.factory.get(url), self.campaign.pk).status_code, 403)
+        other = self.factory.get(url, {"token": progress.make_token(self.campaign.pk + 1)})
+        self.assertEqual(campaign_progress_view(other, self.campaign.pk).status_code, 403)
+        stream_url = reverse("campaign-progress-stream", args=[self.campaign.pk])
+        self.assertEqual(campaign_progress_stream(self.factory.get(stream_url), self.campaign.pk).status_code, 403)
+
+        request = self.factory.get(url)
+        request.user = get_user_model().objects.create_user("viewer", "viewer@example.com", "pass")
+        self.assertEqual(campaign_progress_view(request, self.campaign.pk).status_code, 403)
+        request.user.is_staff = True
+        self.assertEqual(campaign_progress_view(request, self.campaign.pk).status_code, 200)
+
+    @override_settings(PROGRESS_STREAM_MAX_PER_PROCESS=1)
+    def test_open_streams_are_capped(self):
+        """Beyond the per-process cap a stream is refused until an open one is closed"""
+        self._send_one_batch()
+        url = reverse("campaign-progress-stream", args=[self.campaign.pk]) + f"?token={progress.make_token(self.campaign.pk)}"
+        # closing a response signals request_finished, which would close the test's connection
+        request_finished.disconnect(close_old_connections)
+        self.addCleanup(request_finished.connect, close_old_connections)
+        with patch('campaigns.views._stream_slots', None):
+            first = campaign_progress_stream(self.factory.get(url), self.campaign.pk)
+            self.assertEqual(first.status_code, 200)
+            refused = campaign_progress_stream(self.factory.get(url), self.campaign.pk)
+            self.assertEqual(refused.status_code, 503)
+            first.close()  # closed before it sent anything
+            self.assertEqual(campaign_progress_stream(self.factory.get(url), self.campaign.pk).status_code, 200)
+
+@override_settings(CACHES=LOCMEM_CACHES, DOMAIN_THROTTLE_MAX_WAIT=0, SENDGRID_API_KEY="", SUPPRESSION_REFRESH_SECONDS=0,
+                   UNSUBSCRIBE_SECRET_KEY="test-unsubscribe-key", SITE_URL="https://mail.example.com")
+class Test28_OneClickUnsubscribe(TestCase):
+    """
+    TEST #28: Verify emails carry signed RFC 8058 unsubscribe links, that the
+    endpoint validates them without the database, and that buffered requests
+    are applied with bulk UPDATEs
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.factory = RequestFactory()
+        self.recipients = [Recipient.objects.create(email=f"user{i}@example.com") for i in range(3)]
+        self.campaign = Campaign.objects.create(
+            name="Unsub", subject="News", content='<a href="{{ unsubscribe_url }}">Unsubscribe</a>',
+            status=Campaign.IN_PROGRESS,
+        )
+
+    def _url(self, recipient):
+        return reverse("unsubscribe", args=[unsubscribe.make_token(recipient.pk)])
+
+    def test_tokens(self):
+        """Tokens round-trip and any tampering or another key invalidates them"""
+        token = unsubscribe.make_token(12345)
+        self.assertEqual(unsubscribe.read_token(token), 12345)
+        value, signature = token.split(".")
+        self.assertIsNone(unsubscribe.read_token(f"{unsubscribe.make_token(12346).split('.')[0]}.{signature}"))
+        self.assertIsNone(unsubscribe.read_token(value))
+        self.assertIsNone(unsubscribe.read_token("!!.x"))
+        with override_settings(UNSUBSCRIBE_SECRET_KEY="another-key"):
+            self.assertIsNone(unsubscribe.read_token(token))
+        with override_settings(UNSUBSCRIBE_SECRET_KEY=""):
+            self.assertEqual(unsubscribe.list_unsubscribe_headers(12345), {})
+
+    def test_no_links_without_site_url(self):
+        """Without an explicit SITE_URL emails carry no unsubscribe header and the link renders empty"""
+        with override_settings(SITE_URL=""):
+            self.assertEqual(unsubscribe.list_unsubscribe_headers(12345), {})
+            send_batch(self.campaign.pk, [self.recipients[0].pk])
+
+        email = mail.outbox[0]
+        self.assertNotIn("List-Unsubscribe", email.extra_headers)
+        self.assertIn('href=""', email.body)
+
+    def test_emails_carry_list_unsubscribe(self):
+        """Every email has List-Unsubscribe(-Post) headers and the link renders in the body"""
+        self.assertEqual(template_fields(self.campaign), [])  # not an attribute key
+        send_batch(self.campaign.pk, [self.recipients[0].pk])
+
+        email = mail.outbox[0]
+        url = f"https://mail.example.com{self._url(self.recipients[0])}"
+        self.assertEqual(email.extra_headers["List-Unsubscribe"], f"<{url}>")
+        self.assertEqual(email.extra_headers["List-Unsubscribe-Post"], "List-Unsubscribe=One-Click")
+        self.assertIn(f'href="{url}"', email.body)
+
+    def test_one_click_post_is_buffered(self):
+        """POSTs only queue the request; the flush applies them all with one UPDATE"""
+        before = Recipient.objects.get(pk=self.recipients[0].pk).updated_on
+        with self.assertNumQueries(0):
+            for recipient in self.recipients[:2] + [self.recipients[0]]:
+                request = self.factory.post(self._url(recipient), "List-Unsubscribe=One-Click",
+                                            content_type="application/x-www-form-urlencoded")
+                response = unsubscribe_view(request, unsubscribe.make_token(recipient.pk))
+                self.assertEqual(response.status_code, 200)
+        self.assertFalse(Recipient.objects.filter(subscription_status=Recipient.UNSUBSCRIBED).exists())
+
+        with self.assertNumQueries(1):
+            self.assertEqual(flush_unsubscribes(), {"unsubscribed": 2})
+        unsubscribed = Recipient.objects.filter(subscription_status=Recipient.UNSUBSCRIBED)
+        self.assertEqual(set(unsubscribed.values_list("pk", flat=True)), {r.pk for r in self.recipients[:2]})
+        self.assertGreater(unsubscribed.get(pk=self.recipients[0].pk).updated_on, before)  # segment watermark
+        self.assertEqual(flush_unsubscribes(), {"unsubscribed": 0})
+
+    def test_get_confirms_and_bad_token_is_404(self):
+        """GET (e.g. a link scanner) changes nothing; a forged token is rejected"""
+        token = unsubscribe.make_token(self.recipients[0].pk)
+        response = unsubscribe_view(self.factory.get(self._url(self.recipients[0])), token)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'<form method="post">', response.content)
+        self.assertIsNone(cache.get(unsubscribe.BUFFER.seq_key))
+
+        with self.assertRaises(Http404):
+            unsubscribe_view(self.factory.post("/unsubscribe/x"), token[:-1] + ("A" if token[-1] != "A" else "B"))
+
+    def test_entry_written_late_is_retried(self):
+        """A sequence number taken but not yet written when the flush ran is picked up next time"""
+        cache.add(unsubscribe.BUFFER.seq_key, 0, None)
+        late = cache.incr(unsubscribe.BUFFER.seq_key)  # request still in flight
+        unsubscribe.request_unsubscribe(self.recipients[1].pk)
+        self.assertEqual(unsubscribe.flush_pending(), 1)
+
+        cache.set(unsubscribe.BUFFER.entry_key(late), self.recipients[2].pk)
+        self.assertEqual(unsubscribe.flush_pending(), 1)
+        self.assertEqual(Recipient.objects.get(pk=self.recipients[2].pk).subscription_status, Recipient.UNSUBSCRIBED)
+
+@override_settings(CACHES=LOCMEM_CACHES, DOMAIN_THROTTLE_MAX_WAIT=0, SENDGRID_API_KEY="", SUPPRESSION_REFRESH_SECONDS=0,
+                   TRACKING_SECRET_KEY="test-tracking-key", UNSUBSCRIBE_SECRET_KEY="test-unsubscribe-key",
+                   SITE_URL="https://mail.example.com")
+class Test29_EngagementTracking(TestCase):
+    """
+    TEST #29: Verify links are rewritten through signed click redirects with
+    an open pixel, that the endpoints only buffer events, and that the flush
+    stores them with COPY and updates the campaign counters
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.factory = RequestFactory()
+        self.recipients = [Recipient.objects.create(email=f"user{i}@example.com") for i in range(2)]
+        self.campaign = Campaign.objects.create(name="Tracked", subject="S", content="C", status=Campaign.IN_PROGRESS)
+
+    def test_instrument(self):
+        """http(s) links become signed redirects, other links stay, the pixel goes before </body>"""
+        html = (
+            '<html><body><a href="https://shop.example.com/sale?a=1&amp;b=2">Sale</a> '
+            "<a class='x' href='http://example.org'>Home</a> <a href=\"mailto:help@example.com\">Help</a> "
+            '<a href="{{ unsubscribe_url }}">Unsubscribe</a></body></html>'
+        )
+        recipient = self.recipients[0]
+        rendered = render(html, recipient_values(recipient))
+        out = tracking.instrument(rendered, self.campaign.pk, recipient.pk)
+
+        targets = {}
+        for token, target in re.findall(r'https://mail\.example\.com/t/c/([^?"\']+)\?u=([^"\']+)', out):
+            url = unquote(target)
+            self.assertEqual(tracking.read_token(token, EngagementEvent.CLICK, url), (self.campaign.pk, recipient.pk))
+            self.assertIsNone(tracking.read_token(token, EngagementEvent.CLICK, "https://evil.example.com"))
+            targets[url] = token
+        self.assertEqual(set(targets), {"https://shop.example.com/sale?a=1&b=2", "http://example.org"})
+        self.assertIn('href="mailto:help@example.com"', out)
+        self.assertIn(f'href="{unsubscribe.unsubscribe_url(recipient.pk)}"', out)
+        self.assertRegex(out, r'<img src="https://mail\.example\.com/t/o/[^"]+\.gif"[^>]*></body></html>$')
+
+        with override_settings(TRACKING_SECRET_KEY=""):
+            self.assertEqual(tracking.instrument(rendered, self.campaign.pk, recipient.pk), rendered)
+        with override_settings(SITE_URL=""):
+            self.assertEqual(tracking.instrument(rendered, self.campaign.pk, recipient.pk), rendered)
+
+    @patch('campaigns.providers.send_via_smtp', return_value=(250, b"OK"))
+    def test_sent_emails_are_instrumented(self, mock_smtp):
+        """send_batch hands the provider the tracked content"""
+        self.campaign.content = '<a href="https://example.com">Go</a>'
+        self.campaign.save()
+        send_batch(self.campaign.pk, [self.recipients[0].pk])
+        html = mock_smtp.call_args.args[1]
+        self.assertIn("https://mail.example.com/t/c/", html)
+        self.assertIn("https://mail.example.com/t/o/", html)
+
+    def test_endpoints_only_buffer(self):
+        """Pixel and redirect answer without database queries; forged links record nothing"""
+        open_token = tracking.make_token(EngagementEvent.OPEN, self.campaign.pk, self.recipients[0].pk)
+        url = "https://example.com/offer"
+        click_token = tracking.make_token(EngagementEvent.CLICK, self.campaign.pk, self.recipients[0].pk, url)
+        with self.assertNumQueries(0):
+            response = open_pixel_view(self.factory.get("/t/o/x.gif"), open_token)
+            self.assertEqual((response["Content-Type"], len(response.content)), ("image/gif", 43))
+            response = click_view(self.factory.get("/t/c/x", {"u": url}), click_token)
+            self.assertEqual((response.status_code, response["Location"]), (302, url))
+
+            # a bad pixel token still gets the image, a bad click is not redirected anywhere
+            self.assertEqual(open_pixel_view(self.factory.get("/t/o/x.gif"), open_token + "x").status_code, 200)
+            with self.assertRaises(Http404):
+                click_view(self.factory.get("/t/c/x", {"u": "https://evil.example.com"}), click_token)
+        self.assertEqual(cache.get(tracking.BUFFER.seq_key), 2)
+
+    def test_token_kinds_are_not_interchangeable(self):
+        """A pixel token is no click (with or without a target) and a click token is no open"""
+        open_token = tracking.make_token(EngagementEvent.OPEN, self.campaign.pk, self.recipients[0].pk)
+        click_token = tracking.make_token(EngagementEvent.CLICK, self.campaign.pk, self.recipients[0].pk, "")
+        self.assertIsNone(tracking.read_token(open_token, EngagementEvent.CLICK))
+        self.assertIsNone(tracking.read_token(click_token, EngagementEvent.OPEN))
+        for token in (open_token, click_token):
+            with self.assertRaises(Http404):
+                click_view(self.factory.get(f"/t/c/{token}"), token)
+            with self.assertRaises(Http404):
+                click_view(self.factory.get(f"/t/c/{token}", {"u": ""}), token)
+        open_pixel_view(self.factory.get("/t/o/x.gif"), click_token)
+        self.assertIsNone(cache.get(tracking.BUFFER.seq_key))
+
+    def test_flush_stores_events_and_counters(self):
+        """Buffered events are COPYed into the events table and summed per campaign, uniques once"""
+        other = Campaign.objects.create(name="Deleted", subject="S", content="C")
+        first, second = (r.pk for r in self.recipients)
+        tracking.record(EngagementEvent.OPEN, self.campaign.pk, first)
+        tracking.record(EngagementEvent.OPEN, self.campaign.pk, first)
+        tracking.record(EngagementEvent.OPEN, self.campaign.pk, second)
+        tracking.record(EngagementEvent.CLICK, self.campaign.pk, first, url="https://example.com/a")
+        tracking.record(EngagementEvent.OPEN, other.pk, first)
+        other.delete()
+
+        with query_budget(2):  # campaign check + counter UPDATE (COPY is not an execute)
+            self.assertEqual(flush_engagement_events(), {"stored": 4})
+        self.campaign.refresh_from_db()
+        self.assertEqual(
+            (self.campaign.open_count, self.campaign.unique_open_count, self.campaign.click_count, self.campaign.unique_click_count),
+            (3, 2, 1, 1),
+        )
+        self.assertEqual(EngagementEvent.objects.filter(campaign=self.campaign, kind="open").count(), 3)
+        click = EngagementEvent.objects.get(kind="click")
+        self.assertEqual((click.recipient_id, click.url), (first, "https://example.com/a"))
+        self.assertEqual(flush_engagement_events(), {"stored": 0})
+
+    def test_failed_flush_keeps_the_buffer(self):
+        """If storing fails, the events stay buffered for the next flush"""
+        tracking.record(EngagementEvent.OPEN, self.campaign.pk, self.recipients[0].pk)
+        with patch('campaigns.tracking._write', side_effect=RuntimeError("db down")), self.assertRaises(RuntimeError):
+            tracking.flush_events()
+        self.assertEqual(tracking.flush_events(), 1)
+        self.assertEqual(Campaign.objects.get(pk=self.campaign.pk).open_count, 1)
+
 # ============================================================================
 # HOW TO RUN TESTS
 # ============================================================================
@@ -0,0 +1,90 @@
+"""
+Per-recipient-domain send throttling.
+
+Large receivers (gmail.com, outlook.com, ...) defer mail when one sending IP
+opens too many connections or sends too fast to their domain. Caps are shared
+by every sender worker through the cache (Redis in production):
+
+- rate: sends per second to the domain (fixed one-second window)
+- concurrency: sends to the domain in progress at the same moment
+
+Domains without an entry in settings.DOMAIN_THROTTLE_LIMITS are not throttled
+and never touch the cache.
+"""
+import time
+import logging
+
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = "throttle"
+# a crashed worker must not hold a concurrency slot forever
+SLOT_TTL = 60
+POLL_INTERVAL = 0.05
+
+
+def get_domain_limits(domain: str):
+    return getattr(settings, "DOMAIN_THROTTLE_LIMITS", {}).get(domain)
+
+
+class DomainThrottle:
+    """
+    Acquire/release per-domain send slots.
+    `acquire` waits up to `max_wait` seconds for a slot and returns False if the
+    domain stays over its caps, so the caller can defer those recipients.
+    """
+
+    def __init__(self, max_wait: float = None):
+        self.max_wait = getattr(settings, "DOMAIN_THROTTLE_MAX_WAIT", 0.5) if max_wait is None else max_wait
+        self.waited = 0.0  # total seconds spent waiting for slots
+
+    def acquire(self, domain: str) -> bool:
+        limits = get_domain_limits(domain)
+        if not limits:
+            return True
+
+        deadline = time.monotonic() + self.max_wait
+        started = time.monotonic()
+        try:
+            while True:
+                if self._try_acquire(domain, limits):
+                    return True
+                if time.monotonic() >= deadline:
+                    return False
+                time.sleep(POLL_INTERVAL)
+        finally:
+            self.waited += time.monotonic() - started
+
+    def release(self, domain: str):
+        limits = get_domain_limits(domain)
+        if not limits or not limits.get("concurrency"):
+            return
+        key = f"{KEY_PREFIX}:conc:{domain}"
+        try:
+            if cache.decr(key) < 0:
+                cache.set(key, 0, SLOT_TTL)
+        except ValueError:
+            # slot key expired while we were sending
+            pass
+
+    def _try_acquire(self, domain: str, limits: dict) -> bool:
+        concurrency = limits.get("concurrency")
+        if concurrency:
+            key = f"{KEY_PREFIX}:conc:{domain}"
+            cache.add(key, 0, SLOT_TTL)
+            if cache.incr(key) > concurrency:
+                cache.decr(key)
+                return False
+            cache.touch(key, SLOT_TTL)
+
+        rate = limits.get("rate")
+        if rate:
+            key = f"{KEY_PREFIX}:rate:{domain}:{int(time.time())}"
+            cache.add(key, 0, 2)
+            if cache.incr(key) > rate:
+                if concurrency:
+                    self.release(domain)
+                return False
+        return True
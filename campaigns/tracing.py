@@ -0,0 +1,217 @@
+"""
+Distributed tracing of the campaign lifecycle (optional OpenTelemetry).
+
+With TRACING_EXPORTER = "otlp" or "file" and opentelemetry-sdk installed,
+every Celery task execution becomes a span, and the trace context travels
+in the task message headers, so a task's span is a child of the span that
+enqueued it. Inside a task, SQL statements, provider calls and delivery
+log flushes get spans of their own.
+
+Batches are enqueued by the dispatcher's beat tick, not by the campaign's
+own tasks. start_campaign_send therefore stores its span context in the
+cache, and the dispatcher enqueues each campaign's batches under it. One
+campaign then shows up as one trace tree:
+
+    check_scheduled_campaigns > start_campaign_send > send_batch (xN) > db / provider / flush
+                                                    > finalize_campaign > ...
+
+Without the SDK, or with TRACING_EXPORTER = "none", every hook is a no-op.
+"""
+import logging
+from contextlib import ExitStack, contextmanager
+
+from celery.concurrency import get_implementation
+from celery.concurrency.prefork import TaskPool as PreforkPool
+from celery.signals import (
+    before_task_publish, task_failure, task_postrun, task_prerun, worker_init, worker_process_init,
+)
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+
+try:
+    from opentelemetry import context as otel_context, propagate, trace
+    from opentelemetry.trace import SpanKind, Status, StatusCode
+    OTEL_AVAILABLE = True
+except ImportError:
+    OTEL_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+CAMPAIGN_TRACE_TTL = 7 * 24 * 3600
+STATEMENT_MAX_CHARS = 2000
+
+_provider = None
+_tracer = None
+
+
+def configure(exporter=None) -> bool:
+    """Set up the span pipeline (per worker process). Returns whether tracing is on."""
+    global _provider, _tracer
+    name = settings.TRACING_EXPORTER
+    if exporter is None and name == "none":
+        return False
+    if not OTEL_AVAILABLE:
+        logger.warning(f"TRACING_EXPORTER={name} but opentelemetry-sdk is not installed; tracing is off")
+        return False
+
+    from opentelemetry.sdk.resources import Resource
+    from opentelemetry.sdk.trace import TracerProvider
+    from opentelemetry.sdk.trace.export import BatchSpanProcessor, ConsoleSpanExporter, SimpleSpanProcessor
+
+    if exporter is not None:
+        processor = SimpleSpanProcessor(exporter)
+    elif name == "otlp":
+        # endpoint from OTEL_EXPORTER_OTLP_ENDPOINT (default http://localhost:4318)
+        from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+        processor = BatchSpanProcessor(OTLPSpanExporter())
+    elif name == "file":
+        out = open(settings.TRACING_FILE, "a", buffering=1)
+        processor = BatchSpanProcessor(
+            ConsoleSpanExporter(out=out, formatter=lambda span: span.to_json(indent=None) + "\n")
+        )
+    else:
+        raise ValueError(f"Unknown TRACING_EXPORTER: {name}")
+
+    _provider = TracerProvider(resource=Resource.create({"service.name": settings.TRACING_SERVICE_NAME}))
+    _provider.add_span_processor(processor)
+    _tracer = _provider.get_tracer("campaigns")
+    return True
+
+
+def shutdown():
+    """Flush and turn tracing off."""
+    global _provider, _tracer
+    if _provider is not None:
+        _provider.shutdown()
+    _provider = _tracer = None
+
+
+def enabled() -> bool:
+    return _tracer is not None
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """Child span of the current one (no-op when tracing is off)."""
+    if _tracer is None:
+        yield None
+        return
+    with _tracer.start_as_current_span(
+        name, attributes={key: value for key, value in attributes.items() if value is not None}
+    ) as current:
+        yield current
+
+
+# -------------------------
+# one trace per campaign
+# -------------------------
+def _campaign_key(campaign_id):
+    return f"campaign-trace:{campaign_id}"
+
+
+def remember_campaign_trace(campaign_id: int):
+    """Store the current span context as the parent of the campaign's batches."""
+    if _tracer is None:
+        return
+    carrier = {}
+    propagate.inject(carrier)
+    cache.set(_campaign_key(campaign_id), carrier, CAMPAIGN_TRACE_TTL)
+
+
+def campaign_trace(campaign_id: int):
+    """Stored trace carrier of a campaign (None when tracing is off or nothing was stored)."""
+    if _tracer is None:
+        return None
+    return cache.get(_campaign_key(campaign_id))
+
+
+@contextmanager
+def under(carrier):
+    """Make `carrier` (see campaign_trace) the current context, e.g. while enqueuing."""
+    if _tracer is None or not carrier:
+        yield
+        return
+    token = otel_context.attach(propagate.extract(carrier))
+    try:
+        yield
+    finally:
+        otel_context.detach(token)
+
+
+# -------------------------
+# SQL statements as spans
+# -------------------------
+def _traced_execute(execute, sql, params, many, context):
+    with _tracer.start_as_current_span(
+        "db.query", kind=SpanKind.CLIENT,
+        attributes={"db.system": "postgresql", "db.statement": sql[:STATEMENT_MAX_CHARS]},
+    ):
+        return execute(sql, params, many, context)
+
+
+# -------------------------
+# Celery: propagate and span every task
+# -------------------------
+_running = {}  # task_id -> (ExitStack, span)
+
+
+@worker_process_init.connect
+def _configure_worker(**kwargs):
+    # after the fork: span processors run a thread that must live in the child
+    configure()
+
+
+@worker_init.connect
+def _configure_unforked_worker(sender=None, **kwargs):
+    # solo / threads / gevent pools run tasks in this process and never fork,
+    # so worker_process_init does not fire for them
+    if sender is not None and not issubclass(get_implementation(sender.pool_cls), PreforkPool):
+        configure()
+
+
+@before_task_publish.connect
+def _inject_headers(headers=None, **kwargs):
+    if _tracer is not None and headers is not None:
+        propagate.inject(headers)
+
+
+@task_prerun.connect
+def _start_task_span(task_id=None, task=None, args=None, **kwargs):
+    if _tracer is None:
+        return
+    request = task.request
+    carrier = {**vars(request), **(getattr(request, "headers", None) or {})}
+    current = _tracer.start_span(
+        f"celery.task {task.name}",
+        context=propagate.extract(carrier),
+        kind=SpanKind.CONSUMER,
+        attributes={"celery.task_id": task_id, "celery.task_name": task.name},
+    )
+    if args and isinstance(args[0], int):
+        current.set_attribute("celery.arg0", args[0])  # campaign / job id
+    stack = ExitStack()
+    token = otel_context.attach(trace.set_span_in_context(current))
+    stack.callback(otel_context.detach, token)
+    for connection in connections.all():
+        stack.enter_context(connection.execute_wrapper(_traced_execute))
+    _running[task_id] = (stack, current)
+
+
+@task_failure.connect
+def _mark_task_failed(task_id=None, exception=None, **kwargs):
+    entry = _running.get(task_id)
+    if entry is not None:
+        entry[1].record_exception(exception)
+        entry[1].set_status(Status(StatusCode.ERROR, str(exception)))
+
+
+@task_postrun.connect
+def _end_task_span(task_id=None, state=None, **kwargs):
+    entry = _running.pop(task_id, None)
+    if entry is None:
+        return
+    stack, current = entry
+    stack.close()
+    current.set_attribute("celery.state", state or "")
+    current.end()
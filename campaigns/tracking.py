@@ -0,0 +1,161 @@
+"""
+Open and click tracking.
+
+At send time, instrument() rewrites every http(s) link of the rendered
+content to SITE_URL/t/c/<token>?u=<url> and adds a 1x1 pixel
+SITE_URL/t/o/<token>.gif. The token is campaign id + recipient id signed
+with HMAC-SHA256 (TRACKING_SECRET_KEY) together with the event kind, so a
+pixel token is never accepted as a click; a click token also signs the
+target URL, so the redirect cannot be abused as an open redirect.
+
+Right after a large send, opens and clicks arrive in bursts. The endpoints
+only check the signature and append the event to a buffer in the cache
+(buffer.CacheBuffer), with no database access. flush_engagement_events
+(beat, every TRACKING_FLUSH_SECONDS) drains the buffer, COPYs the events
+into campaigns_engagementevent and adds them to the campaign's
+open/click counters in a single UPDATE. Uniqueness (first open / click of a
+recipient) is settled at ingestion with one cache.add per event.
+
+Tracking is opt-in: nothing is rewritten unless both TRACKING_SECRET_KEY
+(no default) and SITE_URL are set.
+"""
+import io
+import re
+import csv
+import time
+import logging
+from collections import defaultdict
+from datetime import datetime, timezone as dt_timezone
+from html import escape, unescape
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.utils.http import base36_to_int, int_to_base36
+
+from . import signing
+from .buffer import CacheBuffer
+from .models import Campaign, EngagementEvent
+
+logger = logging.getLogger(__name__)
+
+KEY_SALT = "campaigns.tracking"
+UNIQUE_TTL = 30 * 24 * 3600
+FLUSH_MAX_EVENTS = 50000
+BUFFER = CacheBuffer("tracking")
+
+HREF = re.compile(r"""(<a\b[^>]*?\bhref\s*=\s*)(["'])(https?://[^"']+)\2""", re.IGNORECASE)
+BODY_END = re.compile(r"</body\s*>", re.IGNORECASE)
+# 1x1 transparent GIF
+PIXEL = (
+    b"GIF89a\x01\x00\x01\x00\x80\x00\x00\x00\x00\x00\xff\xff\xff!\xf9\x04\x01\x00\x00\x00\x00"
+    b",\x00\x00\x00\x00\x01\x00\x01\x00\x00\x02\x02D\x01\x00;"
+)
+
+
+# -------------------------
+# tokens and rewriting
+# -------------------------
+def enabled() -> bool:
+    return bool(settings.TRACKING_SECRET_KEY and settings.SITE_URL)
+
+
+def make_token(kind: str, campaign_id: int, recipient_id: int, url: str = "") -> str:
+    value = f"{int_to_base36(campaign_id)}.{int_to_base36(recipient_id)}"
+    return f"{value}.{signing.signature(f'{kind}.{value}.{url}', KEY_SALT, settings.TRACKING_SECRET_KEY)}"
+
+
+def read_token(token: str, kind: str, url: str = ""):
+    """(campaign_id, recipient_id) of a valid `kind` token for `url`, None otherwise."""
+    value, _, signature = token.rpartition(".")
+    if not value or not signing.verify(f"{kind}.{value}.{url}", signature, KEY_SALT, settings.TRACKING_SECRET_KEY):
+        return None
+    try:
+        campaign, recipient = value.split(".")
+        return base36_to_int(campaign), base36_to_int(recipient)
+    except ValueError:
+        return None
+
+
+def instrument(html: str, campaign_id: int, recipient_id: int) -> str:
+    """Route the content's links through the click redirect and add the open pixel."""
+    if not enabled() or not html:
+        return html
+    site = settings.SITE_URL.rstrip("/")
+    skip = f"{site}/unsubscribe/"
+
+    def rewrite(match):
+        url = unescape(match.group(3))
+        if url.startswith(skip):
+            return match.group(0)
+        tracked = f"{site}/t/c/{make_token(EngagementEvent.CLICK, campaign_id, recipient_id, url)}?u={quote(url, safe='')}"
+        return f"{match.group(1)}{match.group(2)}{escape(tracked)}{match.group(2)}"
+
+    html = HREF.sub(rewrite, html)
+    pixel = (
+        f'<img src="{site}/t/o/{make_token(EngagementEvent.OPEN, campaign_id, recipient_id)}.gif" '
+        f'width="1" height="1" alt="" style="display:none">'
+    )
+    ends = list(BODY_END.finditer(html))
+    if ends:
+        at = ends[-1].start()
+        return html[:at] + pixel + html[at:]
+    return html + pixel
+
+
+# -------------------------
+# ingestion (web) and flush (beat)
+# -------------------------
+def record(kind: str, campaign_id: int, recipient_id: int, url: str = ""):
+    """Buffer one event; no database access."""
+    first = cache.add(f"tracking:{kind}:{campaign_id}:{recipient_id}", 1, UNIQUE_TTL)
+    BUFFER.append((kind, campaign_id, recipient_id, url, time.time(), first))
+
+
+def _write(events) -> int:
+    existing = set(Campaign.objects.filter(pk__in={e[1] for e in events}).values_list("pk", flat=True))
+    events = [e for e in events if e[1] in existing]  # campaign deleted since the send
+    if not events:
+        return 0
+
+    rows = io.StringIO()
+    writer = csv.writer(rows)
+    totals = defaultdict(lambda: [0, 0, 0, 0])  # opens, unique opens, clicks, unique clicks
+    for kind, campaign_id, recipient_id, url, occurred, first in events:
+        writer.writerow([campaign_id, recipient_id, kind, url, datetime.fromtimestamp(occurred, dt_timezone.utc).isoformat()])
+        column = 0 if kind == EngagementEvent.OPEN else 2
+        totals[campaign_id][column] += 1
+        totals[campaign_id][column + 1] += int(first)
+    rows.seek(0)
+
+    values = ", ".join(["(%s, %s, %s, %s, %s)"] * len(totals))
+    params = [value for campaign_id, counts in totals.items() for value in (campaign_id, *counts)]
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.copy_expert(
+            # an empty CSV field is NULL unless forced: opens have no url
+            f"COPY {EngagementEvent._meta.db_table}(campaign_id, recipient_id, kind, url, occurred_at) "
+            f"FROM STDIN WITH (FORMAT csv, FORCE_NOT_NULL (url))",
+            rows,
+        )
+        cursor.execute(
+            f"""
+            UPDATE {Campaign._meta.db_table} c SET
+                open_count = c.open_count + v.opens,
+                unique_open_count = c.unique_open_count + v.unique_opens,
+                click_count = c.click_count + v.clicks,
+                unique_click_count = c.unique_click_count + v.unique_clicks
+            FROM (VALUES {values}) AS v(id, opens, unique_opens, clicks, unique_clicks)
+            WHERE c.id = v.id
+            """,
+            params,
+        )
+    logger.info(f"Stored {len(events)} engagement events for {len(totals)} campaigns")
+    return len(events)
+
+
+def flush_events(limit: int = FLUSH_MAX_EVENTS) -> int:
+    """Write up to `limit` buffered events; returns events stored."""
+    stored = []
+    BUFFER.drain(lambda events: stored.append(_write(events)), limit)
+    return sum(stored)
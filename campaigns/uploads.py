@@ -0,0 +1,182 @@
+"""
+Resumable chunked uploads for large recipient files.
+
+Loosely follows the tus protocol:
+
+- the client declares the file name and size; an ImportJob with an empty
+  file is created and `upload_offset` tracks how many bytes have arrived
+- each chunk is sent with `Upload-Offset` (must equal the current offset,
+  so a client that lost a response re-syncs from the server's offset) and
+  `Upload-Checksum: sha256 <base64 digest>`; verified chunks are written
+  in place, so a dropped connection resumes from the last good chunk
+- CSV imports start right away and read the file through TailingReader,
+  which waits for more bytes until the declared size has arrived, so
+  parsing and COPY overlap with the transfer. Excel files can only be
+  read once complete (zip directory at the end) and are queued then.
+- the streaming import runs in one database transaction, held open while
+  it waits for chunks. It gives up after CHUNKED_UPLOAD_STALL_SECONDS
+  without new data, or once the transfer has taken
+  CHUNKED_UPLOAD_STREAM_MAX_SECONDS; the rollback keeps nothing and the
+  job is FAILED. The client can still resume the upload, and when the last
+  chunk arrives the job is reset to PENDING and imports the complete file.
+"""
+import io
+import os
+import time
+import base64
+import hashlib
+import logging
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import transaction
+
+from .metrics import UPLOAD_BYTES
+from .models import ImportJob
+from .utils import is_excel_file
+
+logger = logging.getLogger(__name__)
+
+POLL_INTERVAL = 0.2
+
+
+class ChunkRejected(Exception):
+    """A chunk that was not written; `status` is the HTTP status to answer with."""
+
+    def __init__(self, status, message, offset=None):
+        super().__init__(message)
+        self.status = status
+        self.offset = offset
+
+
+class UploadStalled(Exception):
+    pass
+
+
+def start_chunked_upload(name: str, size: int, user=None, update_fields=()) -> ImportJob:
+    if size <= 0:
+        raise ChunkRejected(400, "Upload-Length must be positive")
+    job = ImportJob(original_name=name, upload_size=size, created_by=user, update_fields=list(update_fields))
+    job.file.save(os.path.basename(name), ContentFile(b""), save=False)
+    job.save()
+    if not is_excel_file(name):
+        _queue_import(job)
+    return job
+
+
+def parse_checksum(header: str) -> bytes:
+    algorithm, _, value = (header or "").strip().partition(" ")
+    if algorithm.lower() != "sha256" or not value:
+        raise ChunkRejected(400, "Upload-Checksum must be 'sha256 <base64 digest>'")
+    try:
+        return base64.b64decode(value, validate=True)
+    except ValueError:
+        raise ChunkRejected(400, "Upload-Checksum digest is not valid base64")
+
+
+def append_chunk(job_id: int, offset: int, data: bytes, checksum: str) -> ImportJob:
+    """Verify one chunk and write it at `offset`. Returns the updated job."""
+    max_chunk = 2 * settings.CHUNKED_UPLOAD_CHUNK_BYTES
+    if len(data) > max_chunk:
+        raise ChunkRejected(413, f"Chunks are limited to {max_chunk} bytes")
+    expected = parse_checksum(checksum)
+
+    with transaction.atomic():
+        # row lock: chunks of one upload are written strictly in order
+        job = ImportJob.objects.select_for_update().get(pk=job_id)
+        if job.upload_size is None:
+            raise ChunkRejected(400, "Not a chunked upload")
+        if offset != job.upload_offset:
+            raise ChunkRejected(409, "Upload-Offset does not match the server offset", job.upload_offset)
+        if offset + len(data) > job.upload_size:
+            raise ChunkRejected(413, "Chunk goes past the declared Upload-Length", job.upload_offset)
+        if hashlib.sha256(data).digest() != expected:
+            raise ChunkRejected(460, "Checksum mismatch", job.upload_offset)
+
+        with open(job.file.path, "r+b") as fh:
+            fh.seek(offset)
+            fh.write(data)
+            fh.flush()
+            os.fsync(fh.fileno())
+
+        job.upload_offset = offset + len(data)
+        job.save(update_fields=["upload_offset"])
+        UPLOAD_BYTES.inc(len(data))
+        if job.upload_complete:
+            if is_excel_file(job.original_name):
+                _queue_import(job)
+            else:
+                restart_failed_import(job)
+    return job
+
+
+def _queue_import(job):
+    from .tasks import run_import_job
+    transaction.on_commit(lambda: run_import_job.delay(job.pk))
+
+
+def restart_failed_import(job) -> bool:
+    """
+    Queue a complete upload again whose streaming import gave up before the
+    last chunk arrived. Call with the job row locked (append_chunk and
+    run_import_job both lock it), so exactly one of them sees the job both
+    FAILED and complete.
+    """
+    if job.status != ImportJob.FAILED or not job.upload_complete:
+        return False
+    job.status, job.phase, job.rows_processed, job.error = ImportJob.PENDING, ImportJob.QUEUED, 0, ""
+    job.started_at = job.finished_at = None
+    job.save(update_fields=["status", "phase", "rows_processed", "error", "started_at", "finished_at"])
+    logger.info(f"Import job {job.pk} ({job.original_name}): upload resumed and complete, importing again")
+    _queue_import(job)
+    return True
+
+
+class TailingReader(io.RawIOBase):
+    """
+    Raw stream over a file that is still being written by append_chunk.
+    Reads block (polling) until bytes arrive and hit EOF once `size` bytes
+    were read. Raises UploadStalled if nothing new arrives for
+    `stall_timeout` seconds, or if it still has to wait after `max_seconds`.
+    """
+
+    def __init__(self, path, size, name=None, stall_timeout=None, max_seconds=None):
+        self._fh = open(path, "rb")
+        self.size = size
+        self.pos = 0
+        self.name = name or path
+        self.stall_timeout = settings.CHUNKED_UPLOAD_STALL_SECONDS if stall_timeout is None else stall_timeout
+        self.max_seconds = settings.CHUNKED_UPLOAD_STREAM_MAX_SECONDS if max_seconds is None else max_seconds
+        self.opened_at = time.monotonic()
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        want = min(len(b), self.size - self.pos)
+        if want <= 0:
+            return 0
+        waited_since = time.monotonic()
+        while True:
+            n = self._fh.readinto(memoryview(b)[:want])
+            if n:
+                self.pos += n
+                return n
+            now = time.monotonic()
+            if now - waited_since > self.stall_timeout:
+                raise UploadStalled(f"No upload data for {self.stall_timeout}s at byte {self.pos} of {self.size}")
+            if now - self.opened_at > self.max_seconds:
+                raise UploadStalled(
+                    f"Upload still arriving after {self.max_seconds}s at byte {self.pos} of {self.size}; "
+                    f"it is imported once complete"
+                )
+            time.sleep(POLL_INTERVAL)
+
+    def close(self):
+        self._fh.close()
+        super().close()
+
+
+def open_tailing(job: ImportJob, stall_timeout=None, max_seconds=None):
+    """Buffered binary reader over a chunked upload that may still be arriving."""
+    return io.BufferedReader(TailingReader(job.file.path, job.upload_size, job.file.name, stall_timeout, max_seconds))
@@ -1,10 +1,20 @@
 import re
-import pandas as pd
+
+# upload columns with a meaning of their own; any other column is a custom attribute
+RESERVED_COLUMNS = {"name", "email", "subscription_status", "attributes"}
 
 EMAIL_REGEX = re.compile(r"^[a-zA-Z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Za-z]{2,}$")
 
 def is_valid_email(email: str) -> bool:
     return bool(EMAIL_REGEX.match(email.strip().lower()))
 
+def email_domain(email: str) -> str:
+    """Domain part of an already normalized email ("" if there is none)."""
+    return email.rpartition("@")[2] if "@" in email else ""
+
 def is_excel_file(filename: str) -> bool:
     return filename.lower().endswith((".xlsx", ".xls"))
+
+def attribute_columns(columns) -> list:
+    """Upload columns that are stored as Recipient.attributes keys."""
+    return [c for c in columns if str(c).strip() and str(c).strip().lower() not in RESERVED_COLUMNS]
@@ -1,3 +1,162 @@
+import json
+import time
+import ipaddress
+import threading
+
+from django.conf import settings
+from django.http import (
+    Http404, HttpResponse, HttpResponseForbidden, HttpResponseRedirect, JsonResponse, StreamingHttpResponse,
+)
 from django.shortcuts import render
+from django.utils.crypto import constant_time_compare
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_http_methods
+from prometheus_client import CONTENT_TYPE_LATEST
+
+from . import progress, tracking, unsubscribe
+from .models import EngagementEvent
+from .metrics import render_latest
+
+
+def metrics_allowed(request) -> bool:
+    """The scraper sent the bearer token, or connects from METRICS_ALLOWED_NETWORKS."""
+    token = settings.METRICS_BEARER_TOKEN
+    if token and constant_time_compare(request.headers.get("Authorization", ""), f"Bearer {token}"):
+        return True
+    try:
+        client = ipaddress.ip_address(request.META.get("REMOTE_ADDR", ""))
+    except ValueError:
+        return False
+    return any(client in ipaddress.ip_network(network, strict=False) for network in settings.METRICS_ALLOWED_NETWORKS)
+
+
+def metrics_view(request):
+    """Prometheus scrape endpoint of the web process (see campaigns.metrics)."""
+    if not metrics_allowed(request):
+        return HttpResponseForbidden("Forbidden")
+    return HttpResponse(render_latest(), content_type=CONTENT_TYPE_LATEST)
+
+
+def progress_allowed(request, campaign_id) -> bool:
+    """A valid ?token= for the campaign (no database access), or a staff session."""
+    if progress.valid_token(campaign_id, request.GET.get("token")):
+        return True
+    user = getattr(request, "user", None)
+    return bool(user and user.is_active and user.is_staff)
+
+
+def campaign_progress_view(request, campaign_id):
+    """Live progress of one campaign as JSON, read from the cache only (see campaigns.progress)."""
+    if not progress_allowed(request, campaign_id):
+        return JsonResponse({"error": "forbidden"}, status=403)
+    snapshot = progress.snapshot(campaign_id)
+    if snapshot is None:
+        return JsonResponse({"error": "no progress recorded for this campaign"}, status=404)
+    return JsonResponse(snapshot)
+
+
+def progress_events(campaign_id, interval: float, duration: float):
+    """
+    Server-Sent Events: a `progress` event whenever the snapshot changes, a
+    comment line as keep-alive otherwise. The stream ends after the campaign
+    completes or after `duration` seconds; EventSource then reconnects.
+    """
+    yield f"retry: {int(interval * 1000)}\n\n"
+    deadline = time.monotonic() + duration
+    last = None
+    while True:
+        snapshot = progress.snapshot(campaign_id)
+        if snapshot != last:
+            yield f"event: progress\ndata: {json.dumps(snapshot)}\n\n"
+            last = snapshot
+        else:
+            yield ": keep-alive\n\n"
+        if snapshot is None or snapshot["status"] != "in_progress" or time.monotonic() >= deadline:
+            return
+        time.sleep(interval)
+
+
+class StreamSlot:
+    """Iterates the events; frees its slot when the response is closed, even before the first event."""
+
+    def __init__(self, events, slot):
+        self.events, self.slot, self.closed = events, slot, False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self.events)
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.events.close()
+            self.slot.release()
+
+
+_stream_slots = None
+
+
+def stream_slots():
+    """Per-process cap on open streams (PROGRESS_STREAM_MAX_PER_PROCESS): each one holds a web thread."""
+    global _stream_slots
+    if _stream_slots is None:
+        _stream_slots = threading.BoundedSemaphore(settings.PROGRESS_STREAM_MAX_PER_PROCESS)
+    return _stream_slots
+
+
+def campaign_progress_stream(request, campaign_id):
+    """The campaign's progress as an SSE stream (text/event-stream)."""
+    if not progress_allowed(request, campaign_id):
+        return HttpResponseForbidden("Forbidden")
+    slot = stream_slots()
+    if not slot.acquire(blocking=False):
+        response = HttpResponse("Too many progress streams", status=503)
+        response["Retry-After"] = str(int(settings.PROGRESS_STREAM_SECONDS))
+        return response
+    response = StreamingHttpResponse(
+        StreamSlot(progress_events(campaign_id, settings.PROGRESS_STREAM_INTERVAL, settings.PROGRESS_STREAM_SECONDS), slot),
+        content_type="text/event-stream",
+    )
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"  # nginx: pass events through unbuffered
+    return response
+
+
+@csrf_exempt  # RFC 8058: mailbox providers POST without cookies or tokens
+@require_http_methods(["GET", "POST"])
+def unsubscribe_view(request, token):
+    """
+    One-click unsubscribe. GET shows a confirmation button (link scanners
+    prefetch GETs, so they must not unsubscribe); POST, from that button or
+    from a List-Unsubscribe-Post capable mailbox, queues the unsubscribe.
+    Neither reads the database (see campaigns.unsubscribe).
+    """
+    recipient_id = unsubscribe.read_token(token)
+    if recipient_id is None:
+        raise Http404("Invalid unsubscribe link")
+    if request.method == "POST":
+        unsubscribe.request_unsubscribe(recipient_id)
+        return render(request, "campaigns/unsubscribe.html", {"done": True})
+    return render(request, "campaigns/unsubscribe.html", {"done": False})
+
+
+def open_pixel_view(request, token):
+    """Tracking pixel: buffers an open (see campaigns.tracking); always answers with the GIF."""
+    ids = tracking.read_token(token, EngagementEvent.OPEN)
+    if ids is not None:
+        tracking.record(EngagementEvent.OPEN, *ids)
+    response = HttpResponse(tracking.PIXEL, content_type="image/gif")
+    response["Cache-Control"] = "no-store, private"
+    return response
+
 
-# Create your views here.
+def click_view(request, token):
+    """Click redirect: buffers a click and redirects to the signed target URL."""
+    url = request.GET.get("u", "")
+    ids = tracking.read_token(token, EngagementEvent.CLICK, url) if url else None
+    if ids is None:
+        raise Http404("Invalid link")
+    tracking.record(EngagementEvent.CLICK, *ids, url=url)
+    return HttpResponseRedirect(url)
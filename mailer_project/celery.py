@@ -1,5 +1,6 @@
 import os
 from celery import Celery
+from celery.worker.control import control_command, ok
 
 from mailer_project.settings import TIME_ZONE
 
@@ -12,6 +13,19 @@ app.autodiscover_tasks()  # autodiscover tasks in installed apps
 app.conf.timezone = TIME_ZONE
 app.conf.enable_utc = False  # Use local timezone (IST), not UTC
 
+
+# Remote control commands are looked up in the process that sends them too, and
+# `celery control` only imports this module, so they are registered here
+@control_command(
+    args=[("target", str), ("seconds", int)],
+    signature="<task name | campaign:<id>> [seconds (0 = stop)]",
+)
+def profile(state, target, seconds=300, **kwargs):
+    """Profile a task name or a campaign's tasks for a while (see campaigns.profiling)."""
+    from campaigns.profiling import request_profile
+    targets = request_profile(target, seconds)
+    return ok(f"profiling {sorted(targets) or 'nothing'}")
+
 # Schedule periodic task to check for scheduled campaigns every minute
 app.conf.beat_schedule = {
     "check-scheduled-campaigns-every-minute": {
@@ -20,5 +34,45 @@ app.conf.beat_schedule = {
         "options": {
             "expires": 50.0,  # Task expires after 50 seconds (prevents queue buildup)
         }
+    },
+    # Drip batches of active campaigns into the per-priority sender queues
+    "dispatch-campaign-batches": {
+        "task": "campaigns.tasks.dispatch_campaign_batches",
+        "schedule": float(os.getenv("SCHEDULER_TICK_SECONDS", 5)),
+        "options": {
+            "expires": 4.0,
+        }
+    },
+    # Top up segment membership from recently changed recipients
+    "refresh-segments": {
+        "task": "campaigns.tasks.refresh_segments",
+        "schedule": float(os.getenv("SEGMENT_REFRESH_SECONDS", 60)),
+        "options": {
+            "expires": 50.0,
+        }
+    },
+    # Apply buffered one-click unsubscribes with bulk UPDATEs
+    "flush-unsubscribes": {
+        "task": "campaigns.tasks.flush_unsubscribes",
+        "schedule": float(os.getenv("UNSUBSCRIBE_FLUSH_SECONDS", 5)),
+        "options": {
+            "expires": 4.0,
+        }
+    },
+    # Store buffered open/click events (COPY) and update campaign counters
+    "flush-engagement-events": {
+        "task": "campaigns.tasks.flush_engagement_events",
+        "schedule": float(os.getenv("TRACKING_FLUSH_SECONDS", 5)),
+        "options": {
+            "expires": 4.0,
+        }
+    },
+    # Drop staging tables of recipient imports that crashed mid-way
+    "cleanup-import-staging-tables": {
+        "task": "campaigns.tasks.cleanup_import_staging_tables",
+        "schedule": 3600.0,
+        "options": {
+            "expires": 600.0,
+        }
     }
 }
@@ -10,8 +10,9 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/3.2/ref/settings/
 """
 
+import json
 from pathlib import Path
-from decouple import config
+from decouple import Csv, config
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -143,6 +144,10 @@ USE_L10N = True
 STATIC_URL = '/static/'
 STATIC_ROOT = BASE_DIR / 'staticfiles'
 
+# Uploaded files (recipient imports are stored here until their background job finishes)
+MEDIA_URL = '/media/'
+MEDIA_ROOT = BASE_DIR / 'media'
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/3.2/ref/settings/#default-auto-field
 
@@ -163,12 +168,24 @@ CELERY_ENABLE_UTC = False  # Use IST timezone, not UTC
 CELERY_TASK_ACKS_LATE = True
 # 1 = worker takes tasks one-by-one (best to avoid uneven load).
 CELERY_WORKER_PREFETCH_MULTIPLIER = int(config("CELERY_WORKER_PREFETCH_MULTIPLIER", default=1))
+# Workers listening on several queues (-Q senders.high,senders.normal,...) always take
+# from the first non-empty one, instead of kombu's default round-robin between them
+CELERY_BROKER_TRANSPORT_OPTIONS = {"queue_order_strategy": "priority"}
 CELERY_TASK_ROUTES = {
+    # send_batch is normally enqueued onto senders.high / senders.normal / senders.low
+    # by the dispatcher (see campaigns.scheduler); "senders" stays as the fallback
     "campaigns.tasks.send_batch": {"queue": "senders"},
     "campaigns.tasks.start_campaign_send": {"queue": "scheduler"},
+    "campaigns.tasks.dispatch_campaign_batches": {"queue": "scheduler"},
     "campaigns.tasks.check_scheduled_campaigns": {"queue": "scheduler"},
     "campaigns.tasks.finalize_campaign": {"queue": "scheduler"},
-    "campaigns.tasks.send_campaign_report": {"queue": "scheduler"}
+    "campaigns.tasks.send_campaign_report": {"queue": "scheduler"},
+    "campaigns.tasks.cleanup_import_staging_tables": {"queue": "scheduler"},
+    "campaigns.tasks.refresh_segments": {"queue": "scheduler"},
+    "campaigns.tasks.flush_unsubscribes": {"queue": "scheduler"},
+    "campaigns.tasks.flush_engagement_events": {"queue": "scheduler"},
+    # recipient uploads run on their own worker (solo pool: the importer forks its own processes)
+    "campaigns.tasks.run_import_job": {"queue": "imports"}
 }
 
 # Site admin email (report recipient)
@@ -181,6 +198,84 @@ SENDGRID_FROM_NAME = config("SENDGRID_FROM_NAME", default="Campaign Mailer")
 # Rate limiting: SendGrid allows 600/sec on Pro plan, but we use conservative limits
 SENDGRID_RATE_LIMIT_PER_SEC = config("SENDGRID_RATE_LIMIT_PER_SEC", cast=int, default=100)
 
+# Per-recipient-domain caps shared by all sender workers (see campaigns/throttle.py)
+# rate = sends/second, concurrency = simultaneous sends. Unlisted domains are not throttled.
+DOMAIN_THROTTLE_LIMITS = config("DOMAIN_THROTTLE_LIMITS", cast=json.loads, default=json.dumps({
+    "gmail.com": {"rate": 50, "concurrency": 8},
+    "googlemail.com": {"rate": 20, "concurrency": 4},
+    "outlook.com": {"rate": 30, "concurrency": 4},
+    "hotmail.com": {"rate": 30, "concurrency": 4},
+    "yahoo.com": {"rate": 20, "concurrency": 4},
+}))
+# Seconds a sender waits for a domain slot before deferring that domain's recipients
+DOMAIN_THROTTLE_MAX_WAIT = config("DOMAIN_THROTTLE_MAX_WAIT", cast=float, default=0.5)
+
+# Suppression list Bloom filter kept by each sender process (see campaigns/suppression.py)
+SUPPRESSION_REFRESH_SECONDS = config("SUPPRESSION_REFRESH_SECONDS", cast=int, default=60)    # incremental top-up
+SUPPRESSION_REBUILD_SECONDS = config("SUPPRESSION_REBUILD_SECONDS", cast=int, default=3600)  # full rebuild (drops deletions)
+SUPPRESSION_BLOOM_ERROR_RATE = config("SUPPRESSION_BLOOM_ERROR_RATE", cast=float, default=0.001)
+
+# Segment membership bitmaps (see campaigns/segments.py): incremental top-up from
+# Recipient.updated_on, re-reading this much overlap, and a periodic full rebuild
+SEGMENT_REFRESH_SECONDS = config("SEGMENT_REFRESH_SECONDS", cast=int, default=60)
+SEGMENT_REFRESH_OVERLAP_SECONDS = config("SEGMENT_REFRESH_OVERLAP_SECONDS", cast=int, default=900)
+SEGMENT_REBUILD_SECONDS = config("SEGMENT_REBUILD_SECONDS", cast=int, default=3600)
+
+# Recipient upload pipeline (see campaigns/importer_v2.py):
+# "parallel" = temp CSV + parallel COPY workers, "stream" = single streaming COPY, no temp files
+RECIPIENT_IMPORT_MODE = config("RECIPIENT_IMPORT_MODE", default="parallel")
+# importer_v1: skip batch rows already in the table via a Bloom filter of existing emails
+# (fewer conflicting inserts when re-uploading mostly known lists; ~1.2 MB per 1M recipients)
+RECIPIENT_IMPORT_BLOOM_PREFILTER = config("RECIPIENT_IMPORT_BLOOM_PREFILTER", cast=bool, default=False)
+# Chunked uploads (see campaigns/uploads.py): files at least this big are sent from the
+# browser in resumable chunks; an import reading a still-arriving upload gives up after
+# this many seconds without new data
+CHUNKED_UPLOAD_THRESHOLD = config("CHUNKED_UPLOAD_THRESHOLD", cast=int, default=20 * 1024 * 1024)
+CHUNKED_UPLOAD_CHUNK_BYTES = config("CHUNKED_UPLOAD_CHUNK_BYTES", cast=int, default=8 * 1024 * 1024)
+CHUNKED_UPLOAD_STALL_SECONDS = config("CHUNKED_UPLOAD_STALL_SECONDS", cast=int, default=900)
+# a streaming import holds one transaction while chunks arrive; past this it imports at completion instead
+CHUNKED_UPLOAD_STREAM_MAX_SECONDS = config("CHUNKED_UPLOAD_STREAM_MAX_SECONDS", cast=int, default=1800)
+
+# Prometheus (see campaigns/metrics.py): each Celery worker serves its metrics on this
+# port (0 = off); set PROMETHEUS_MULTIPROC_DIR in the environment so prefork children
+# are included. The web process serves its own at /metrics, only to clients in
+# METRICS_ALLOWED_NETWORKS (CIDRs, comma separated) or sending
+# "Authorization: Bearer <METRICS_BEARER_TOKEN>"; both empty = nobody
+METRICS_WORKER_PORT = config("METRICS_WORKER_PORT", cast=int, default=9808)
+METRICS_ALLOWED_NETWORKS = config("METRICS_ALLOWED_NETWORKS", cast=Csv(), default="")
+METRICS_BEARER_TOKEN = config("METRICS_BEARER_TOKEN", default="")
+
+# Tracing (see campaigns/tracing.py, needs opentelemetry-sdk): "none", "otlp" (to
+# OTEL_EXPORTER_OTLP_ENDPOINT, needs opentelemetry-exporter-otlp-proto-http) or "file"
+TRACING_EXPORTER = config("TRACING_EXPORTER", default="none")
+TRACING_FILE = config("TRACING_FILE", default=str(BASE_DIR / "logs" / "traces.jsonl"))
+TRACING_SERVICE_NAME = config("TRACING_SERVICE_NAME", default="campaign-mailer")
+
+# On-demand sampling profiler (see campaigns/profiling.py): collapsed stacks per worker process
+PROFILE_DIR = config("PROFILE_DIR", default=str(BASE_DIR / "logs" / "profiles"))
+PROFILE_INTERVAL_MS = config("PROFILE_INTERVAL_MS", cast=float, default=5)
+PROFILE_CLOCK = config("PROFILE_CLOCK", default="cpu")                                   # "cpu" or "wall"
+PROFILE_FLAG_REFRESH_SECONDS = config("PROFILE_FLAG_REFRESH_SECONDS", cast=int, default=5)  # re-read requested targets
+
+# Public base URL of the site (e.g. https://mail.yourdomain.com), used in links inside emails.
+# No default: when empty, emails carry no unsubscribe or tracking links
+SITE_URL = config("SITE_URL", default="")
+# One-click unsubscribe (see campaigns/unsubscribe.py): links are signed with this key and
+# point at SITE_URL; requests are buffered and applied every UNSUBSCRIBE_FLUSH_SECONDS
+UNSUBSCRIBE_SECRET_KEY = config("UNSUBSCRIBE_SECRET_KEY", default=SECRET_KEY)
+# Open/click tracking (see campaigns/tracking.py), opt-in: links and pixel signed with this key
+# (empty = no tracking, as is an empty SITE_URL); events are buffered and stored every TRACKING_FLUSH_SECONDS
+TRACKING_SECRET_KEY = config("TRACKING_SECRET_KEY", default="")
+
+# Live campaign progress (see campaigns/progress.py): staff sessions, or ?token= signed with
+# this key (empty = staff only). The SSE stream polls the cache every INTERVAL seconds and
+# closes after SECONDS (below the gunicorn timeout), the browser reconnects; each open stream
+# holds a gthread thread, so a web process serves at most MAX_PER_PROCESS of them (503 beyond)
+PROGRESS_SECRET_KEY = config("PROGRESS_SECRET_KEY", default=SECRET_KEY)
+PROGRESS_STREAM_INTERVAL = config("PROGRESS_STREAM_INTERVAL", cast=float, default=2)
+PROGRESS_STREAM_SECONDS = config("PROGRESS_STREAM_SECONDS", cast=int, default=60)
+PROGRESS_STREAM_MAX_PER_PROCESS = config("PROGRESS_STREAM_MAX_PER_PROCESS", cast=int, default=4)
+
 # Email SMTP fallback (used if SendGrid fails)
 EMAIL_BACKEND = "django.core.mail.backends.smtp.EmailBackend"
 EMAIL_HOST = config("EMAIL_HOST", default="smtp.example.com")
@@ -307,6 +402,17 @@ LOGGING = {
             'level': 'INFO',
             'propagate': False,
         },
+        # one line per task execution: task=... queries=... db_ms=... wall_ms=... (also as record fields)
+        'campaigns.instrumentation': {
+            'handlers': ['console', 'file_celery'],
+            'level': 'INFO',
+            'propagate': False,
+        },
+        'campaigns.profiling': {
+            'handlers': ['console', 'file_celery'],
+            'level': 'INFO',
+            'propagate': False,
+        },
     },
     'root': {
         'handlers': ['console', 'file_django', 'file_error'],
@@ -16,6 +16,16 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import path
 
+from campaigns.views import (
+    campaign_progress_stream, campaign_progress_view, click_view, metrics_view, open_pixel_view, unsubscribe_view,
+)
+
 urlpatterns = [
     path('admin/', admin.site.urls),
+    path('metrics', metrics_view, name='metrics'),
+    path('campaigns/<int:campaign_id>/progress', campaign_progress_view, name='campaign-progress'),
+    path('campaigns/<int:campaign_id>/progress/stream', campaign_progress_stream, name='campaign-progress-stream'),
+    path('unsubscribe/<str:token>', unsubscribe_view, name='unsubscribe'),
+    path('t/o/<str:token>.gif', open_pixel_view, name='track-open'),
+    path('t/c/<str:token>', click_view, name='track-click'),
 ]